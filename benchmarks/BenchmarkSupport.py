@@ -0,0 +1,308 @@
+#
+# Shared code for the benchmark scripts in this directory.
+#
+# The benchmarks run in a regular python interpreter with numpy installed, not
+# inside blender, e.g. `python3 benchmarks/VertexDecoding.py`. They load the
+# modules of the add-on that do not depend on bpy directly from the pes-fmdl
+# directory, without running its __init__.py.
+#
+import importlib
+import math
+import os
+import random
+import struct
+import sys
+import time
+import tracemalloc
+import types
+import zlib
+
+import numpy
+
+ADDON_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pes-fmdl')
+ADDON_PACKAGE = 'pes_fmdl'
+
+def loadAddonModule(name):
+	if ADDON_PACKAGE not in sys.modules:
+		package = types.ModuleType(ADDON_PACKAGE)
+		package.__path__ = [ADDON_DIRECTORY]
+		sys.modules[ADDON_PACKAGE] = package
+	return importlib.import_module(ADDON_PACKAGE + '.' + name)
+
+FmdlFile = loadAddonModule('FmdlFile')
+PesSkeletonData = loadAddonModule('PesSkeletonData')
+
+#
+# Returns the shortest wall clock time of $repeat calls to function, and the
+# return value of the last call.
+#
+def bestTime(function, repeat = 3):
+	bestDuration = None
+	for i in range(repeat):
+		start = time.perf_counter()
+		result = function()
+		duration = time.perf_counter() - start
+		if bestDuration is None or duration < bestDuration:
+			bestDuration = duration
+	return (bestDuration, result)
+
+#
+# Returns the peak memory allocated while calling function. Only memory
+# allocated during the call is traced, so memory held before does not count.
+#
+def peakMemory(function):
+	tracemalloc.start()
+	try:
+		function()
+		(current, peak) = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	return peak
+
+def makeBones(boneCount):
+	if boneCount > len(PesSkeletonData.bones):
+		raise ValueError("PesSkeletonData only contains %d bones" % len(PesSkeletonData.bones))
+	
+	bones = []
+	bonesByName = {}
+	for name in list(PesSkeletonData.bones.keys())[:boneCount]:
+		pesBone = PesSkeletonData.bones[name]
+		bone = FmdlFile.FmdlFile.Bone()
+		bone.name = name
+		if pesBone.sklParent in bonesByName:
+			bone.parent = bonesByName[pesBone.sklParent]
+			bone.parent.children.append(bone)
+		(x, y, z) = pesBone.startPosition
+		bone.globalPosition = FmdlFile.FmdlFile.Vector4(x, y, z, 1.0)
+		bone.localPosition = FmdlFile.FmdlFile.Vector4(0.0, 0.0, 0.0, 0.0)
+		bone.boundingBox = FmdlFile.FmdlFile.BoundingBox(
+			FmdlFile.FmdlFile.Vector4(x, y, z, 1.0),
+			FmdlFile.FmdlFile.Vector4(x, y, z, 1.0),
+		)
+		bones.append(bone)
+		bonesByName[name] = bone
+	return bones
+
+#
+# Builds a synthetic skinned mesh: a triangulated grid spanning the bones in
+# bones, with each grid point weighted to its three nearest bones. As in
+# meshes exported from blender, a quarter of the grid points are split into
+# two vertices with different normals and UVs sharing a position object.
+# Optionally, looseVertexCount vertices not used by any face are added.
+#
+def makeSkinnedGridMesh(faceCount, bones, looseVertexCount = 0, seed = 0):
+	F = FmdlFile.FmdlFile
+	generator = random.Random(seed)
+	
+	vertexFields = F.VertexFields()
+	vertexFields.hasNormal = True
+	vertexFields.hasTangent = True
+	vertexFields.hasColor = True
+	vertexFields.hasBoneMapping = len(bones) > 0
+	vertexFields.uvCount = 2
+	vertexFields.uvEqualities = { 0: [], 1: [] }
+	
+	columns = max(2, int(math.sqrt(faceCount / 2)) + 1)
+	rows = max(2, int(math.ceil(faceCount / (2 * (columns - 1)))) + 1)
+	
+	bonePositions = numpy.array([(bone.globalPosition.x, bone.globalPosition.y, bone.globalPosition.z) for bone in bones] or [(0.0, 0.0, 0.0)])
+	(minX, minY) = bonePositions[:, 0:2].min(axis = 0) - 0.05
+	(maxX, maxY) = bonePositions[:, 0:2].max(axis = 0) + 0.05
+	gridX = numpy.repeat(numpy.linspace(minX, maxX, columns), rows)
+	gridY = numpy.tile(numpy.linspace(minY, maxY, rows), columns)
+	gridPositions = numpy.stack([gridX, gridY, numpy.zeros(len(gridX))], axis = 1)
+	
+	if len(bones) > 0:
+		nearestBones = numpy.empty((len(gridPositions), min(3, len(bones))), dtype = numpy.int64)
+		for start in range(0, len(gridPositions), 4096):
+			distances = numpy.linalg.norm(gridPositions[start : start + 4096, None, :] - bonePositions[None, :, :], axis = 2)
+			nearestBones[start : start + 4096] = numpy.argsort(distances, axis = 1)[:, 0:nearestBones.shape[1]]
+	
+	def makeVertex(position, boneMapping):
+		vertex = F.Vertex()
+		vertex.position = position
+		vertex.boneMapping = boneMapping
+		vertex.normal = F.Vector4(generator.uniform(-1, 1), generator.uniform(-1, 1), generator.uniform(-1, 1), 1.0)
+		vertex.tangent = F.Vector4(generator.uniform(-1, 1), generator.uniform(-1, 1), generator.uniform(-1, 1), 1.0)
+		# IO.exportMeshGeometry() appends 1.0 to the RGBA blender loop color.
+		vertex.color = [generator.random(), generator.random(), generator.random(), 1.0, 1.0]
+		vertex.uv = [F.Vector2(generator.random(), generator.random()) for i in range(vertexFields.uvCount)]
+		return vertex
+	
+	vertices = []
+	gridVertices = []
+	for i in range(len(gridPositions)):
+		(x, y, z) = gridPositions[i]
+		position = F.Vector3(float(x), float(y), float(z))
+		if len(bones) > 0:
+			weights = [0.6, 0.3, 0.1][0:nearestBones.shape[1]]
+			boneMapping = dict((bones[nearestBones[i][j]], weights[j]) for j in range(len(weights)))
+		else:
+			boneMapping = None
+		loops = [makeVertex(position, boneMapping) for j in range(2 if generator.random() < 0.25 else 1)]
+		vertices += loops
+		gridVertices.append(loops)
+	
+	faces = []
+	for column in range(columns - 1):
+		for row in range(rows - 1):
+			if len(faces) >= faceCount:
+				break
+			a = gridVertices[column * rows + row]
+			b = gridVertices[(column + 1) * rows + row]
+			c = gridVertices[(column + 1) * rows + row + 1]
+			d = gridVertices[column * rows + row + 1]
+			faces.append(F.Face(a[0], b[-1], c[0]))
+			if len(faces) < faceCount:
+				faces.append(F.Face(a[-1], c[-1], d[0]))
+	
+	for i in range(looseVertexCount):
+		bone = bones[generator.randrange(len(bones))] if len(bones) > 0 else None
+		position = F.Vector3(generator.uniform(minX, maxX), generator.uniform(minY, maxY), 0.1)
+		vertices.append(makeVertex(position, { bone: 1.0 } if bone is not None else None))
+	
+	mesh = F.Mesh()
+	mesh.vertices = vertices
+	mesh.faces = faces
+	mesh.boneGroup = F.BoneGroup()
+	mesh.boneGroup.bones = bones[:]
+	mesh.alphaFlags = 0
+	mesh.shadowFlags = 0
+	mesh.vertexFields = vertexFields
+	return mesh
+
+def makeModel(meshes, bones):
+	F = FmdlFile.FmdlFile
+	
+	texture = F.Texture()
+	texture.filename = 'benchmark.ftex'
+	texture.directory = '/Assets/benchmark/'
+	materialInstance = F.MaterialInstance()
+	materialInstance.name = 'benchmark'
+	materialInstance.shader = 'fox3ddf_blin'
+	materialInstance.technique = 'fox3DDF_Blin'
+	materialInstance.textures = [('Base_Tex_SRGB', texture)]
+	
+	rootMeshGroup = F.MeshGroup()
+	rootMeshGroup.name = ''
+	rootMeshGroup.visible = True
+	rootMeshGroup.boundingBox = F.BoundingBox(F.Vector4(-1.0, 0.0, -1.0, 1.0), F.Vector4(1.0, 2.0, 1.0, 1.0))
+	meshGroups = [rootMeshGroup]
+	for i in range(len(meshes)):
+		meshes[i].materialInstance = materialInstance
+		meshGroup = F.MeshGroup()
+		meshGroup.name = 'mesh %d' % i
+		meshGroup.visible = True
+		meshGroup.parent = rootMeshGroup
+		meshGroup.boundingBox = rootMeshGroup.boundingBox
+		meshGroup.meshes = [meshes[i]]
+		rootMeshGroup.children.append(meshGroup)
+		meshGroups.append(meshGroup)
+	
+	fmdl = F()
+	fmdl.bones = bones
+	fmdl.materialInstances = [materialInstance]
+	fmdl.meshes = meshes
+	fmdl.meshGroups = meshGroups
+	return fmdl
+
+#
+# A synthetic kit: a shirt large enough to be split, shorts, socks and some
+# smaller meshes, where the shirt, shorts and socks have antiblur meshes, as
+# kits exported from blender usually do.
+#
+KIT_MESHES = [
+	# (name, faces, bones, antiblur)
+	('shirt', 40000, 50, True),
+	('shorts', 16000, 24, True),
+	('socks', 8000, 12, True),
+	('collar', 3000, 8, False),
+	('badge', 1000, 4, False),
+]
+
+def makeKit():
+	bones = makeBones(max(boneCount for (name, faceCount, boneCount, antiBlur) in KIT_MESHES))
+	meshes = []
+	for (seed, (name, faceCount, boneCount, antiBlur)) in enumerate(KIT_MESHES):
+		mesh = makeSkinnedGridMesh(faceCount, bones[0:boneCount], seed = seed)
+		if antiBlur:
+			mesh.extensionHeaders.add('Has-Antiblur-Meshes')
+		meshes.append(mesh)
+	fmdl = makeModel(meshes, bones)
+	for (meshGroup, (name, faceCount, boneCount, antiBlur)) in zip(fmdl.meshGroups[1:], KIT_MESHES):
+		meshGroup.name = name
+	return fmdl
+
+FTEX_STORAGE_RAW = 'raw'
+FTEX_STORAGE_COMPRESSED = 'compressed'
+FTEX_STORAGE_CHUNKED = 'chunked'
+FTEX_CHUNK_SIZE = 1 << 14
+
+#
+# The size of a single frame of a texture in ftex pixel format 0 (RGBA) or 4
+# (DXT5), the formats makeFtex() supports.
+#
+def ftexFrameSize(pixelFormat, width, height):
+	if pixelFormat == 0:
+		return width * height * 4
+	return max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * 16
+
+#
+# Writes a synthetic ftex file with a full mipmap chain, or six of them for a
+# cube map. Frame data is random, but compresses to about half its size, like
+# real textures do. Frames are stored uncompressed, as a single zlib stream,
+# or in zlib compressed chunks of FTEX_CHUNK_SIZE bytes, where chunks that
+# don't compress are stored uncompressed.
+#
+# Returns the list of frames, in the order they appear in the DDS file.
+#
+def makeFtex(filename, width, height, pixelFormat = 4, storage = FTEX_STORAGE_CHUNKED, cubeMap = False, seed = 0):
+	generator = numpy.random.default_rng(seed)
+	mipmapCount = int(math.log2(max(width, height))) + 1
+	imageCount = 6 if cubeMap else 1
+	frames = []
+	for image in range(imageCount):
+		for mipmap in range(mipmapCount):
+			size = ftexFrameSize(pixelFormat, max(1, width >> mipmap), max(1, height >> mipmap))
+			frames.append(generator.integers(0, 16, size, dtype = numpy.uint8).tobytes())
+	
+	headerSize = 64 + 16 * len(frames)
+	mipmapHeaders = []
+	frameData = []
+	offset = headerSize
+	for (index, frame) in enumerate(frames):
+		if storage == FTEX_STORAGE_RAW:
+			data = frame
+			(compressedSize, chunkCount) = (0, 0)
+		elif storage == FTEX_STORAGE_COMPRESSED:
+			data = zlib.compress(frame)
+			(compressedSize, chunkCount) = (len(data), 0)
+		else:
+			chunks = [frame[position : position + FTEX_CHUNK_SIZE] for position in range(0, len(frame), FTEX_CHUNK_SIZE)]
+			chunkTable = []
+			chunkData = []
+			chunkOffset = 8 * len(chunks)
+			for chunk in chunks:
+				compressedChunk = zlib.compress(chunk)
+				if len(compressedChunk) < len(chunk):
+					chunkTable.append(struct.pack('< HH I', len(compressedChunk), len(chunk), chunkOffset))
+					chunkData.append(compressedChunk)
+				else:
+					chunkTable.append(struct.pack('< HH I', len(chunk), len(chunk), chunkOffset | (1 << 31)))
+					chunkData.append(chunk)
+				chunkOffset += len(chunkData[-1])
+			data = b''.join(chunkTable + chunkData)
+			(compressedSize, chunkCount) = (len(data), len(chunks))
+		mipmapHeaders.append(struct.pack('< I I I BB H', offset, len(frame), compressedSize, index % mipmapCount, 0, chunkCount))
+		frameData.append(data)
+		offset += len(data)
+	
+	header = struct.pack('< 4s f HHHH  BB HIII  BB 14x  8s 8s',
+		b'FTEX', 2.03, pixelFormat, height, width, 1, mipmapCount, 0,
+		0, 0, 0, 4 if cubeMap else 0, 0, 0, bytes(8), bytes(8),
+	)
+	with open(filename, 'wb') as stream:
+		stream.write(header)
+		for data in mipmapHeaders + frameData:
+			stream.write(data)
+	return frames
@@ -0,0 +1,97 @@
+#
+# Runs the export extensions over a synthetic kit model as IO.exportFmdl()
+# does, using FmdlExportPipeline, and as it used to, by chaining the
+# encodeFmdl*() functions of the extension modules, each of which builds a
+# new FmdlFile. Checks that both write exactly the same file, and compares
+# their time and peak memory use.
+#
+# Also runs the pipeline over a kit read with readFile(columnar = True), as
+# the import operator reads models, and checks that it writes exactly the
+# same file as for the kit read as regular meshes.
+#
+import os
+import tempfile
+
+import BenchmarkSupport
+from BenchmarkSupport import FmdlFile
+
+FmdlAntiBlur = BenchmarkSupport.loadAddonModule('FmdlAntiBlur')
+FmdlExportPipeline = BenchmarkSupport.loadAddonModule('FmdlExportPipeline')
+FmdlMeshSplitting = BenchmarkSupport.loadAddonModule('FmdlMeshSplitting')
+FmdlSplitVertexEncoding = BenchmarkSupport.loadAddonModule('FmdlSplitVertexEncoding')
+FmdlVertexCache = BenchmarkSupport.loadAddonModule('FmdlVertexCache')
+
+def exportChained(fmdl, optimizeVertexCache):
+	fmdl = FmdlAntiBlur.encodeFmdlAntiBlur(fmdl)
+	fmdl = FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservation(fmdl)
+	fmdl = FmdlMeshSplitting.encodeFmdlSplitMeshes(fmdl)
+	if optimizeVertexCache:
+		fmdl = FmdlVertexCache.optimizeFmdlVertexCache(fmdl)
+	return fmdl
+
+def exportPipeline(fmdl, optimizeVertexCache):
+	stages = FmdlExportPipeline.exportStages(True, True, True, False)
+	if optimizeVertexCache:
+		#
+		# The regular vertex cache optimization stage also measures
+		# statistics, which the chained export does not compute.
+		#
+		stages.append(('vertex-cache-optimization', (lambda fmdl, sourceMeshes: FmdlVertexCache.optimizeFmdlVertexCacheInPlace(fmdl, sourceMeshes))))
+	(durations, reports) = FmdlExportPipeline.runExportStages(fmdl, stages)
+	return (fmdl, durations)
+
+#
+# Runs export on a new kit model $repeat times, and returns the shortest time,
+# the peak memory allocated during a separate run, and the last result.
+#
+def measure(export, repeat = 3):
+	bestDuration = None
+	for i in range(repeat):
+		fmdl = BenchmarkSupport.makeKit()
+		(duration, result) = BenchmarkSupport.bestTime(lambda: export(fmdl), 1)
+		if bestDuration is None or duration < bestDuration:
+			bestDuration = duration
+	
+	fmdl = BenchmarkSupport.makeKit()
+	peak = BenchmarkSupport.peakMemory(lambda: export(fmdl))
+	return (bestDuration, peak, result)
+
+def fileContents(fmdl, directory):
+	filename = os.path.join(directory, 'kit.fmdl')
+	fmdl.writeFile(filename)
+	with open(filename, 'rb') as file:
+		return file.read()
+
+def checkColumnarExport(directory):
+	filename = os.path.join(directory, 'imported.fmdl')
+	(fmdl, durations) = exportPipeline(BenchmarkSupport.makeKit(), False)
+	fmdl.writeFile(filename)
+	
+	contents = []
+	for columnar in [False, True]:
+		fmdl = FmdlFile.FmdlFile()
+		fmdl.readFile(filename, columnar = columnar)
+		(fmdl, durations) = exportPipeline(fmdl, True)
+		contents.append(fileContents(fmdl, directory))
+	if contents[0] != contents[1]:
+		raise AssertionError("pipeline export of columnar meshes writes a different file than of regular meshes")
+
+def main():
+	print("%-28s %7s %9s %9s %9s" % ("export", "meshes", "time (s)", "peak (MB)", "speedup"))
+	with tempfile.TemporaryDirectory() as directory:
+		for optimizeVertexCache in [False, True]:
+			suffix = ", vertex cache" if optimizeVertexCache else ""
+			(chainedTime, chainedPeak, chainedFmdl) = measure(lambda fmdl: exportChained(fmdl, optimizeVertexCache))
+			(pipelineTime, pipelinePeak, (pipelineFmdl, durations)) = measure(lambda fmdl: exportPipeline(fmdl, optimizeVertexCache))
+			if fileContents(chainedFmdl, directory) != fileContents(pipelineFmdl, directory):
+				raise AssertionError("pipeline export%s writes a different file than chained export" % suffix)
+			
+			print("%-28s %7d %9.3f %9.1f %9s" % ("chained" + suffix, len(chainedFmdl.meshes), chainedTime, chainedPeak / 1e6, ""))
+			print("%-28s %7d %9.3f %9.1f %8.1fx" % ("pipeline" + suffix, len(pipelineFmdl.meshes), pipelineTime, pipelinePeak / 1e6, chainedTime / pipelineTime))
+			for (name, duration) in durations:
+				print("  %-26s %7s %9.3f" % (name, "", duration))
+		checkColumnarExport(directory)
+	print("identical files written")
+
+if __name__ == '__main__':
+	main()
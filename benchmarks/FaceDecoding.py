@@ -0,0 +1,55 @@
+#
+# Compares the original per-triangle face decoder with FmdlFile.parseFaces()
+# and FmdlFile.parseFaceIndexArray() on synthetic meshes.
+#
+import os
+import struct
+import tempfile
+
+import BenchmarkSupport
+from BenchmarkSupport import FmdlFile
+
+#
+# The face decoder FmdlFile.parseFaces() used before it was vectorized,
+# without its validity check.
+#
+def parseFacesPerTriangle(fmdl, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount, vertices):
+	vertexBuffer = fmdl.segment1Blocks[2]
+	faces = []
+	for faceVertexIndex in range(firstFaceVertexIndex, firstFaceVertexIndex + faceVertexCount, 3):
+		position = faceVertexIndex * 2 + vertexBufferOffset
+		(index1, index2, index3) = struct.unpack_from('< HHH', vertexBuffer, position)
+		faces.append(FmdlFile.FmdlFile.Face(vertices[index1], vertices[index2], vertices[index3]))
+	return faces
+
+def main():
+	bones = BenchmarkSupport.makeBones(30)
+	print("%8s %16s %12s %12s %8s %8s" % ("faces", "per triangle (s)", "objects (s)", "array (s)", "objects", "array"))
+	for faceCount in [2000, 20000]:
+		mesh = BenchmarkSupport.makeSkinnedGridMesh(faceCount, bones)
+		fmdl = BenchmarkSupport.makeModel([mesh], bones)
+		
+		(fileDescriptor, filename) = tempfile.mkstemp(suffix = '.fmdl')
+		os.close(fileDescriptor)
+		try:
+			fmdl.writeFile(filename)
+			container = FmdlFile.FmdlContainer()
+			container.readFile(filename)
+		finally:
+			os.remove(filename)
+		
+		bufferOffsets = FmdlFile.FmdlFile.parseBufferOffsets(container)
+		faceVertexCount = len(mesh.faces) * 3
+		vertices = mesh.vertices
+		
+		(legacyTime, legacy) = BenchmarkSupport.bestTime(lambda: parseFacesPerTriangle(container, bufferOffsets[2], 0, faceVertexCount, vertices))
+		(facesTime, faces) = BenchmarkSupport.bestTime(lambda: FmdlFile.FmdlFile.parseFaces(container, bufferOffsets[2], 0, faceVertexCount, vertices))
+		(arrayTime, faceIndices) = BenchmarkSupport.bestTime(lambda: FmdlFile.FmdlFile.parseFaceIndexArray(container, bufferOffsets[2], 0, faceVertexCount, len(vertices)))
+		for (a, b) in zip(legacy, faces):
+			assert a.vertices == b.vertices
+		assert len(legacy) == len(faces) == len(faceIndices)
+		
+		print("%8d %16.4f %12.4f %12.6f %7.1fx %7.1fx" % (len(faces), legacyTime, facesTime, arrayTime, legacyTime / facesTime, legacyTime / arrayTime))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,71 @@
+#
+# Checks that FmdlFile.parseFloat16Array() and FmdlFile.encodeFloat16Array()
+# produce exactly the same bits as the scalar parseFloat16() and
+# encodeFloat16(), over all 65536 half float patterns and a large random
+# sample of doubles, and compares their speed.
+#
+import math
+import random
+import struct
+
+import numpy
+
+import BenchmarkSupport
+from BenchmarkSupport import FmdlFile
+
+def sameFloat(a, b):
+	if math.isnan(a) or math.isnan(b):
+		return math.isnan(a) and math.isnan(b)
+	return a == b and math.copysign(1.0, a) == math.copysign(1.0, b)
+
+def randomFloats(count, seed = 0):
+	generator = random.Random(seed)
+	specialValues = [
+		0.0, -0.0, float('inf'), float('-inf'), float('nan'),
+		5e-324, -5e-324, 2.0 ** -14, 2.0 ** -24, 2.0 ** -25,
+		65504.0, 65519.99, 65520.0, 65536.0, 1e308,
+	]
+	values = []
+	for i in range(count):
+		kind = generator.random()
+		if kind < 0.5:
+			value = generator.uniform(-2.0, 2.0)
+		elif kind < 0.8:
+			value = math.ldexp(generator.random(), generator.randint(-40, 20)) * generator.choice([-1, 1])
+		elif kind < 0.9:
+			value = struct.unpack('< d', struct.pack('< Q', generator.getrandbits(64)))[0]
+		elif kind < 0.95:
+			value = generator.uniform(65000.0, 66000.0) * generator.choice([-1, 1])
+		else:
+			value = generator.choice(specialValues)
+		values.append(value)
+	return values
+
+def main():
+	patterns = numpy.arange(65536, dtype = numpy.uint16)
+	parsed = FmdlFile.FmdlFile.parseFloat16Array(patterns)
+	for pattern in range(65536):
+		if not sameFloat(parsed[pattern], FmdlFile.FmdlFile.parseFloat16(pattern)):
+			raise AssertionError("parseFloat16Array(0x%04x) differs" % pattern)
+	expected = numpy.array([FmdlFile.FmdlFile.encodeFloat16(value) for value in parsed.tolist()], dtype = numpy.uint16)
+	if not (FmdlFile.FmdlFile.encodeFloat16Array(parsed) == expected).all():
+		raise AssertionError("encodeFloat16Array differs on decoded half floats")
+	print("all 65536 half float patterns match")
+
+	values = randomFloats(1000000)
+	(scalarTime, expected) = BenchmarkSupport.bestTime(lambda: [FmdlFile.FmdlFile.encodeFloat16(value) for value in values])
+	(arrayTime, encoded) = BenchmarkSupport.bestTime(lambda: FmdlFile.FmdlFile.encodeFloat16Array(values))
+	mismatches = numpy.flatnonzero(encoded != numpy.array(expected, dtype = numpy.uint16))
+	if len(mismatches) > 0:
+		raise AssertionError("encodeFloat16Array(%r) differs" % values[mismatches[0]])
+	print("%d random floats match" % len(values))
+
+	(scalarParseTime, _) = BenchmarkSupport.bestTime(lambda: [FmdlFile.FmdlFile.parseFloat16(int16) for int16 in expected])
+	(arrayParseTime, _) = BenchmarkSupport.bestTime(lambda: FmdlFile.FmdlFile.parseFloat16Array(encoded))
+
+	print("%8s %12s %12s %8s" % ("", "scalar (s)", "numpy (s)", "speedup"))
+	print("%8s %12.3f %12.3f %7.1fx" % ("encode", scalarTime, arrayTime, scalarTime / arrayTime))
+	print("%8s %12.3f %12.3f %7.1fx" % ("parse", scalarParseTime, arrayParseTime, scalarParseTime / arrayParseTime))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,130 @@
+#
+# Loads the textures of a team's kits the way importing each player model
+# does, once converting every texture with Ftex.ftexToDdsBuffer() and once
+# through an FtexCache.FtexCache, which converts each texture only the first
+# time it is loaded.
+#
+# Checks that cached DDS data is identical to converted DDS data, that a
+# changed ftex file is converted again, and that the cache stays within its
+# size by removing the least recently used textures, and that clearing it
+# removes them all.
+#
+# Usage: python3 benchmarks/FtexCache.py [player count]
+#
+import os
+import sys
+import tempfile
+import time
+
+import BenchmarkSupport
+
+Ftex = BenchmarkSupport.loadAddonModule('Ftex')
+FtexCache = BenchmarkSupport.loadAddonModule('FtexCache')
+
+KIT_TEXTURES = [
+	('kit colour', 2048, 2048),
+	('kit normals', 2048, 2048),
+	('kit shading', 1024, 1024),
+	('numbers', 1024, 1024),
+	('name', 1024, 256),
+]
+
+def loadTextures(ftexFilenames, playerCount, cache):
+	for player in range(playerCount):
+		for ftexFilename in ftexFilenames:
+			if cache == None:
+				ddsData = Ftex.ftexToDdsBuffer(ftexFilename)
+			else:
+				ddsData = cache.ddsBuffer(ftexFilename)
+			if ddsData == None:
+				raise AssertionError("%s: conversion failed" % ftexFilename)
+
+def timed(function):
+	start = time.perf_counter()
+	function()
+	return time.perf_counter() - start
+
+def cacheEntries(cache):
+	return sorted(name for name in os.listdir(cache.directory) if name.endswith(FtexCache.CACHE_ENTRY_EXTENSION))
+
+def checkCache(directory, ftexFilenames):
+	cache = FtexCache.FtexCache(os.path.join(directory, 'check cache'), 1 << 40)
+	for ftexFilename in ftexFilenames:
+		if cache.ddsBuffer(ftexFilename) != Ftex.ftexToDdsBuffer(ftexFilename):
+			raise AssertionError("%s: cached DDS data differs from converted DDS data" % ftexFilename)
+		if cache.ddsBuffer(ftexFilename) != Ftex.ftexToDdsBuffer(ftexFilename):
+			raise AssertionError("%s: DDS data read from the cache differs from converted DDS data" % ftexFilename)
+	if len(cacheEntries(cache)) != len(ftexFilenames):
+		raise AssertionError("cache holds %d textures instead of %d" % (len(cacheEntries(cache)), len(ftexFilenames)))
+	
+	ftexFilename = os.path.join(directory, 'changed.ftex')
+	BenchmarkSupport.makeFtex(ftexFilename, 256, 256, seed = 1)
+	cache.ddsBuffer(ftexFilename)
+	BenchmarkSupport.makeFtex(ftexFilename, 256, 256, seed = 2)
+	status = os.stat(ftexFilename)
+	os.utime(ftexFilename, ns = (status.st_atime_ns, status.st_mtime_ns + 1000000000))
+	if cache.ddsBuffer(ftexFilename) != Ftex.ftexToDdsBuffer(ftexFilename):
+		raise AssertionError("changed texture is not converted again")
+
+def checkEviction(directory):
+	filenames = []
+	for index in range(4):
+		filename = os.path.join(directory, 'small %d.ftex' % index)
+		BenchmarkSupport.makeFtex(filename, 256, 256, seed = index)
+		filenames.append(filename)
+	entrySize = len(Ftex.ftexToDdsBuffer(filenames[0]))
+	cache = FtexCache.FtexCache(os.path.join(directory, 'eviction cache'), 3 * entrySize)
+	
+	# Entry modification times order the entries, so keep them apart.
+	for filename in filenames[:3]:
+		cache.ddsBuffer(filename)
+		time.sleep(0.05)
+	entries = cacheEntries(cache)
+	cache.ddsBuffer(filenames[0])
+	time.sleep(0.05)
+	cache.ddsBuffer(filenames[3])
+	
+	expected = sorted([cache.entryFilename(filenames[index]) for index in (0, 2, 3)])
+	remaining = [os.path.join(cache.directory, name) for name in cacheEntries(cache)]
+	if remaining != expected:
+		raise AssertionError("cache keeps %s instead of the 3 most recently used textures" % remaining)
+	if len(entries) != 3:
+		raise AssertionError("cache holds %d textures instead of 3" % len(entries))
+	
+	removedSize = cache.clear()
+	if removedSize != 3 * entrySize or len(cacheEntries(cache)) != 0:
+		raise AssertionError("clearing the cache removed %d bytes and left %d textures" % (removedSize, len(cacheEntries(cache))))
+
+def main():
+	if len(sys.argv) > 1:
+		playerCount = int(sys.argv[1])
+	else:
+		playerCount = 25
+	
+	with tempfile.TemporaryDirectory() as directory:
+		ftexFilenames = []
+		ddsSize = 0
+		for (seed, (name, width, height)) in enumerate(KIT_TEXTURES):
+			ftexFilename = os.path.join(directory, '%s.ftex' % name)
+			frames = BenchmarkSupport.makeFtex(ftexFilename, width, height, seed = seed)
+			ftexFilenames.append(ftexFilename)
+			ddsSize += sum(len(frame) for frame in frames)
+		print("%d player models sharing %d DXT5 textures, %.1f MB of image data" % (playerCount, len(ftexFilenames), ddsSize / 1e6))
+		
+		uncachedTime = timed(lambda: loadTextures(ftexFilenames, playerCount, None))
+		cache = FtexCache.FtexCache(os.path.join(directory, 'cache'), 1 << 30)
+		cachedTime = timed(lambda: loadTextures(ftexFilenames, playerCount, cache))
+		cache = FtexCache.FtexCache(cache.directory, cache.maximumSize)
+		warmTime = timed(lambda: loadTextures(ftexFilenames, playerCount, cache))
+		
+		print("%-22s %9s %8s" % ("textures", "time (s)", "speedup"))
+		print("%-22s %9.3f %8s" % ("converted every time", uncachedTime, ""))
+		print("%-22s %9.3f %7.1fx" % ("cache, first session", cachedTime, uncachedTime / cachedTime))
+		print("%-22s %9.3f %7.1fx" % ("cache, next session", warmTime, uncachedTime / warmTime))
+		
+		checkCache(directory, ftexFilenames)
+		checkEviction(directory)
+		print("cached textures identical, changed textures converted again, least recently used textures evicted, cache cleared")
+
+if __name__ == '__main__':
+	main()
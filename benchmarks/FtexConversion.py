@@ -0,0 +1,72 @@
+#
+# Converts large synthetic ftex textures to DDS with Ftex.ftexToDds(), and
+# reports the time taken and the peak memory allocated during conversion,
+# which should stay at the size of a chunk rather than of the texture.
+#
+# Also converts them in memory with Ftex.ftexToDdsBuffer(), as
+# blenderImageLoadFtex() does, and compares that with the round trip through
+# a temporary DDS file that blender used to load.
+#
+# Checks that the DDS files contain exactly the frames of the texture, that
+# compressed formats have the size of their first frame as linear size, and
+# that the in-memory DDS data is identical to the DDS file.
+#
+import os
+import struct
+import tempfile
+
+import BenchmarkSupport
+
+Ftex = BenchmarkSupport.loadAddonModule('Ftex')
+
+def readFile(filename):
+	with open(filename, 'rb') as stream:
+		return stream.read()
+
+def convertThroughFile(ftexFilename, ddsFilename):
+	if not Ftex.ftexToDds(ftexFilename, ddsFilename):
+		return None
+	data = readFile(ddsFilename)
+	os.remove(ddsFilename)
+	return data
+
+def checkDds(name, data, frames):
+	frameData = b''.join(frames)
+	if data[-len(frameData):] != frameData or len(data) - len(frameData) not in (128, 148):
+		raise AssertionError("%s: DDS file does not contain the frames of the texture" % name)
+	(flags, ) = struct.unpack_from('< I', data, 8)
+	(pitchOrLinearSize, ) = struct.unpack_from('< I', data, Ftex.DDS_PITCH_OR_LINEAR_SIZE_OFFSET)
+	if (flags & 0x80000) != 0 and pitchOrLinearSize != len(frames[0]):
+		raise AssertionError("%s: DDS linear size is %d instead of %d" % (name, pitchOrLinearSize, len(frames[0])))
+
+def main():
+	cases = [
+		# (name, width, height, pixel format, storage, cube map)
+		("DXT5 4096, chunked", 4096, 4096, 4, BenchmarkSupport.FTEX_STORAGE_CHUNKED, False),
+		("DXT5 4096, zlib stream", 4096, 4096, 4, BenchmarkSupport.FTEX_STORAGE_COMPRESSED, False),
+		("DXT5 4096, uncompressed", 4096, 4096, 4, BenchmarkSupport.FTEX_STORAGE_RAW, False),
+		("DXT5 1024 cube, chunked", 1024, 1024, 4, BenchmarkSupport.FTEX_STORAGE_CHUNKED, True),
+		("RGBA 2048, chunked", 2048, 2048, 0, BenchmarkSupport.FTEX_STORAGE_CHUNKED, False),
+	]
+	
+	print("%-26s %9s %9s %10s %12s %15s" % ("texture", "DDS (MB)", "time (s)", "peak (KB)", "memory (s)", "temp file (s)"))
+	with tempfile.TemporaryDirectory() as directory:
+		ftexFilename = os.path.join(directory, 'texture.ftex')
+		ddsFilename = os.path.join(directory, 'texture.dds')
+		for (seed, (name, width, height, pixelFormat, storage, cubeMap)) in enumerate(cases):
+			frames = BenchmarkSupport.makeFtex(ftexFilename, width, height, pixelFormat, storage, cubeMap, seed)
+			(duration, success) = BenchmarkSupport.bestTime(lambda: Ftex.ftexToDds(ftexFilename, ddsFilename))
+			if not success:
+				raise AssertionError("%s: conversion failed" % name)
+			data = readFile(ddsFilename)
+			checkDds(name, data, frames)
+			peak = BenchmarkSupport.peakMemory(lambda: Ftex.ftexToDds(ftexFilename, ddsFilename))
+			
+			(memoryDuration, buffer) = BenchmarkSupport.bestTime(lambda: Ftex.ftexToDdsBuffer(ftexFilename))
+			if buffer != data:
+				raise AssertionError("%s: in-memory conversion differs from the DDS file" % name)
+			(fileDuration, buffer) = BenchmarkSupport.bestTime(lambda: convertThroughFile(ftexFilename, ddsFilename))
+			print("%-26s %9.1f %9.3f %10.1f %12.3f %15.3f" % (name, len(data) / 1e6, duration, peak / 1e3, memoryDuration, fileDuration))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,121 @@
+#
+# Reads a kit exported with all extensions the way IO.importFmdl() does:
+# decoding split meshes, vertex loop preservation and antiblur meshes, and
+# grouping the vertex records of each mesh into blender vertices. Compares
+# reading regular meshes, which builds Vertex and Face objects and rebuilds
+# them in each decoding step, with reading columnar meshes, which are decoded
+# as arrays.
+#
+# Checks that both find the same blender vertices, faces and bone weights,
+# and that the vertices built for decoded columnar meshes share positions
+# the way the vertices of decoded regular meshes do.
+#
+import os
+import tempfile
+
+import numpy
+
+import BenchmarkSupport
+from BenchmarkSupport import FmdlFile
+
+FmdlAntiBlur = BenchmarkSupport.loadAddonModule('FmdlAntiBlur')
+FmdlExportPipeline = BenchmarkSupport.loadAddonModule('FmdlExportPipeline')
+FmdlMeshSplitting = BenchmarkSupport.loadAddonModule('FmdlMeshSplitting')
+FmdlSplitVertexEncoding = BenchmarkSupport.loadAddonModule('FmdlSplitVertexEncoding')
+
+def exportKit(filename):
+	fmdl = BenchmarkSupport.makeKit()
+	FmdlExportPipeline.runExportStages(fmdl, FmdlExportPipeline.exportStages(True, True, True, False))
+	fmdl.writeFile(filename)
+
+def readDecoded(filename, columnar):
+	fmdl = FmdlFile.FmdlFile()
+	fmdl.readFile(filename, columnar = columnar)
+	fmdl = FmdlMeshSplitting.decodeFmdlSplitMeshes(fmdl)
+	fmdl = FmdlSplitVertexEncoding.decodeFmdlVertexLoopPreservation(fmdl)
+	fmdl = FmdlAntiBlur.decodeFmdlAntiBlur(fmdl)
+	return fmdl
+
+#
+# Groups the vertex records of a mesh into blender vertices the way
+# IO.meshGeometry() does, by the identity of their positions. Returns the same
+# lists as ColumnarMesh.vertexLoops().
+#
+def objectVertexLoops(mesh):
+	vertexIndices = {}
+	recordVertices = []
+	firstLoops = []
+	for (index, vertex) in enumerate(mesh.vertices):
+		if vertex.position not in vertexIndices:
+			vertexIndices[vertex.position] = len(vertexIndices)
+			firstLoops.append(index)
+		recordVertices.append(vertexIndices[vertex.position])
+	return (recordVertices, firstLoops)
+
+def importObjects(filename):
+	fmdl = readDecoded(filename, False)
+	return (fmdl, [objectVertexLoops(mesh) for mesh in fmdl.meshes])
+
+def importColumns(filename):
+	fmdl = readDecoded(filename, True)
+	return (fmdl, [tuple(indices.tolist() for indices in mesh.vertexLoops()) for mesh in fmdl.meshes])
+
+def objectBoneWeights(mesh):
+	return [
+		{bone.name: weight for (bone, weight) in vertex.boneMapping.items()}
+		for vertex in mesh.vertices
+	]
+
+def columnarBoneWeights(mesh):
+	(boneIndices, boneWeights) = mesh.boneMappingColumns()
+	return [
+		{mesh.boneGroup.bones[index].name: weight / 255.0 for (index, weight) in zip(indices, weights) if weight > 0}
+		for (indices, weights) in zip(boneIndices.tolist(), boneWeights.tolist())
+	]
+
+def checkImports(objectImport, columnarImport):
+	((objectFmdl, objectLoops), (columnarFmdl, columnarLoops)) = (objectImport, columnarImport)
+	if len(objectFmdl.meshes) != len(columnarFmdl.meshes):
+		raise AssertionError("columnar import finds %d meshes instead of %d" % (len(columnarFmdl.meshes), len(objectFmdl.meshes)))
+	for (index, (objectMesh, columnarMesh)) in enumerate(zip(objectFmdl.meshes, columnarFmdl.meshes)):
+		if not columnarMesh.isColumnar() or columnarMesh.cachedVertices is not None:
+			raise AssertionError("mesh %d: columnar import builds vertex objects" % index)
+		if objectLoops[index] != columnarLoops[index]:
+			raise AssertionError("mesh %d: columnar import finds different blender vertices" % index)
+		
+		vertexIndices = {}
+		for (vertexIndex, vertex) in enumerate(objectMesh.vertices):
+			vertexIndices[vertex] = vertexIndex
+		faceIndices = [[vertexIndices[vertex] for vertex in face.vertices] for face in objectMesh.faces]
+		if faceIndices != columnarMesh.faceIndices.tolist():
+			raise AssertionError("mesh %d: columnar import finds different faces" % index)
+		positions = [(vertex.position.x, vertex.position.y, vertex.position.z) for vertex in objectMesh.vertices]
+		if not numpy.array_equal(numpy.array(positions, dtype = numpy.float32).reshape((-1, 3)), columnarMesh.positions):
+			raise AssertionError("mesh %d: columnar import finds different positions" % index)
+		if objectMesh.vertexFields.hasBoneMapping and objectBoneWeights(objectMesh) != columnarBoneWeights(columnarMesh):
+			raise AssertionError("mesh %d: columnar import finds different bone weights" % index)
+		
+		if objectVertexLoops(columnarMesh) != objectLoops[index]:
+			raise AssertionError("mesh %d: vertices of the decoded columnar mesh do not share positions" % index)
+
+def main():
+	with tempfile.TemporaryDirectory() as directory:
+		filename = os.path.join(directory, 'kit.fmdl')
+		exportKit(filename)
+		
+		(objectTime, objectImport) = BenchmarkSupport.bestTime(lambda: importObjects(filename))
+		(columnarTime, columnarImport) = BenchmarkSupport.bestTime(lambda: importColumns(filename))
+		objectPeak = BenchmarkSupport.peakMemory(lambda: importObjects(filename))
+		columnarPeak = BenchmarkSupport.peakMemory(lambda: importColumns(filename))
+	
+	vertexCount = sum(len(loops[1]) for loops in objectImport[1])
+	print("%d meshes, %d blender vertices" % (len(objectImport[0].meshes), vertexCount))
+	print("%-10s %9s %9s %8s" % ("import", "time (s)", "peak (MB)", "speedup"))
+	print("%-10s %9.3f %9.1f %8s" % ("objects", objectTime, objectPeak / 1e6, ""))
+	print("%-10s %9.3f %9.1f %7.1fx" % ("columnar", columnarTime, columnarPeak / 1e6, objectTime / columnarTime))
+	
+	checkImports(objectImport, columnarImport)
+	print("identical geometry found")
+
+if __name__ == '__main__':
+	main()
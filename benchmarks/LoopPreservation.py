@@ -0,0 +1,279 @@
+#
+# Checks that FmdlSplitVertexEncoding.encodeMeshVertexLoopPreservation()
+# produces exactly the same vertices, in the same order, and the same faces
+# as the per-vertex reference implementation, and compares their speed.
+#
+# The encoded meshes, and the unencoded ones, are then split, written and read
+# back, both as regular and as columnar meshes, recombined and decoded, as
+# the importer does. Checks that decodeMeshVertexLoopIndices() finds the same
+# vertices as decodeMeshVertexLoopPreservation() builds for regular meshes,
+# both for regular and columnar meshes, and that decoding columnar meshes
+# builds the same vertices and faces once they are converted. Compares the
+# speed of decoding regular meshes with finding the vertices of columnar
+# meshes.
+#
+# Besides the regular synthetic meshes, which have some vertices split into
+# two loops, the meshes include duplicate loops of a vertex, distinct vertices
+# at the same position with the same bone mapping, with and without identical
+# loops, and meshes without bone mapping. Encoding is also checked on a mesh
+# without vertices, and on a position object shared by vertices with
+# different bone mappings, which cannot be encoded.
+#
+import os
+import random
+import tempfile
+
+import BenchmarkSupport
+from BenchmarkSupport import FmdlFile
+
+FmdlMeshSplitting = BenchmarkSupport.loadAddonModule('FmdlMeshSplitting')
+FmdlSplitVertexEncoding = BenchmarkSupport.loadAddonModule('FmdlSplitVertexEncoding')
+
+#
+# Consider all FMDL vertices to be loops of the same vertex when they share a
+# position object pointer.
+#
+# This is the reference implementation of
+# FmdlSplitVertexEncoding.encodeMeshVertexLoopPreservation(), which handles one
+# vertex at a time.
+#
+def encodeMeshVertexLoopPreservationPerVertex(mesh):
+	#
+	# Map from topological keys to lists of position objects
+	#
+	topologicallyEquivalentVertices = {}
+	#
+	# Map from position objects to lists of encoded vertices
+	#
+	splitVertices = {}
+	
+	for encodedVertex in mesh.vertexEncoding:
+		key = FmdlSplitVertexEncoding.topologicalKey(encodedVertex, mesh.vertexFields)
+		
+		if encodedVertex.vertex.position not in splitVertices:
+			splitVertices[encodedVertex.vertex.position] = []
+			
+			if key not in topologicallyEquivalentVertices:
+				topologicallyEquivalentVertices[key] = []
+			topologicallyEquivalentVertices[key].append(encodedVertex.vertex.position)
+		splitVertices[encodedVertex.vertex.position].append(encodedVertex)
+	
+	#
+	# Sort splitVertices by nontopological encoding, and remove duplicates.
+	#
+	replacedVertices = {}
+	for key in splitVertices:
+		loops = {}
+		for encodedVertex in splitVertices[key]:
+			encoding = FmdlSplitVertexEncoding.nontopologicalEncoding(encodedVertex, mesh.vertexFields)
+			if encoding in loops:
+				replacedVertices[encodedVertex.vertex] = loops[encoding].vertex
+			else:
+				loops[encoding] = encodedVertex
+		splitVertices[key] = [loops[encoding] for encoding in sorted(loops.keys())]
+	
+	#
+	# Sort topologicallyEquivalentVertices by nontopological encoding of
+	# the first element, in descending order.
+	#
+	for (key, positions) in topologicallyEquivalentVertices.items():
+		topologicallyEquivalentVertices[key] = sorted(positions, reverse = True, key = (
+			lambda position : FmdlSplitVertexEncoding.nontopologicalEncoding(splitVertices[position][0], mesh.vertexFields)
+		))
+	
+	encodedVertices = []
+	addedTopologicalKeys = set()
+	for encodedVertex in mesh.vertexEncoding:
+		key = FmdlSplitVertexEncoding.topologicalKey(encodedVertex, mesh.vertexFields)
+		if key not in addedTopologicalKeys:
+			addedTopologicalKeys.add(key)
+			
+			for position in topologicallyEquivalentVertices[key]:
+				encodedVertices += splitVertices[position]
+	
+	output = FmdlFile.FmdlFile.Mesh()
+	output.boneGroup = mesh.boneGroup
+	output.materialInstance = mesh.materialInstance
+	output.alphaFlags = mesh.alphaFlags
+	output.shadowFlags = mesh.shadowFlags
+	output.vertexFields = mesh.vertexFields
+	output.vertices = [encodedVertex.vertex for encodedVertex in encodedVertices]
+	output.faces = FmdlSplitVertexEncoding.replaceFaceVertices(mesh.faces, replacedVertices)
+	output.vertexEncoding = encodedVertices
+	output.extensionHeaders = mesh.extensionHeaders.copy()
+	
+	return output
+
+def copyVertex(vertex, position):
+	F = FmdlFile.FmdlFile
+	output = F.Vertex()
+	output.position = position
+	output.normal = vertex.normal
+	output.tangent = vertex.tangent
+	output.color = vertex.color
+	output.uv = vertex.uv[:]
+	output.boneMapping = vertex.boneMapping
+	return output
+
+#
+# Adds duplicate loops, topologically equivalent vertices and extra loops to
+# a mesh, and shuffles its vertices.
+#
+def addEquivalentVertices(mesh, seed):
+	F = FmdlFile.FmdlFile
+	generator = random.Random(seed)
+	vertices = mesh.vertices
+	addedVertices = []
+	for i in range(len(vertices) // 20):
+		vertex = vertices[generator.randrange(len(vertices))]
+		addedVertices.append(copyVertex(vertex, vertex.position))
+	for i in range(len(vertices) // 20):
+		vertex = vertices[generator.randrange(len(vertices))]
+		position = F.Vector3(vertex.position.x, vertex.position.y, vertex.position.z)
+		addedVertices.append(copyVertex(vertex, position))
+		if generator.random() < 0.5:
+			loop = copyVertex(vertex, position)
+			loop.normal = F.Vector4(generator.random(), 0.0, 0.0, 1.0)
+			addedVertices.append(loop)
+	for i in range(len(vertices) // 50):
+		vertex = vertices[generator.randrange(len(vertices))]
+		loop = copyVertex(vertex, vertex.position)
+		loop.uv = [F.Vector2(generator.random(), generator.random()) for uv in vertex.uv]
+		addedVertices.append(loop)
+	
+	mesh.vertices = vertices + addedVertices
+	generator.shuffle(mesh.vertices)
+	for i in range(len(addedVertices)):
+		mesh.faces.append(F.Face(*generator.sample(mesh.vertices, 3)))
+	return mesh
+
+#
+# Describes a decoded mesh by the encodings of its vertices, in order, the
+# vertex that each of them is a loop of, and the vertex indices of its faces.
+#
+def decodedMeshSignature(mesh):
+	vertexIndices = {}
+	for (index, vertex) in enumerate(mesh.vertices):
+		vertexIndices[vertex] = index
+	firstLoops = {}
+	loopIndices = []
+	for (index, encodedVertex) in enumerate(mesh.vertexEncoding):
+		if encodedVertex.vertex is not mesh.vertices[index]:
+			raise AssertionError("vertex encoding %d does not encode vertex %d" % (index, index))
+		vertex = encodedVertex.vertex
+		firstLoop = firstLoops.setdefault(id(vertex.position), (len(firstLoops), vertex))
+		if vertex.boneMapping is not firstLoop[1].boneMapping:
+			raise AssertionError("loops of vertex %d have different bone mappings" % firstLoop[0])
+		loopIndices.append(firstLoop[0])
+	return (
+		[
+			(
+				encodedVertex.position, encodedVertex.normal, encodedVertex.color, encodedVertex.tangent, tuple(encodedVertex.uv),
+				tuple((bone.name, weight) for (bone, weight) in (encodedVertex.boneMapping or [])),
+			)
+			for encodedVertex in mesh.vertexEncoding
+		],
+		loopIndices,
+		[tuple(vertexIndices[vertex] for vertex in face.vertices) for face in mesh.faces],
+	)
+
+#
+# Checks that encodeMeshVertexLoopPreservation() encodes a mesh without
+# vertices, and fails on a position object shared by vertices with different
+# bone mappings, as the reference implementation does.
+#
+def checkEncodingEdgeCases():
+	bones = BenchmarkSupport.makeBones(4)
+	emptyMesh = BenchmarkSupport.makeSkinnedGridMesh(2, bones)
+	emptyMesh.vertices = []
+	emptyMesh.faces = []
+	BenchmarkSupport.makeModel([emptyMesh], bones).precomputeVertexEncoding()
+	expected = encodeMeshVertexLoopPreservationPerVertex(emptyMesh)
+	encoded = FmdlSplitVertexEncoding.encodeMeshVertexLoopPreservation(emptyMesh)
+	if encoded.vertices != expected.vertices or encoded.faces != expected.faces or encoded.vertexEncoding != expected.vertexEncoding:
+		raise AssertionError("encodeMeshVertexLoopPreservation() encodes a mesh without vertices differently")
+	
+	mesh = BenchmarkSupport.makeSkinnedGridMesh(20, bones)
+	vertex = mesh.vertices[0]
+	otherBones = [bone for bone in bones if bone not in vertex.boneMapping]
+	loop = copyVertex(vertex, vertex.position)
+	loop.boneMapping = { otherBones[0]: 1.0 }
+	mesh.vertices = mesh.vertices + [loop]
+	BenchmarkSupport.makeModel([mesh], bones).precomputeVertexEncoding()
+	errors = []
+	for encode in [encodeMeshVertexLoopPreservationPerVertex, FmdlSplitVertexEncoding.encodeMeshVertexLoopPreservation]:
+		try:
+			encode(mesh)
+			errors.append(None)
+		except KeyError as error:
+			errors.append(error.args)
+	if errors[0] == None or errors[1] != errors[0]:
+		raise AssertionError("encodeMeshVertexLoopPreservation() fails differently on a position object with different bone mappings")
+
+def readMesh(filename, columnar):
+	fmdl = FmdlFile.FmdlFile()
+	fmdl.readFile(filename, columnar = columnar)
+	return FmdlMeshSplitting.decodeFmdlSplitMeshes(fmdl).meshes[0]
+
+def checkDecoding(name, mesh, bones, directory):
+	filename = os.path.join(directory, 'model.fmdl')
+	FmdlMeshSplitting.encodeFmdlSplitMeshes(BenchmarkSupport.makeModel([mesh], bones)).writeFile(filename)
+	regularMesh = readMesh(filename, False)
+	columnarMesh = readMesh(filename, True)
+	
+	(objectTime, expected) = BenchmarkSupport.bestTime(lambda: FmdlSplitVertexEncoding.decodeMeshVertexLoopPreservation(regularMesh))
+	(indexTime, loopIndices) = BenchmarkSupport.bestTime(lambda: FmdlSplitVertexEncoding.decodeMeshVertexLoopIndices(columnarMesh))
+	expectedSignature = decodedMeshSignature(expected)
+	if FmdlSplitVertexEncoding.decodeMeshVertexLoopIndices(regularMesh).tolist() != expectedSignature[1]:
+		raise AssertionError("%s: decodeMeshVertexLoopIndices() decodes regular meshes differently" % name)
+	if loopIndices.tolist() != expectedSignature[1]:
+		raise AssertionError("%s: decodeMeshVertexLoopIndices() decodes columnar meshes differently" % name)
+	if decodedMeshSignature(FmdlSplitVertexEncoding.decodeMeshVertexLoopPreservation(columnarMesh)) != expectedSignature:
+		raise AssertionError("%s: decodeMeshVertexLoopPreservation() decodes columnar meshes differently" % name)
+	
+	print("%-34s %8d %8d %11.3f %12.3f %7.1fx" % (
+		name, len(regularMesh.vertices), loopIndices[-1] + 1 if len(loopIndices) > 0 else 0,
+		objectTime, indexTime, objectTime / indexTime,
+	))
+
+def main():
+	cases = [
+		("grid 20k", 20000, 60, False),
+		("grid 20k, no bones", 20000, 0, False),
+		("equivalent 20k", 20000, 60, True),
+		("equivalent 20k, no bones", 20000, 0, True),
+		("grid 150k", 150000, 100, False),
+		("equivalent 150k", 150000, 100, True),
+	]
+	
+	print("encoding")
+	print("%-26s %8s %8s %14s %11s %8s" % ("mesh", "vertices", "loops", "per vertex (s)", "numpy (s)", "speedup"))
+	decodedMeshes = []
+	for (seed, (name, faceCount, boneCount, equivalentVertices)) in enumerate(cases):
+		bones = BenchmarkSupport.makeBones(boneCount)
+		mesh = BenchmarkSupport.makeSkinnedGridMesh(faceCount, bones, looseVertexCount = faceCount // 100, seed = seed)
+		if equivalentVertices:
+			addEquivalentVertices(mesh, seed)
+		fmdl = BenchmarkSupport.makeModel([mesh], bones)
+		fmdl.precomputeVertexEncoding()
+		
+		(perVertexTime, expected) = BenchmarkSupport.bestTime(lambda: encodeMeshVertexLoopPreservationPerVertex(mesh))
+		(arrayTime, encoded) = BenchmarkSupport.bestTime(lambda: FmdlSplitVertexEncoding.encodeMeshVertexLoopPreservation(mesh))
+		if encoded.vertexEncoding != expected.vertexEncoding:
+			raise AssertionError("%s: encodeMeshVertexLoopPreservation() orders vertices differently" % name)
+		if [face.vertices for face in encoded.faces] != [face.vertices for face in expected.faces]:
+			raise AssertionError("%s: encodeMeshVertexLoopPreservation() produces different faces" % name)
+		print("%-26s %8d %8d %14.3f %11.3f %7.1fx" % (name, len(mesh.vertices), len(encoded.vertices), perVertexTime, arrayTime, perVertexTime / arrayTime))
+		decodedMeshes.append((name, encoded, bones))
+		decodedMeshes.append((name + ", unencoded", mesh, bones))
+	checkEncodingEdgeCases()
+	
+	print("")
+	print("decoding")
+	print("%-34s %8s %8s %11s %12s %8s" % ("mesh", "loops", "vertices", "objects (s)", "indices (s)", "speedup"))
+	with tempfile.TemporaryDirectory() as directory:
+		for (name, mesh, bones) in decodedMeshes:
+			checkDecoding(name, mesh, bones, directory)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,88 @@
+#
+# Compares the fragmenting strategies of FmdlMeshSplitting on meshes whose bone
+# subtrees do not fit a single submesh: how many submeshes they produce, how
+# many vertices they duplicate across submeshes, into how many disconnected
+# pieces the submeshes fall apart, and how long splitting takes.
+#
+import BenchmarkSupport
+
+FmdlMeshSplitting = BenchmarkSupport.loadAddonModule('FmdlMeshSplitting')
+
+STRATEGIES = [
+	FmdlMeshSplitting.FRAGMENT_STRATEGY_SORT_VECTOR,
+	FmdlMeshSplitting.FRAGMENT_STRATEGY_REGION_GROWING,
+]
+
+#
+# Removes every other band of faces across one side of a grid mesh, leaving a
+# set of parallel strips, like legs or fingers. The strips run along the
+# longer side of the grid, or across it.
+#
+def makeStrips(mesh, stripCount, alongLongerSide):
+	xs = [face.vertices[0].position.x for face in mesh.faces]
+	ys = [face.vertices[0].position.y for face in mesh.faces]
+	if (max(xs) - min(xs) < max(ys) - min(ys)) == alongLongerSide:
+		positions = xs
+	else:
+		positions = ys
+	(minimum, maximum) = (min(positions), max(positions))
+	bandWidth = (maximum - minimum) / (2 * stripCount - 1)
+	mesh.faces = [face for (face, position) in zip(mesh.faces, positions) if int((position - minimum) / bandWidth) % 2 == 0]
+	usedVertices = set(vertex for face in mesh.faces for vertex in face.vertices)
+	mesh.vertices = [vertex for vertex in mesh.vertices if vertex in usedVertices]
+	return mesh
+
+def countPieces(submesh):
+	parents = {}
+	def find(position):
+		while parents[position] is not position:
+			parents[position] = parents[parents[position]]
+			position = parents[position]
+		return position
+	for face in submesh.faces:
+		positions = [vertex.position for vertex in face.vertices]
+		for position in positions:
+			parents.setdefault(position, position)
+		for position in positions[1:]:
+			(a, b) = (find(positions[0]), find(position))
+			if a is not b:
+				parents[a] = b
+	return len(set(find(position) for position in parents))
+
+def main():
+	cases = [
+		("grid, 5 bones", 200000, 5, 0, True),
+		("8 strips, 5 bones", 200000, 5, 8, True),
+		("8 across, 5 bones", 200000, 5, 8, False),
+		("grid, 150 bones", 300000, 150, 0, True),
+		("16 strips, 40 bones", 300000, 40, 16, True),
+		("16 across, 40 bones", 300000, 40, 16, False),
+	]
+	
+	print("%-20s %-15s %9s %9s %11s %7s %9s" % ("mesh", "strategy", "vertices", "submeshes", "duplicated", "pieces", "time (s)"))
+	for (name, faceCount, boneCount, stripCount, alongLongerSide) in cases:
+		bones = BenchmarkSupport.makeBones(boneCount)
+		mesh = BenchmarkSupport.makeSkinnedGridMesh(faceCount, bones)
+		if stripCount > 0:
+			makeStrips(mesh, stripCount, alongLongerSide)
+		fmdl = BenchmarkSupport.makeModel([mesh], bones)
+		fmdl.precomputeVertexEncoding()
+		parentBones = FmdlMeshSplitting.computeParentBones(bones)
+		descendentBones = FmdlMeshSplitting.computeDescendentBones(parentBones)
+		
+		for strategy in STRATEGIES:
+			(duration, submeshes) = BenchmarkSupport.bestTime(lambda: FmdlMeshSplitting.splitMesh(mesh, parentBones, descendentBones, strategy), repeat = 1)
+			vertexCount = sum(len(submesh.vertices) for submesh in submeshes)
+			pieces = sum(countPieces(submesh) for submesh in submeshes)
+			print("%-20s %-15s %9d %9d %11d %7d %9.2f" % (
+				name,
+				strategy,
+				len(mesh.vertices),
+				len(submeshes),
+				vertexCount - len(mesh.vertices),
+				pieces,
+				duration,
+			))
+
+if __name__ == '__main__':
+	main()
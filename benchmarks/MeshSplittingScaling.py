@@ -0,0 +1,134 @@
+#
+# Measures how FmdlMeshSplitting.encodeFmdlSplitMeshes() and
+# decodeFmdlSplitMeshes() scale with mesh size and bone count, on synthetic
+# skinned meshes with and without loose vertices.
+#
+# For each case, the mesh is split, written to a file, read back and
+# recombined. Splitting and recombining are timed separately, and run a second
+# time under tracemalloc to record their peak memory use. Each case also
+# records the number of submeshes, the number of vertices duplicated across
+# submeshes, and whether recombining restored the original number of vertices
+# and faces.
+#
+# Results are printed as a table, and written as JSON to the output file if
+# one is given, for comparing runs or fragmenting strategies.
+#
+# Usage: python3 benchmarks/MeshSplittingScaling.py [--faces N ...] [--bones N ...]
+#            [--loose FRACTION ...] [--strategy NAME] [--repeat N] [--output FILE]
+#
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+
+import numpy
+
+import BenchmarkSupport
+from BenchmarkSupport import FmdlFile
+
+FmdlMeshSplitting = BenchmarkSupport.loadAddonModule('FmdlMeshSplitting')
+
+FACE_COUNTS = [20000, 50000, 100000, 200000, 500000]
+BONE_COUNTS = [20, 60, 150]
+LOOSE_VERTEX_FRACTIONS = [0.0, 0.02]
+
+def readSplitModel(filename):
+	fmdl = FmdlFile.FmdlFile()
+	fmdl.readFile(filename)
+	return fmdl
+
+def runCase(faceCount, boneCount, looseVertexFraction, strategy, repeat, directory):
+	bones = BenchmarkSupport.makeBones(boneCount)
+	mesh = BenchmarkSupport.makeSkinnedGridMesh(faceCount, bones, looseVertexCount = int(faceCount * looseVertexFraction))
+	fmdl = BenchmarkSupport.makeModel([mesh], bones)
+	fmdl.precomputeVertexEncoding()
+	
+	def split():
+		return FmdlMeshSplitting.encodeFmdlSplitMeshes(fmdl, strategy)
+	(splitTime, splitFmdl) = BenchmarkSupport.bestTime(split, repeat)
+	splitMemory = BenchmarkSupport.peakMemory(split)
+	
+	filename = os.path.join(directory, 'split.fmdl')
+	splitFmdl.writeFile(filename)
+	readFmdl = readSplitModel(filename)
+	def combine():
+		return FmdlMeshSplitting.decodeFmdlSplitMeshes(readFmdl)
+	(combineTime, combinedFmdl) = BenchmarkSupport.bestTime(combine, repeat)
+	combineMemory = BenchmarkSupport.peakMemory(combine)
+	
+	submeshVertexCount = sum(len(submesh.vertices) for submesh in splitFmdl.meshes)
+	return {
+		'faces': len(mesh.faces),
+		'vertices': len(mesh.vertices),
+		'looseVertices': int(faceCount * looseVertexFraction),
+		'bones': boneCount,
+		'strategy': strategy,
+		'submeshes': len(splitFmdl.meshes),
+		'duplicatedVertices': submeshVertexCount - len(mesh.vertices),
+		'splitSeconds': splitTime,
+		'splitPeakBytes': splitMemory,
+		'combineSeconds': combineTime,
+		'combinePeakBytes': combineMemory,
+		'roundTrip': (
+			len(combinedFmdl.meshes) == 1
+			and len(combinedFmdl.meshes[0].vertices) == len(mesh.vertices)
+			and len(combinedFmdl.meshes[0].faces) == len(mesh.faces)
+		),
+	}
+
+def main():
+	parser = argparse.ArgumentParser(description = "Mesh splitting benchmark and scaling suite")
+	parser.add_argument('--faces', type = int, nargs = '+', default = FACE_COUNTS, help = "face counts of the generated meshes")
+	parser.add_argument('--bones', type = int, nargs = '+', default = BONE_COUNTS, help = "numbers of PesSkeletonData bones skinning the meshes")
+	parser.add_argument('--loose', type = float, nargs = '+', default = LOOSE_VERTEX_FRACTIONS, help = "loose vertices to add, as a fraction of the face count")
+	parser.add_argument('--strategy', default = FmdlMeshSplitting.FRAGMENT_STRATEGY_SORT_VECTOR, choices = [
+		FmdlMeshSplitting.FRAGMENT_STRATEGY_SORT_VECTOR,
+		FmdlMeshSplitting.FRAGMENT_STRATEGY_REGION_GROWING,
+	], help = "fragmenting strategy")
+	parser.add_argument('--repeat', type = int, default = 1, help = "number of timed runs per case; the fastest one counts")
+	parser.add_argument('--output', help = "file to write JSON results to")
+	arguments = parser.parse_args()
+	
+	results = []
+	print("%8s %8s %6s %6s %9s %10s %9s %10s %9s %10s %5s" % (
+		"faces", "vertices", "loose", "bones", "submeshes", "duplicated",
+		"split (s)", "split (MB)", "comb. (s)", "comb. (MB)", "ok",
+	))
+	with tempfile.TemporaryDirectory() as directory:
+		for faceCount in arguments.faces:
+			for boneCount in arguments.bones:
+				for looseVertexFraction in arguments.loose:
+					result = runCase(faceCount, boneCount, looseVertexFraction, arguments.strategy, arguments.repeat, directory)
+					results.append(result)
+					print("%8d %8d %6d %6d %9d %10d %9.2f %10.1f %9.2f %10.1f %5s" % (
+						result['faces'],
+						result['vertices'],
+						result['looseVertices'],
+						result['bones'],
+						result['submeshes'],
+						result['duplicatedVertices'],
+						result['splitSeconds'],
+						result['splitPeakBytes'] / 1e6,
+						result['combineSeconds'],
+						result['combinePeakBytes'] / 1e6,
+						"yes" if result['roundTrip'] else "NO",
+					))
+					sys.stdout.flush()
+	
+	if arguments.output is not None:
+		with open(arguments.output, 'w') as file:
+			json.dump({
+				'python': platform.python_version(),
+				'numpy': numpy.__version__,
+				'platform': platform.platform(),
+				'cpus': os.cpu_count(),
+				'results': results,
+			}, file, indent = '\t')
+	
+	if not all(result['roundTrip'] for result in results):
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main()
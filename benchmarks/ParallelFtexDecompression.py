@@ -0,0 +1,108 @@
+#
+# Measures whether decompressing the chunks of a kit's worth of large
+# synthetic ftex textures with full mipmap chains on several threads would be
+# faster than Ftex.ftexToDdsBuffer(), which decompresses them one after
+# another on the importing thread.
+#
+# This measures the best case for a thread pool: the chunk table and chunks of
+# each frame are read in bulk with Ftex.readChunkTable(), and all of them are
+# decompressed on the worker threads at once, holding the whole texture in
+# memory. Checks that the threads produce exactly the same image data as
+# Ftex.ftexToDdsBuffer(), and compares their wall clock times and the peak
+# memory allocated while converting.
+#
+# Result: no gain. On the single CPU machine this was measured on, even this
+# best case took 0.53 s with 2 or 4 threads against 0.48 s serially, so the
+# add-on decompresses the chunks on the importing thread, one at a time.
+#
+# Usage: python3 benchmarks/ParallelFtexDecompression.py [worker count...]
+#
+import concurrent.futures
+import io
+import os
+import sys
+import tempfile
+
+import BenchmarkSupport
+
+Ftex = BenchmarkSupport.loadAddonModule('Ftex')
+
+KIT_TEXTURES = [
+	('kit colour', 4096, 4096),
+	('kit normals', 4096, 4096),
+	('kit shading', 2048, 2048),
+	('numbers', 1024, 1024),
+	('name', 1024, 256),
+]
+
+def decompressChunk(chunk):
+	(buffer, isCompressed) = chunk
+	if isCompressed:
+		return Ftex.decompressChunk(buffer)
+	return buffer
+
+#
+# Returns the image data of all frames of an ftex file, decompressing the
+# chunks of each frame on the threads of executor.
+#
+def imageDataParallel(ftexFilename, executor):
+	with open(ftexFilename, 'rb') as stream:
+		(ddsHeader, usesLinearSize, frameSpecifications) = Ftex.readFtexHeader(stream)
+		frames = []
+		for (offset, chunkCount, uncompressedSize, compressedSize) in frameSpecifications:
+			if chunkCount == 0:
+				with io.BytesIO() as outputStream:
+					Ftex.writeImageBuffer(stream, outputStream, offset, chunkCount, uncompressedSize, compressedSize)
+					frames.append(outputStream.getvalue())
+				continue
+			chunks = [
+				(Ftex.readChunk(stream, chunkOffset, chunkSize), isCompressed)
+				for (chunkOffset, chunkSize, isCompressed) in Ftex.readChunkTable(stream, offset, chunkCount)
+			]
+			frames += executor.map(decompressChunk, chunks)
+		return b''.join(frames)
+
+def imageDataSerial(ftexFilename):
+	with open(ftexFilename, 'rb') as stream:
+		(ddsHeader, usesLinearSize, frameSpecifications) = Ftex.readFtexHeader(stream)
+	return Ftex.ftexToDdsBuffer(ftexFilename)[len(ddsHeader):]
+
+def convertTextures(ftexFilenames, workerCount):
+	if workerCount == 1:
+		return [imageDataSerial(ftexFilename) for ftexFilename in ftexFilenames]
+	with concurrent.futures.ThreadPoolExecutor(workerCount) as executor:
+		return [imageDataParallel(ftexFilename, executor) for ftexFilename in ftexFilenames]
+
+def main():
+	if len(sys.argv) > 1:
+		workerCounts = [int(argument) for argument in sys.argv[1:]]
+	else:
+		workerCounts = [1, 2, 4]
+	
+	with tempfile.TemporaryDirectory() as directory:
+		ftexFilenames = []
+		ddsSize = 0
+		for (seed, (name, width, height)) in enumerate(KIT_TEXTURES):
+			ftexFilename = os.path.join(directory, '%s.ftex' % name)
+			frames = BenchmarkSupport.makeFtex(ftexFilename, width, height, seed = seed)
+			ftexFilenames.append(ftexFilename)
+			ddsSize += sum(len(frame) for frame in frames)
+		print("%d CPUs; %d DXT5 textures, %.1f MB of image data in %d KiB chunks" % (
+			os.cpu_count(), len(ftexFilenames), ddsSize / 1e6, BenchmarkSupport.FTEX_CHUNK_SIZE // 1024,
+		))
+		
+		serialImageData = None
+		serialTime = None
+		print("%8s %10s %8s %10s" % ("workers", "time (s)", "speedup", "peak (MB)"))
+		for workerCount in workerCounts:
+			(duration, imageData) = BenchmarkSupport.bestTime(lambda: convertTextures(ftexFilenames, workerCount))
+			if serialImageData is None:
+				(serialImageData, serialTime) = (imageData, duration)
+			elif imageData != serialImageData:
+				raise AssertionError("%d workers produce different image data than %d" % (workerCount, workerCounts[0]))
+			del imageData
+			peak = BenchmarkSupport.peakMemory(lambda: convertTextures(ftexFilenames, workerCount))
+			print("%8d %10.3f %7.2fx %10.1f" % (workerCount, duration, serialTime / duration, peak / 1e6))
+
+if __name__ == '__main__':
+	main()
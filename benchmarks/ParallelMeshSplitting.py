@@ -0,0 +1,90 @@
+#
+# Measures whether splitting the oversized meshes of a model, like a body with
+# a shirt, shorts and socks, in parallel worker processes would be faster than
+# FmdlMeshSplitting.encodeFmdlSplitMeshes(), which splits them one after
+# another.
+#
+# This measures the best case for a process pool: forked workers inherit the
+# meshes, split one each with FmdlMeshSplitting.splitMesh(), and return only
+# the sizes of the submeshes, so nothing but the splitting itself is timed.
+# Returning the submeshes, and rebuilding them from the objects of the model,
+# would only add to that. Checks that the workers find submeshes of the same
+# sizes as splitting in this process.
+#
+# Result: no gain. On the single CPU machine this was measured on, even this
+# best case took 6.5 s serially against 7.6 s with 2 workers and 8.3 s with
+# 4, so the add-on splits meshes in the exporting process. Blender on Windows
+# cannot fork workers at all, and spawned workers would also have to be sent
+# the meshes.
+#
+# Usage: python3 benchmarks/ParallelMeshSplitting.py [worker count...]
+#
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+
+import BenchmarkSupport
+
+FmdlMeshSplitting = BenchmarkSupport.loadAddonModule('FmdlMeshSplitting')
+
+MESH_FACE_COUNTS = [
+	('body', 150000),
+	('shirt', 90000),
+	('shorts', 60000),
+	('socks', 45000),
+]
+
+#
+# Inherited by forked workers, as (meshes, parentBones, descendentBones).
+#
+splitArguments = None
+
+def submeshSizes(meshIndex):
+	(meshes, parentBones, descendentBones) = splitArguments
+	return [
+		(len(submesh.boneGroup.bones), len(submesh.vertices), len(submesh.faces))
+		for submesh in FmdlMeshSplitting.splitMesh(meshes[meshIndex], parentBones, descendentBones)
+	]
+
+def splitAll(meshCount, workerCount):
+	if workerCount == 1:
+		return [submeshSizes(i) for i in range(meshCount)]
+	with concurrent.futures.ProcessPoolExecutor(workerCount, multiprocessing.get_context('fork')) as executor:
+		return list(executor.map(submeshSizes, range(meshCount)))
+
+def main():
+	global splitArguments
+	
+	if len(sys.argv) > 1:
+		workerCounts = [int(argument) for argument in sys.argv[1:]]
+	else:
+		workerCounts = [1, 2, 4]
+	if 'fork' not in multiprocessing.get_all_start_methods():
+		print("worker processes cannot be forked on this platform")
+		return
+	
+	bones = BenchmarkSupport.makeBones(120)
+	meshes = [
+		BenchmarkSupport.makeSkinnedGridMesh(faceCount, bones, seed = seed)
+		for (seed, (name, faceCount)) in enumerate(MESH_FACE_COUNTS)
+	]
+	fmdl = BenchmarkSupport.makeModel(meshes, bones)
+	fmdl.precomputeVertexEncoding()
+	parentBones = FmdlMeshSplitting.computeParentBones(bones)
+	splitArguments = (meshes, parentBones, FmdlMeshSplitting.computeDescendentBones(parentBones))
+	print("%d CPUs; meshes: %s" % (os.cpu_count(), ", ".join("%s %d faces" % entry for entry in MESH_FACE_COUNTS)))
+	
+	serialSizes = None
+	serialTime = None
+	print("%8s %10s %10s %8s" % ("workers", "submeshes", "time (s)", "speedup"))
+	for workerCount in workerCounts:
+		(duration, sizes) = BenchmarkSupport.bestTime(lambda: splitAll(len(meshes), workerCount), repeat = 2)
+		if serialSizes is None:
+			(serialSizes, serialTime) = (sizes, duration)
+		elif sizes != serialSizes:
+			raise AssertionError("%d workers produce different submeshes than %d" % (workerCount, workerCounts[0]))
+		print("%8d %10d %10.2f %7.2fx" % (workerCount, sum(len(meshSizes) for meshSizes in sizes), duration, serialTime / duration))
+
+if __name__ == '__main__':
+	main()
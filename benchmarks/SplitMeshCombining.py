@@ -0,0 +1,107 @@
+#
+# Reads back a model with large split meshes, and combines the split meshes
+# using FmdlMeshSplitting.combineMeshes(), for regular and for columnar meshes,
+# and using the per-vertex FmdlMeshSplitting.combineMesh() on which it used to
+# be based. Checks that all of them produce the same combined meshes, and
+# compares their speed.
+#
+import os
+import tempfile
+
+import BenchmarkSupport
+from BenchmarkSupport import FmdlFile
+
+FmdlMeshSplitting = BenchmarkSupport.loadAddonModule('FmdlMeshSplitting')
+FmdlSplitVertexEncoding = BenchmarkSupport.loadAddonModule('FmdlSplitVertexEncoding')
+
+MESH_FACE_COUNTS = [
+	('body', 150000),
+	('shirt', 90000),
+]
+
+def combineMeshesPerVertex(meshes, bones):
+	output = FmdlFile.FmdlFile.Mesh()
+	output.vertexFields = meshes[0].vertexFields
+	output.vertexEncoding = []
+	output.vertices = []
+	output.faces = []
+	mergedEncodedVertices = {}
+	for mesh in meshes:
+		FmdlMeshSplitting.combineMesh(output, mesh, mergedEncodedVertices)
+	output.boneGroup = FmdlFile.FmdlFile.BoneGroup()
+	if output.vertexFields.hasBoneMapping:
+		selectedBones = set(bone for encodedVertex in output.vertexEncoding for (bone, weight) in encodedVertex.boneMapping)
+		output.boneGroup.bones = [bone for bone in bones if bone in selectedBones]
+	return output
+
+def splitMeshGroups(fmdl):
+	return [meshGroup.meshes for meshGroup in fmdl.meshGroups if 'split-mesh-groups' in meshGroup.extensionHeaders]
+
+#
+# Describes a combined mesh by the encodings of its vertices, in order, and the
+# vertex indices of its faces.
+#
+def meshSignature(mesh):
+	vertexIndices = {}
+	for (index, vertex) in enumerate(mesh.vertices):
+		vertexIndices[vertex] = index
+	return (
+		[bone.name for bone in mesh.boneGroup.bones],
+		[
+			(
+				encodedVertex.position, encodedVertex.normal, encodedVertex.color, encodedVertex.tangent, tuple(encodedVertex.uv),
+				tuple((bone.name, weight) for (bone, weight) in encodedVertex.boneMapping),
+			)
+			for encodedVertex in mesh.vertexEncoding
+		],
+		[tuple(vertexIndices[vertex] for vertex in face.vertices) for face in mesh.faces],
+	)
+
+def main():
+	bones = BenchmarkSupport.makeBones(120)
+	meshes = [
+		BenchmarkSupport.makeSkinnedGridMesh(faceCount, bones, seed = seed)
+		for (seed, (name, faceCount)) in enumerate(MESH_FACE_COUNTS)
+	]
+	fmdl = BenchmarkSupport.makeModel(meshes, bones)
+	fmdl = FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservation(fmdl)
+	fmdl = FmdlMeshSplitting.encodeFmdlSplitMeshes(fmdl)
+	
+	with tempfile.TemporaryDirectory() as directory:
+		filename = os.path.join(directory, 'split.fmdl')
+		fmdl.writeFile(filename)
+		regularFmdl = FmdlFile.FmdlFile()
+		regularFmdl.readFile(filename)
+		columnarFmdl = FmdlFile.FmdlFile()
+		columnarFmdl.readFile(filename, columnar = True)
+	
+	groups = splitMeshGroups(regularFmdl)
+	columnarGroups = splitMeshGroups(columnarFmdl)
+	print("%d split meshes: %s submeshes, %d vertices" % (
+		len(groups),
+		" + ".join(str(len(group)) for group in groups),
+		sum(len(mesh.vertices) for group in groups for mesh in group),
+	))
+	
+	(perVertexTime, perVertexMeshes) = BenchmarkSupport.bestTime(lambda: [combineMeshesPerVertex(group, regularFmdl.bones) for group in groups])
+	(regularTime, regularMeshes) = BenchmarkSupport.bestTime(lambda: [FmdlMeshSplitting.combineMeshes(group, regularFmdl.bones) for group in groups])
+	(columnarTime, columnarMeshes) = BenchmarkSupport.bestTime(lambda: [FmdlMeshSplitting.combineMeshes(group, columnarFmdl.bones) for group in columnarGroups])
+	
+	for (perVertexMesh, regularMesh, columnarMesh) in zip(perVertexMeshes, regularMeshes, columnarMeshes):
+		if perVertexMesh.vertexEncoding != regularMesh.vertexEncoding or perVertexMesh.boneGroup.bones != regularMesh.boneGroup.bones:
+			raise AssertionError("combineMeshes() selects different vertices than combineMesh()")
+		if [face.vertices for face in perVertexMesh.faces] != [face.vertices for face in regularMesh.faces]:
+			raise AssertionError("combineMeshes() produces different faces than combineMesh()")
+		if not columnarMesh.isColumnar():
+			raise AssertionError("combineMeshes() does not combine columnar meshes into a columnar mesh")
+		if meshSignature(columnarMesh) != meshSignature(regularMesh):
+			raise AssertionError("combineMeshes() combines columnar meshes differently")
+	print("all combined meshes match")
+	
+	print("%-22s %10s %8s" % ("", "time (s)", "speedup"))
+	print("%-22s %10.3f %7.1fx" % ("combineMesh()", perVertexTime, 1.0))
+	print("%-22s %10.3f %7.1fx" % ("combineMeshes()", regularTime, perVertexTime / regularTime))
+	print("%-22s %10.3f %7.1fx" % ("combineMeshes(), columnar", columnarTime, perVertexTime / columnarTime))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,106 @@
+#
+# Runs FmdlVertexCache.optimizeFmdlVertexCache() after the vertex loop
+# preservation and mesh splitting export stages, as IO.exportFmdl() does, and
+# reports ACMR and ATVR before and after optimization. Checks that the
+# optimized model, written and read back and decoded, contains exactly the
+# same faces and the same vertex/loop structure as the unoptimized model.
+#
+import collections
+import os
+import random
+import tempfile
+
+import BenchmarkSupport
+from BenchmarkSupport import FmdlFile
+
+FmdlMeshSplitting = BenchmarkSupport.loadAddonModule('FmdlMeshSplitting')
+FmdlSplitVertexEncoding = BenchmarkSupport.loadAddonModule('FmdlSplitVertexEncoding')
+FmdlVertexCache = BenchmarkSupport.loadAddonModule('FmdlVertexCache')
+
+def shuffleFaces(mesh, seed = 0):
+	random.Random(seed).shuffle(mesh.faces)
+	return mesh
+
+def exportModel(meshes, bones, optimize):
+	fmdl = BenchmarkSupport.makeModel(meshes, bones)
+	fmdl = FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservation(fmdl)
+	fmdl = FmdlMeshSplitting.encodeFmdlSplitMeshes(fmdl)
+	if optimize:
+		fmdl = FmdlVertexCache.optimizeFmdlVertexCache(fmdl)
+	return fmdl
+
+#
+# Reads a written model back as the importer does, and describes each of its
+# meshes as a multiset of faces, identifying each vertex by its attributes and
+# by the attributes of all loops of its blender vertex.
+#
+def importedGeometry(filename):
+	fmdl = FmdlFile.FmdlFile()
+	fmdl.readFile(filename)
+	fmdl = FmdlMeshSplitting.decodeFmdlSplitMeshes(fmdl)
+	fmdl = FmdlSplitVertexEncoding.decodeFmdlVertexLoopPreservation(fmdl)
+	
+	def vertexKey(vertex):
+		return (
+			(vertex.position.x, vertex.position.y, vertex.position.z),
+			(vertex.normal.x, vertex.normal.y, vertex.normal.z),
+			tuple((uv.u, uv.v) for uv in vertex.uv),
+			tuple(sorted((bone.name, weight) for (bone, weight) in vertex.boneMapping.items())),
+		)
+	
+	output = []
+	for mesh in fmdl.meshes:
+		positionLoops = collections.defaultdict(list)
+		for vertex in mesh.vertices:
+			positionLoops[id(vertex.position)].append(vertexKey(vertex))
+		output.append(collections.Counter(
+			tuple((vertexKey(vertex), tuple(sorted(positionLoops[id(vertex.position)]))) for vertex in face.vertices)
+			for face in mesh.faces
+		))
+	return output
+
+def main():
+	cases = [
+		("grid 20k", 20000, 40, False),
+		("shuffled 20k", 20000, 40, True),
+		("split 150k", 150000, 120, False),
+		("shuffled split 150k", 150000, 120, True),
+	]
+	
+	print("%-20s %7s %8s %8s %8s %8s %9s" % ("mesh", "meshes", "ACMR", "ACMR", "ATVR", "ATVR", "time (s)"))
+	print("%-20s %7s %8s %8s %8s %8s %9s" % ("", "", "before", "after", "before", "after", ""))
+	for (name, faceCount, boneCount, shuffled) in cases:
+		bones = BenchmarkSupport.makeBones(boneCount)
+		def makeMeshes():
+			mesh = BenchmarkSupport.makeSkinnedGridMesh(faceCount, bones)
+			return [shuffleFaces(mesh) if shuffled else mesh]
+		
+		unoptimized = exportModel(makeMeshes(), bones, False)
+		before = FmdlVertexCache.measureFmdlVertexCache(unoptimized)
+		(duration, optimized) = BenchmarkSupport.bestTime(lambda: FmdlVertexCache.optimizeFmdlVertexCache(unoptimized), repeat = 1)
+		after = FmdlVertexCache.measureFmdlVertexCache(optimized)
+		
+		with tempfile.TemporaryDirectory() as directory:
+			unoptimizedFilename = os.path.join(directory, 'unoptimized.fmdl')
+			optimizedFilename = os.path.join(directory, 'optimized.fmdl')
+			exportModel(makeMeshes(), bones, False).writeFile(unoptimizedFilename)
+			exportModel(makeMeshes(), bones, True).writeFile(optimizedFilename)
+			if importedGeometry(unoptimizedFilename) != importedGeometry(optimizedFilename):
+				raise AssertionError("%s: optimized model imports differently" % name)
+		
+		faces = [len(mesh.faces) for mesh in unoptimized.meshes]
+		vertices = [len(mesh.vertices) for mesh in unoptimized.meshes]
+		def total(statistics, field, counts):
+			return sum(entry[field] * count for (entry, count) in zip(statistics, counts))
+		print("%-20s %7d %8.3f %8.3f %8.3f %8.3f %9.2f" % (
+			name,
+			len(unoptimized.meshes),
+			total(before, 0, faces) / sum(faces),
+			total(after, 0, faces) / sum(faces),
+			total(before, 0, faces) / sum(vertices),
+			total(after, 0, faces) / sum(vertices),
+			duration,
+		))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,171 @@
+#
+# Compares the vectorized FmdlFile.parseVerticesVectorized() on synthetic
+# meshes with parseVertices(), the per-vertex decoder it replaced, which is
+# kept here as its reference implementation.
+#
+import os
+import tempfile
+from struct import unpack
+
+import BenchmarkSupport
+from BenchmarkSupport import FmdlFile
+
+#
+# The reference implementation of FmdlFile.parseVerticesVectorized(), which
+# decodes one vertex at a time.
+#
+def parseVertices(fmdl, format, boneGroup, vertexCount):
+	#
+	# This function assumes that:
+	# - no datum type in format occurs more than once;
+	# - each uv field is present only if all preceeding ones are also present;
+	# - boneWeights is present if and only if boneIndices is present.
+	#
+	
+	if 2 not in fmdl.segment1Blocks:
+		raise FmdlFile.InvalidFmdl("Vertex block not found")
+	
+	vertexBuffer = fmdl.segment1Blocks[2]
+	
+	vertices = []
+	vertexEncodings = []
+	for vertexIndex in range(vertexCount):
+		vertex = FmdlFile.FmdlFile.Vertex()
+		vertexEncoding = FmdlFile.FmdlFile.VertexEncoding()
+		vertexEncoding.vertex = vertex
+		
+		uvEncoding = [None for i in range(4)]
+		uv = [None for i in range(4)]
+		boneWeights = None
+		boneIndices = None
+		
+		for (datumType, datumFormat, offset, increment) in format:
+			position = offset + vertexIndex * increment
+			
+			if datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.position:
+				if datumFormat != FmdlFile.FmdlFile.FmdlVertexDatumFormat.tripleFloat32:
+					raise FmdlFile.InvalidFmdl("Unexpected format %d for vertex position data" % datumFormat)
+				vertexEncoding.position = vertexBuffer[position : position + 12]
+				value = unpack('< 3f', vertexEncoding.position)
+				vertex.position = FmdlFile.FmdlFile.Vector3(value[0], value[1], value[2])
+			elif datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.boneWeights:
+				if datumFormat != FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadFloat8:
+					raise FmdlFile.InvalidFmdl("Unexpected format %d for vertex bone weight data" % datumFormat)
+				boneWeights = unpack('< 4B', vertexBuffer[position : position + 4])
+			elif datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.normal:
+				if datumFormat != FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadFloat16:
+					raise FmdlFile.InvalidFmdl("Unexpected format %d for vertex normal data" % datumFormat)
+				vertexEncoding.normal = vertexBuffer[position : position + 8]
+				value = [FmdlFile.FmdlFile.parseFloat16(x) for x in unpack('< 4H', vertexEncoding.normal)]
+				vertex.normal = FmdlFile.FmdlFile.Vector4(value[0], value[1], value[2], value[3])
+			elif datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.color:
+				if datumFormat != FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadFloat8:
+					raise FmdlFile.InvalidFmdl("Unexpected format %d for vertex color data" % datumFormat)
+				vertexEncoding.color = vertexBuffer[position : position + 4]
+				vertex.color = [x / 255.0 for x in unpack('< 4B', vertexEncoding.color)]
+			elif datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.boneIndices:
+				if datumFormat != FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadInt8:
+					raise FmdlFile.InvalidFmdl("Unexpected format %d for vertex bone index data" % datumFormat)
+				boneIndices = unpack('< 4B', vertexBuffer[position : position + 4])
+			elif datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.uv0:
+				if datumFormat == FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
+					uvEncoding[0] = vertexBuffer[position : position + 4]
+					value = [FmdlFile.FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[0])]
+				elif datumFormat == FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
+					uvEncoding[0] = vertexBuffer[position : position + 8]
+					value = unpack('< 2f', uvEncoding[0])
+				else:
+					raise FmdlFile.InvalidFmdl("Unexpected format %d for vertex uv data" % datumFormat)
+				uv[0] = FmdlFile.FmdlFile.Vector2(value[0], value[1])
+			elif datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.uv1:
+				if datumFormat == FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
+					uvEncoding[1] = vertexBuffer[position : position + 4]
+					value = [FmdlFile.FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[1])]
+				elif datumFormat == FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
+					uvEncoding[1] = vertexBuffer[position : position + 8]
+					value = unpack('< 2f', uvEncoding[1])
+				uv[1] = FmdlFile.FmdlFile.Vector2(value[0], value[1])
+			elif datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.uv2:
+				if datumFormat == FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
+					uvEncoding[2] = vertexBuffer[position : position + 4]
+					value = [FmdlFile.FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[2])]
+				elif datumFormat == FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
+					uvEncoding[2] = vertexBuffer[position : position + 8]
+					value = unpack('< 2f', uvEncoding[2])
+				uv[2] = FmdlFile.FmdlFile.Vector2(value[0], value[1])
+			elif datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.uv3:
+				if datumFormat == FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
+					uvEncoding[3] = vertexBuffer[position : position + 4]
+					value = [FmdlFile.FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[3])]
+				elif datumFormat == FmdlFile.FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
+					uvEncoding[3] = vertexBuffer[position : position + 8]
+					value = unpack('< 2f', uvEncoding[3])
+				uv[3] = FmdlFile.FmdlFile.Vector2(value[0], value[1])
+			elif datumType == FmdlFile.FmdlFile.FmdlVertexDatumType.tangent:
+				if datumFormat != FmdlFile.FmdlFile.FmdlVertexDatumFormat.quadFloat16:
+					raise FmdlFile.InvalidFmdl("Unexpected format %d for vertex tangent data" % datumFormat)
+				vertexEncoding.tangent = vertexBuffer[position : position + 8]
+				value = [FmdlFile.FmdlFile.parseFloat16(x) for x in unpack('< 4H', vertexEncoding.tangent)]
+				vertex.tangent = FmdlFile.FmdlFile.Vector4(value[0], value[1], value[2], value[3])
+			else:
+				raise FmdlFile.InvalidFmdl("Unexpected vertex datum type %d" % datumType)
+		
+		for i in range(4):
+			if uv[i] != None:
+				vertex.uv.append(uv[i])
+				vertexEncoding.uv.append(uvEncoding[i])
+		
+		if boneWeights != None:
+			vertex.boneMapping = {}
+			vertexEncoding.boneMapping = []
+			for i in range(4):
+				if boneWeights[i] > 0:
+					if not boneIndices[i] < len(boneGroup.bones):
+						#
+						# This happens a fair few times in real models.
+						# Let's just ignore the bone weighting instead.
+						#
+						# WARNING
+						#raise FmdlFile.InvalidFmdl("Invalid bone ID %d referenced by vertex" % boneIndices[i])
+						continue
+					
+					vertex.boneMapping[boneGroup.bones[boneIndices[i]]] = boneWeights[i] / 255.0
+					vertexEncoding.boneMapping.append((boneGroup.bones[boneIndices[i]], boneWeights[i]))
+		
+		vertices.append(vertex)
+		vertexEncodings.append(vertexEncoding)
+	return (vertices, vertexEncodings)
+
+def main():
+	bones = BenchmarkSupport.makeBones(30)
+	print("%8s %8s %12s %12s %8s" % ("faces", "vertices", "legacy (s)", "numpy (s)", "speedup"))
+	for faceCount in [2000, 20000]:
+		mesh = BenchmarkSupport.makeSkinnedGridMesh(faceCount, bones)
+		fmdl = BenchmarkSupport.makeModel([mesh], bones)
+		
+		(fileDescriptor, filename) = tempfile.mkstemp(suffix = '.fmdl')
+		os.close(fileDescriptor)
+		try:
+			fmdl.writeFile(filename)
+			container = FmdlFile.FmdlContainer()
+			container.readFile(filename)
+		finally:
+			os.remove(filename)
+		
+		(strings, extensionHeaders) = FmdlFile.FmdlFile.parseStrings(container)
+		boundingBoxes = FmdlFile.FmdlFile.parseBoundingBoxes(container)
+		parsedBones = FmdlFile.FmdlFile.parseBones(container, strings, boundingBoxes)
+		boneGroup = FmdlFile.FmdlFile.parseBoneGroups(container, parsedBones)[0]
+		bufferOffsets = FmdlFile.FmdlFile.parseBufferOffsets(container)
+		format = FmdlFile.FmdlFile.parseMeshFormatAssignments(container, bufferOffsets)[0]
+		vertexCount = len(mesh.vertices)
+		
+		(legacyTime, legacy) = BenchmarkSupport.bestTime(lambda: parseVertices(container, format, boneGroup, vertexCount))
+		(numpyTime, vectorized) = BenchmarkSupport.bestTime(lambda: FmdlFile.FmdlFile.parseVerticesVectorized(container, format, boneGroup, vertexCount))
+		for (a, b) in zip(legacy[1], vectorized[1]):
+			assert bytes(a.position) == b.position and bytes(a.normal) == b.normal and a.boneMapping == b.boneMapping
+		
+		print("%8d %8d %12.3f %12.3f %7.1fx" % (faceCount, vertexCount, legacyTime, numpyTime, legacyTime / numpyTime))
+
+if __name__ == '__main__':
+	main()
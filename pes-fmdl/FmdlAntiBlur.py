@@ -1,11 +1,11 @@
 from . import FmdlFile
 
-def encodeFmdlAntiBlur(fmdl):
-	output = FmdlFile.FmdlFile()
-	output.bones = fmdl.bones.copy()
-	output.materialInstances = fmdl.materialInstances.copy()
-	output.extensionHeaders = fmdl.extensionHeaders.copy()
-	
+#
+# Adds an antiblur mesh after each mesh marked Has-Antiblur-Meshes, modifying
+# fmdl in place. Returns a map from the added antiblur meshes to the meshes
+# they are made from, whose vertices, faces and vertex encoding they share.
+#
+def encodeFmdlAntiBlurInPlace(fmdl):
 	antiBlurMaterials = {}
 	antiBlurMeshes = {}
 	
@@ -55,6 +55,7 @@ def encodeFmdlAntiBlur(fmdl):
 		output.alphaFlags = 128 | (mesh.alphaFlags & 32)
 		output.shadowFlags = 1
 		output.vertexFields = mesh.vertexFields
+		output.vertexEncoding = mesh.vertexEncoding
 		
 		output.extensionHeaders = mesh.extensionHeaders.copy()
 		if 'Has-Antiblur-Meshes' in output.extensionHeaders:
@@ -65,16 +66,16 @@ def encodeFmdlAntiBlur(fmdl):
 		
 		return output
 	
-	output.meshes = []
-	for mesh in fmdl.meshes:
-		output.meshes.append(mesh)
+	meshes = fmdl.meshes
+	fmdl.meshes = []
+	for mesh in meshes:
+		fmdl.meshes.append(mesh)
 		if 'Has-Antiblur-Meshes' in mesh.extensionHeaders:
-			antiBlurMesh = makeAntiBlurMesh(mesh, output)
-			output.meshes.append(antiBlurMesh)
+			antiBlurMesh = makeAntiBlurMesh(mesh, fmdl)
+			fmdl.meshes.append(antiBlurMesh)
 			antiBlurMeshes[mesh] = antiBlurMesh
 	
-	output.meshGroups = fmdl.meshGroups.copy()
-	for meshGroup in output.meshGroups:
+	for meshGroup in fmdl.meshGroups:
 		meshes = meshGroup.meshes
 		meshGroup.meshes = []
 		for mesh in meshes:
@@ -82,10 +83,18 @@ def encodeFmdlAntiBlur(fmdl):
 			if mesh in antiBlurMeshes:
 				meshGroup.meshes.append(antiBlurMeshes[mesh])
 	
-	if 'X-FMDL-Extensions' not in output.extensionHeaders:
-		output.extensionHeaders['X-FMDL-Extensions'] = []
-	output.extensionHeaders['X-FMDL-Extensions'].append("antiblur")
+	if 'X-FMDL-Extensions' not in fmdl.extensionHeaders:
+		fmdl.extensionHeaders['X-FMDL-Extensions'] = []
+	fmdl.extensionHeaders['X-FMDL-Extensions'].append("antiblur")
 	
+	sourceMeshes = {}
+	for (mesh, antiBlurMesh) in antiBlurMeshes.items():
+		sourceMeshes[antiBlurMesh] = mesh
+	return sourceMeshes
+
+def encodeFmdlAntiBlur(fmdl):
+	output = fmdl.copyStructure()
+	encodeFmdlAntiBlurInPlace(output)
 	return output
 
 def decodeFmdlAntiBlur(fmdl):
@@ -0,0 +1,85 @@
+from . import FmdlAntiBlur, FmdlMeshSplitting, FmdlSplitVertexEncoding, FmdlVertexCache
+import time
+
+#
+# The export extensions of IO.exportFmdl(), run as a sequence of stages over a
+# single FmdlFile.
+#
+# The encodeFmdl*() functions of the extension modules each build a new
+# FmdlFile, with new meshes and a copy of the mesh group tree. Export stages
+# instead modify the FmdlFile in place, using the *InPlace() variants of these
+# functions, so that the model is built once and each stage only replaces
+# what it changes.
+#
+# Stages also share what they know about the model, in a map from meshes to
+# the meshes they were made from with the same vertices, faces, vertex fields
+# and bone group. Antiblur meshes are such copies of the mesh they are made
+# for, and meshes split from them are copies of the corresponding submeshes.
+# Later stages copy the result of the source mesh for them, rather than
+# encoding, splitting and optimizing the same geometry twice.
+#
+# A stage is a (name, function) pair, where the function takes the FmdlFile
+# and the map of source meshes, and returns a report for the user, or None.
+#
+
+def encodeVerticesStage(fmdl, sourceMeshes):
+	fmdl.precomputeVertexEncoding()
+
+def antiBlurStage(fmdl, sourceMeshes):
+	sourceMeshes.update(FmdlAntiBlur.encodeFmdlAntiBlurInPlace(fmdl))
+
+def vertexLoopPreservationStage(fmdl, sourceMeshes):
+	FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservationInPlace(fmdl, sourceMeshes)
+
+def makeMeshSplittingStage(fragmentStrategy):
+	def meshSplittingStage(fmdl, sourceMeshes):
+		FmdlMeshSplitting.encodeFmdlSplitMeshesInPlace(fmdl, fragmentStrategy, sourceMeshes)
+	return meshSplittingStage
+
+def vertexCacheOptimizationStage(fmdl, sourceMeshes):
+	statisticsBefore = FmdlVertexCache.measureFmdlVertexCache(fmdl)
+	FmdlVertexCache.optimizeFmdlVertexCacheInPlace(fmdl, sourceMeshes)
+	return FmdlVertexCache.describeVertexCacheStatistics(fmdl, statisticsBefore, FmdlVertexCache.measureFmdlVertexCache(fmdl))
+
+def exportStages(
+	enableAntiblur,
+	enableVertexLoopPreservation,
+	enableMeshSplitting,
+	enableVertexCacheOptimization,
+	meshSplittingFragmentStrategy = FmdlMeshSplitting.FRAGMENT_STRATEGY_SORT_VECTOR,
+):
+	stages = []
+	if enableAntiblur:
+		stages.append(('antiblur', antiBlurStage))
+	if enableVertexLoopPreservation:
+		stages.append(('vertex-loop-preservation', vertexLoopPreservationStage))
+	if enableMeshSplitting:
+		stages.append(('mesh-splitting', makeMeshSplittingStage(meshSplittingFragmentStrategy)))
+	if enableVertexCacheOptimization:
+		stages.append(('vertex-cache-optimization', vertexCacheOptimizationStage))
+	
+	#
+	# Encode vertices before antiblur meshes are made, so that they can share
+	# the vertex encoding of the mesh they are made for.
+	#
+	if len(stages) > 0:
+		stages.insert(0, ('vertex-encoding', encodeVerticesStage))
+	return stages
+
+#
+# Runs stages over fmdl, modifying it in place. Returns a tuple
+# (durations, reports): the duration of each stage in seconds, as a list of
+# (name, duration) pairs, and the reports of the stages that returned one, in
+# order.
+#
+def runExportStages(fmdl, stages):
+	sourceMeshes = {}
+	durations = []
+	reports = []
+	for (name, stage) in stages:
+		start = time.perf_counter()
+		report = stage(fmdl, sourceMeshes)
+		durations.append((name, time.perf_counter() - start))
+		if report is not None:
+			reports.append(report)
+	return (durations, reports)
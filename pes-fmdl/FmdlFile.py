@@ -1,10 +1,31 @@
+import contextlib
+import gc
 import math
+import mmap
+import numpy
+import operator
 import struct
+import sys
 from struct import pack, pack_into, unpack, unpack_from
 
 class InvalidFmdl(Exception):
 	pass
 
+#
+# Creating large numbers of small objects, such as the vertices of a mesh,
+# triggers a lot of pointless cyclic garbage collection passes that can easily
+# dominate the run time. Suspend garbage collection for the duration.
+#
+@contextlib.contextmanager
+def suspendedGarbageCollection():
+	enabled = gc.isenabled()
+	gc.disable()
+	try:
+		yield
+	finally:
+		if enabled:
+			gc.enable()
+
 class FmdlContainer:
 	MAGIC = b'FMDL'
 	VERSION_2_03 = 0x4001eb85
@@ -35,8 +56,13 @@ class FmdlContainer:
 		self.version = self.VERSION_2_03
 		self.segment0Blocks = {}
 		self.segment1Blocks = {}
+		self.mapping = None
 	
-	def readStream(self, stream):
+	#
+	# If segment1BlockIDs is given, only the segment 1 blocks it lists are
+	# read. Other segment 1 blocks are skipped entirely.
+	#
+	def readStream(self, stream, segment1BlockIDs = None):
 		header = bytearray(56)
 		if stream.readinto(header) != len(header):
 			raise InvalidFmdl("Incomplete header")
@@ -107,6 +133,8 @@ class FmdlContainer:
 		fileLength = stream.tell()
 		
 		for (blockID, sectionOffset, length) in section1Descriptors:
+			if segment1BlockIDs is not None and blockID not in segment1BlockIDs:
+				continue
 			if blockID in self.segment1Blocks:
 				raise InvalidFmdl("Duplicate segment 1 block %d" % blockID)
 			
@@ -124,10 +152,151 @@ class FmdlContainer:
 				pass
 			self.segment1Blocks[blockID] = block
 	
-	def readFile(self, filename):
-		with open(filename, 'rb') as stream:
-			self.readStream(stream)
+	#
+	# Parses an fmdl file that is already present in memory, such as a memory
+	# mapped file. Instead of copying the file contents, segment 0 entries and
+	# segment 1 blocks are stored as memoryview slices of buffer, which must be
+	# kept alive and unmodified for as long as the blocks are in use. Use
+	# mutableSegment0Block() or mutableSegment1Block() to obtain a private copy
+	# of a block that can be modified.
+	#
+	def readBuffer(self, buffer):
+		data = memoryview(buffer).cast('B')
+		
+		if len(data) < 56:
+			raise InvalidFmdl("Incomplete header")
+		(
+			magic,
+			version,
+			descriptorsOffset,
+			section0Bitmap,
+			section1Bitmap,
+			section0BlockCount,
+			section1BlockCount,
+			section0Offset,
+			section0Length,
+			section1Offset,
+			section1Length,
+		) = unpack_from('< 4s I Q QQ II II II', data, 0)
+		
+		if magic != self.MAGIC:
+			raise InvalidFmdl("Unexpected magic number")
+		
+		self.version = version
+		
+		if descriptorsOffset + section0BlockCount * 8 + section1BlockCount * 12 > len(data):
+			raise InvalidFmdl("Incomplete block descriptor")
+		
+		section0Descriptors = []
+		for i in range(section0BlockCount):
+			(
+				blockID,
+				entryCount,
+				blockOffset,
+			) = unpack_from('< H H I', data, descriptorsOffset + i * 8)
+			section0Descriptors.append((blockID, entryCount, blockOffset))
+		
+		section1Descriptors = []
+		for i in range(section1BlockCount):
+			(
+				blockID,
+				blockOffset,
+				length,
+			) = unpack_from('< I I I', data, descriptorsOffset + section0BlockCount * 8 + i * 12)
+			section1Descriptors.append((blockID, blockOffset, length))
+		
+		for (blockID, entryCount, sectionOffset) in section0Descriptors:
+			if blockID not in self.SECTION0_BLOCK_ENTRY_SIZES:
+				continue
+			entrySize = self.SECTION0_BLOCK_ENTRY_SIZES[blockID]
+			
+			if blockID in self.segment0Blocks:
+				raise InvalidFmdl("Duplicate segment 0 block %d" % blockID)
+			
+			blockOffset = sectionOffset + section0Offset
+			if blockOffset + entryCount * entrySize > len(data):
+				raise InvalidFmdl("Unexpected end of file reading section 0 block %d entry" % blockID)
+			
+			self.segment0Blocks[blockID] = [
+				data[entryOffset : entryOffset + entrySize]
+				for entryOffset in range(blockOffset, blockOffset + entryCount * entrySize, entrySize)
+			]
+		
+		fileLength = len(data)
+		
+		for (blockID, sectionOffset, length) in section1Descriptors:
+			if blockID in self.segment1Blocks:
+				raise InvalidFmdl("Duplicate segment 1 block %d" % blockID)
+			
+			# These block lengths are occasionally set to slightly wrong values.
+			# Interpret them liberally.
+			blockOffset = sectionOffset + section1Offset
+			remainingLength = fileLength - blockOffset
+			if remainingLength < 0:
+				raise InvalidFmdl("Unexpected end of file reading section 1 block %d" % blockID)
+			if length > remainingLength or blockID == 3:
+				length = remainingLength
+			
+			self.segment1Blocks[blockID] = data[blockOffset : blockOffset + length]
 	
+	def readFile(self, filename, mapped = False):
+		if not mapped:
+			with open(filename, 'rb') as stream:
+				self.readStream(stream)
+			return
+		
+		with open(filename, 'rb') as stream:
+			try:
+				mapping = mmap.mmap(stream.fileno(), 0, access = mmap.ACCESS_READ)
+			except ValueError:
+				# Empty files cannot be mapped.
+				raise InvalidFmdl("Incomplete header")
+		self.mapping = mapping
+		self.readBuffer(mapping)
+	
+	#
+	# Releases the file mapping of a container read using readFile(mapped = True).
+	# Blocks that were not copied using mutableSegment*Block() are no longer
+	# available afterwards. If slices of the mapping are still referenced
+	# elsewhere, such as by parsed vertex encodings, the mapping is released
+	# once those are garbage collected instead.
+	#
+	def close(self):
+		if self.mapping is None:
+			return
+		
+		self.segment0Blocks = {}
+		self.segment1Blocks = {}
+		try:
+			self.mapping.close()
+		except BufferError:
+			pass
+		self.mapping = None
+	
+	def mutableSegment0Block(self, blockID):
+		block = self.segment0Blocks[blockID]
+		for i in range(len(block)):
+			if not isinstance(block[i], bytearray):
+				block[i] = bytearray(block[i])
+		return block
+	
+	def mutableSegment1Block(self, blockID):
+		block = self.segment1Blocks[blockID]
+		if isinstance(block, list):
+			block = bytearray(0).join(block)
+			self.segment1Blocks[blockID] = block
+		elif not isinstance(block, bytearray):
+			block = bytearray(block)
+			self.segment1Blocks[blockID] = block
+		return block
+	
+	#
+	# All offsets are computed up front, after which the header, the
+	# descriptors and the blocks are passed to stream.writelines() as they
+	# are, without first being concatenated into one buffer. Besides a single
+	# buffer, a segment 1 block may also be a list of buffers, which are
+	# written one after another.
+	#
 	def writeStream(self, stream):
 		section0Bitmap = 0
 		section1Bitmap = 0
@@ -135,8 +304,8 @@ class FmdlContainer:
 		section0Descriptors = []
 		section1Descriptors = []
 		
-		section0Blocks = []
-		section1Blocks = []
+		section0Chunks = []
+		section1Chunks = []
 		
 		offset = 0
 		for i in range(64):
@@ -144,21 +313,22 @@ class FmdlContainer:
 				continue
 			
 			entries = self.segment0Blocks[i]
-			block = bytearray(0).join(entries)
+			blockLength = sum(len(entry) for entry in entries)
 			descriptor = pack('< H H I', i, len(entries), offset)
-			if len(block) % 16:
+			section0Chunks += entries
+			if blockLength % 16:
 				# This is more padding than used by some PES fmdl files, but certainly safe.
-				padding = 16 - (len(block) % 16)
-				block += bytearray(padding)
+				padding = 16 - (blockLength % 16)
+				section0Chunks.append(bytes(padding))
+				blockLength += padding
 			
 			section0Bitmap |= (1 << i)
 			section0Descriptors.append(descriptor)
-			section0Blocks.append(block)
-			offset += len(block)
+			offset += blockLength
 		section0Length = offset
 		if section0Length % 16:
 			padding = 16 - (section0Length % 16)
-			section0Blocks.append(bytearray(padding))
+			section0Chunks.append(bytes(padding))
 			section0Length += padding
 		
 		offset = 0
@@ -167,12 +337,17 @@ class FmdlContainer:
 				continue
 			
 			block = self.segment1Blocks[i]
-			descriptor = pack('< I I I', i, offset, len(block))
+			if isinstance(block, list):
+				blockChunks = block
+			else:
+				blockChunks = [block]
+			blockLength = sum(len(chunk) for chunk in blockChunks)
+			descriptor = pack('< I I I', i, offset, blockLength)
 			
 			section1Bitmap |= (1 << i)
 			section1Descriptors.append(descriptor)
-			section1Blocks.append(block)
-			offset += len(block)
+			section1Chunks += blockChunks
+			offset += blockLength
 		section1Length = offset
 		
 		descriptors = bytearray(0).join(section0Descriptors + section1Descriptors)
@@ -199,9 +374,7 @@ class FmdlContainer:
 			0,
 		)
 		
-		totalContent = [header] + [descriptors] + section0Blocks + section1Blocks
-		for chunk in totalContent:
-			stream.write(chunk)
+		stream.writelines([header, descriptors] + section0Chunks + section1Chunks)
 	
 	def writeFile(self, filename):
 		with open(filename, 'wb') as stream:
@@ -325,6 +498,14 @@ class FmdlFile:
 		def __init__(self):
 			self.vertices = []
 			self.faces = []
+			self.initAttributes()
+			self.vertexEncoding = None
+		
+		#
+		# Sets the members other than vertices, faces and vertexEncoding,
+		# which ColumnarMesh and LazyMesh store differently.
+		#
+		def initAttributes(self):
 			self.boneGroup = None
 			self.materialInstance = None
 			self.alphaFlags = None
@@ -332,7 +513,277 @@ class FmdlFile:
 			self.vertexFields = None
 			# extension fields
 			self.extensionHeaders = set()
-			self.vertexEncoding = None
+		
+		#
+		# Returns whether the geometry of this mesh is described by the
+		# arrays of a ColumnarMesh, rather than by Vertex and Face objects.
+		#
+		def isColumnar(self):
+			return False
+	
+	#
+	# A mesh that stores its geometry as numpy arrays with one row per vertex
+	# or face, rather than as Vertex and Face objects:
+	# - positions: (n, 3) floats
+	# - normals, tangents: (n, 4) floats, or None
+	# - colors: (n, 4) floats in the range [0, 1], or None
+	# - uvs: a list of (n, 2) float arrays, one per uv map
+	# - boneIndices: (n, 4) uint8 indices into boneGroup.bones, or None
+	# - boneWeights: (n, 4) uint8 weights in units of 1/255, or None
+	# - faceIndices: (m, 3) int32 vertex indices
+	#
+	# Half float columns with numpy dtype float16 are stored exactly as they
+	# are; other float columns are converted the way encodeVertices() converts
+	# Vertex objects. Meshes read by readFile() keep the precision of the file,
+	# so writing them back reproduces the original encoding.
+	#
+	# The vertices, faces and vertexEncoding members of a regular Mesh are
+	# available as a compatibility view that is built on first use. The view
+	# is a snapshot: modifying the objects in it does not change the arrays,
+	# and is not reflected by writeFile(). Assigned vertices or faces take the
+	# place of the view, as they would in a regular Mesh; from then on, the
+	# arrays no longer describe the mesh, and isColumnar() returns False.
+	#
+	class ColumnarMesh(Mesh):
+		def __init__(self):
+			self.initAttributes()
+			self.positions = numpy.zeros((0, 3), dtype = numpy.float32)
+			self.normals = None
+			self.tangents = None
+			self.colors = None
+			self.uvs = []
+			self.boneIndices = None
+			self.boneWeights = None
+			self.faceIndices = numpy.zeros((0, 3), dtype = numpy.int32)
+			# For each vertex record, the index of the vertex it is a loop of,
+			# as decoded by the vertex loop preservation extension; None if
+			# each record is a vertex of its own.
+			self.loopVertexIndices = None
+			
+			self.cachedVertices = None
+			self.cachedFaces = None
+			self.cachedVertexEncoding = None
+			self.assignedVertices = None
+			self.assignedFaces = None
+		
+		def isColumnar(self):
+			return self.assignedVertices is None and self.assignedFaces is None
+		
+		@property
+		def vertices(self):
+			if self.assignedVertices is not None:
+				return self.assignedVertices
+			return self.viewVertices()
+		
+		@vertices.setter
+		def vertices(self, vertices):
+			self.assignedVertices = vertices
+		
+		@property
+		def faces(self):
+			if self.assignedFaces is not None:
+				return self.assignedFaces
+			if self.cachedFaces is None:
+				self.cachedFaces = FmdlFile.makeFaces(self.faceIndices, self.viewVertices())
+			return self.cachedFaces
+		
+		@faces.setter
+		def faces(self, faces):
+			self.assignedFaces = faces
+		
+		#
+		# Once vertices or faces are assigned, only an assigned vertex
+		# encoding is returned, as for a regular Mesh.
+		#
+		@property
+		def vertexEncoding(self):
+			if self.cachedVertexEncoding is None and self.isColumnar():
+				if self.cachedVertices is None:
+					self.viewVertices()
+				else:
+					(vertices, vertexEncoding) = self.makeVertices()
+					for (vertex, encodedVertex) in zip(self.cachedVertices, vertexEncoding):
+						encodedVertex.vertex = vertex
+					self.cachedVertexEncoding = vertexEncoding
+			return self.cachedVertexEncoding
+		
+		@vertexEncoding.setter
+		def vertexEncoding(self, vertexEncoding):
+			self.cachedVertexEncoding = vertexEncoding
+		
+		def viewVertices(self):
+			if self.cachedVertices is None:
+				(self.cachedVertices, vertexEncoding) = self.makeVertices()
+				if self.cachedVertexEncoding is None:
+					self.cachedVertexEncoding = vertexEncoding
+			return self.cachedVertices
+		
+		def makeVertices(self):
+			values = {
+				'position': self.positions,
+				'normal': self.normals,
+				'tangent': self.tangents,
+				'color': self.colors,
+			}
+			for i in range(len(self.uvs)):
+				values['uv%d' % i] = self.uvs[i]
+			(vertices, vertexEncoding) = FmdlFile.makeVertices(self.encodeColumns(), self.boneGroup, len(self.positions), values)
+			
+			#
+			# Loops of the same vertex share the position and bone mapping of
+			# its first loop, as they do in meshes decoded by
+			# FmdlSplitVertexEncoding.decodeMeshVertexLoopPreservation().
+			#
+			if self.loopVertexIndices is not None:
+				(vertexIndices, firstLoopIndices) = self.vertexLoops()
+				continuedIndices = numpy.flatnonzero(firstLoopIndices[vertexIndices] != numpy.arange(len(vertexIndices)))
+				for (index, firstIndex) in zip(continuedIndices.tolist(), firstLoopIndices[vertexIndices[continuedIndices]].tolist()):
+					vertices[index].position = vertices[firstIndex].position
+					vertices[index].boneMapping = vertices[firstIndex].boneMapping
+			return (vertices, vertexEncoding)
+		
+		#
+		# Returns, for each vertex record, the index of the vertex it is a loop
+		# of, and for each vertex, the index of its first loop. Vertices are
+		# numbered in order of their first loop.
+		#
+		def vertexLoops(self):
+			if self.loopVertexIndices is None:
+				indices = numpy.arange(len(self.positions))
+				return (indices, indices)
+			(uniqueIndices, firstLoopIndices, vertexIndices) = numpy.unique(self.loopVertexIndices, return_index = True, return_inverse = True)
+			order = numpy.argsort(firstLoopIndices, kind = 'stable')
+			ranks = numpy.empty(len(order), dtype = numpy.int64)
+			ranks[order] = numpy.arange(len(order))
+			return (ranks[vertexIndices.ravel()], firstLoopIndices[order])
+		
+		#
+		# Returns the bone mapping of each vertex record as a pair of
+		# (vertexCount, 4) arrays of bone indices into boneGroup and weights,
+		# holding the same (bone, weight) pairs as the boneMapping of the
+		# Vertex objects built by makeVertices(). Slots that do not contribute
+		# to it have weight 0: unused and invalid slots, and slots whose bone
+		# is mapped again by a later slot of the same record.
+		#
+		def boneMappingColumns(self):
+			indices = numpy.asarray(self.boneIndices, dtype = numpy.int64)
+			weights = numpy.asarray(self.boneWeights, dtype = numpy.uint8)
+			used = (weights > 0) & (indices < len(self.boneGroup.bones))
+			contributes = used.copy()
+			for slot in range(indices.shape[1]):
+				for laterSlot in range(slot + 1, indices.shape[1]):
+					contributes[:, slot] &= ~(used[:, laterSlot] & (indices[:, laterSlot] == indices[:, slot]))
+			return (indices, numpy.where(contributes, weights, 0).astype(numpy.uint8))
+		
+		#
+		# Returns the vertex data as it would be stored in the file, as a
+		# dictionary from VERTEX_DATUM_FIELDS field names to arrays of the
+		# corresponding element types. Bone mappings are compacted the way
+		# makeVertices() reads them: unused and invalid bone slots are
+		# dropped, and the remaining ones moved to the front. Bone indices
+		# remain indices into boneGroup.
+		#
+		def encodeColumns(self):
+			records = FmdlFile.encodeVertexColumns(self.vertexFields, self.positions, self.normals, self.tangents, self.colors, self.uvs)
+			if self.vertexFields.hasBoneMapping:
+				weights = numpy.asarray(self.boneWeights, dtype = numpy.uint8)
+				indices = numpy.asarray(self.boneIndices, dtype = numpy.uint8)
+				used = (weights > 0) & (indices < len(self.boneGroup.bones))
+				order = numpy.argsort(~used, axis = 1, kind = 'stable')
+				records['boneWeights'] = numpy.take_along_axis(numpy.where(used, weights, 0), order, axis = 1).astype(numpy.uint8)
+				records['boneIndices'] = numpy.take_along_axis(numpy.where(used, indices, 0), order, axis = 1).astype(numpy.uint8)
+			return records
+		
+		#
+		# Sets the vertex arrays from vertex records returned by
+		# parseVertexRecords(), copying them out of the vertex buffer.
+		#
+		def setVertexRecords(self, records, vertexCount):
+			if 'position' in records:
+				self.positions = numpy.array(records['position'])
+			else:
+				self.positions = numpy.zeros((vertexCount, 3), dtype = numpy.float32)
+			if 'normal' in records:
+				self.normals = numpy.array(records['normal'])
+			if 'tangent' in records:
+				self.tangents = numpy.array(records['tangent'])
+			if 'color' in records:
+				self.colors = records['color'] / 255.0
+			self.uvs = []
+			for i in range(4):
+				if 'uv%d' % i in records:
+					self.uvs.append(numpy.array(records['uv%d' % i]))
+			if 'boneIndices' in records:
+				self.boneIndices = numpy.array(records['boneIndices'])
+				self.boneWeights = numpy.array(records['boneWeights'])
+			self.loopVertexIndices = None
+			self.cachedVertices = None
+			self.cachedFaces = None
+			self.cachedVertexEncoding = None
+	
+	#
+	# A mesh whose vertices and faces are only decoded when vertices, faces or
+	# vertexEncoding is first accessed, as created by readFile(lazy = True).
+	# Until then, the mesh keeps a reference to the fmdl container it was read
+	# from. Errors in the vertex or face data are only reported once the
+	# geometry is decoded.
+	#
+	class LazyMesh(Mesh):
+		def __init__(self, fmdl, format, vertexCount, faceBufferOffset, firstFaceVertexIndex, faceVertexCount):
+			self.initAttributes()
+			
+			self.fmdl = fmdl
+			self.format = format
+			self.vertexCount = vertexCount
+			self.faceBufferOffset = faceBufferOffset
+			self.firstFaceVertexIndex = firstFaceVertexIndex
+			self.faceVertexCount = faceVertexCount
+			
+			self.decodedVertices = None
+			self.decodedFaces = None
+			self.decodedVertexEncoding = None
+		
+		def decodeGeometry(self):
+			if self.fmdl is None:
+				return
+			
+			(vertices, vertexEncoding) = FmdlFile.parseVerticesVectorized(self.fmdl, self.format, self.boneGroup, self.vertexCount)
+			faces = FmdlFile.parseFaces(self.fmdl, self.faceBufferOffset, self.firstFaceVertexIndex, self.faceVertexCount, vertices)
+			
+			self.decodedVertices = vertices
+			self.decodedFaces = faces
+			self.decodedVertexEncoding = vertexEncoding
+			self.fmdl = None
+		
+		@property
+		def vertices(self):
+			self.decodeGeometry()
+			return self.decodedVertices
+		
+		@vertices.setter
+		def vertices(self, vertices):
+			self.decodeGeometry()
+			self.decodedVertices = vertices
+		
+		@property
+		def faces(self):
+			self.decodeGeometry()
+			return self.decodedFaces
+		
+		@faces.setter
+		def faces(self, faces):
+			self.decodeGeometry()
+			self.decodedFaces = faces
+		
+		@property
+		def vertexEncoding(self):
+			self.decodeGeometry()
+			return self.decodedVertexEncoding
+		
+		@vertexEncoding.setter
+		def vertexEncoding(self, vertexEncoding):
+			self.decodeGeometry()
+			self.decodedVertexEncoding = vertexEncoding
 	
 	class MeshGroup:
 		extensionHeaders = {
@@ -374,6 +825,50 @@ class FmdlFile:
 		quadFloat8 = 8
 		quadInt8 = 9
 	
+	#
+	# For each vertex datum type: the field name used for it in vertex record
+	# arrays, a description used in error messages, and the numpy element type
+	# and element count of each datum format supported for it. Half floats are
+	# represented as numpy float16, which converts to the same values as
+	# parseFloat16().
+	#
+	VERTEX_DATUM_FIELDS = {
+		FmdlVertexDatumType.position: ('position', 'position', {
+			FmdlVertexDatumFormat.tripleFloat32: ('<f4', 3),
+		}),
+		FmdlVertexDatumType.boneWeights: ('boneWeights', 'bone weight', {
+			FmdlVertexDatumFormat.quadFloat8: ('u1', 4),
+		}),
+		FmdlVertexDatumType.normal: ('normal', 'normal', {
+			FmdlVertexDatumFormat.quadFloat16: ('<f2', 4),
+		}),
+		FmdlVertexDatumType.color: ('color', 'color', {
+			FmdlVertexDatumFormat.quadFloat8: ('u1', 4),
+		}),
+		FmdlVertexDatumType.boneIndices: ('boneIndices', 'bone index', {
+			FmdlVertexDatumFormat.quadInt8: ('u1', 4),
+		}),
+		FmdlVertexDatumType.uv0: ('uv0', 'uv', {
+			FmdlVertexDatumFormat.doubleFloat16: ('<f2', 2),
+			FmdlVertexDatumFormat.doubleFloat32: ('<f4', 2),
+		}),
+		FmdlVertexDatumType.uv1: ('uv1', 'uv', {
+			FmdlVertexDatumFormat.doubleFloat16: ('<f2', 2),
+			FmdlVertexDatumFormat.doubleFloat32: ('<f4', 2),
+		}),
+		FmdlVertexDatumType.uv2: ('uv2', 'uv', {
+			FmdlVertexDatumFormat.doubleFloat16: ('<f2', 2),
+			FmdlVertexDatumFormat.doubleFloat32: ('<f4', 2),
+		}),
+		FmdlVertexDatumType.uv3: ('uv3', 'uv', {
+			FmdlVertexDatumFormat.doubleFloat16: ('<f2', 2),
+			FmdlVertexDatumFormat.doubleFloat32: ('<f4', 2),
+		}),
+		FmdlVertexDatumType.tangent: ('tangent', 'tangent', {
+			FmdlVertexDatumFormat.quadFloat16: ('<f2', 4),
+		}),
+	}
+	
 	
 	
 	def __init__(self):
@@ -442,6 +937,54 @@ class FmdlFile:
 		
 		return (sign << (exponentBits + mantissaBits)) | (biasedExponent << mantissaBits) | (mantissa)
 	
+	#
+	# Array versions of parseFloat16() and encodeFloat16(), operating on entire
+	# columns of values at once. parseFloat16Array() takes an array of 16 bit
+	# integers and returns a float64 array; encodeFloat16Array() does the
+	# reverse. Both produce exactly the same values as their scalar
+	# counterparts; in particular, encodeFloat16Array() rounds towards zero
+	# rather than to nearest, unlike numpy's own float16 conversion.
+	#
+	@staticmethod
+	def parseFloat16Array(int16s):
+		return numpy.asarray(int16s, dtype = numpy.uint16).view(numpy.float16).astype(numpy.float64)
+	
+	@staticmethod
+	def encodeFloat16Array(floatValues):
+		exponentBits = 5
+		exponentBias = 15
+		mantissaBits = 10
+		
+		floatValues = numpy.asarray(floatValues, dtype = numpy.float64)
+		
+		signs = (floatValues < 0.0).astype(numpy.uint16)
+		(candidateMantissas, exponents) = numpy.frexp(numpy.abs(floatValues))
+		
+		finite = numpy.isfinite(floatValues)
+		nonzero = finite & (candidateMantissas >= 0.1)
+		denormal = nonzero & (exponents < -exponentBias + 2)
+		overflow = nonzero & ~denormal & (exponents > exponentBias + 1)
+		normal = nonzero & ~denormal & ~overflow
+		
+		biasedExponents = numpy.zeros(floatValues.shape, dtype = numpy.uint16)
+		mantissas = numpy.zeros(floatValues.shape, dtype = numpy.uint16)
+		
+		biasedExponents[numpy.isnan(floatValues)] = 31
+		mantissas[numpy.isnan(floatValues)] = ~(~0 << mantissaBits)
+		biasedExponents[numpy.isinf(floatValues)] = 31
+		
+		mantissas[denormal] = numpy.trunc(numpy.ldexp(
+			candidateMantissas[denormal],
+			exponentBias + mantissaBits - 1 + exponents[denormal],
+		))
+		
+		biasedExponents[overflow] = 31
+		
+		biasedExponents[normal] = exponents[normal] - 1 + exponentBias
+		mantissas[normal] = numpy.trunc(((candidateMantissas[normal] * 2.0) - 1.0) * 2 ** mantissaBits)
+		
+		return (signs << (exponentBits + mantissaBits)) | (biasedExponents << mantissaBits) | mantissas
+	
 	
 	
 	@staticmethod
@@ -598,7 +1141,7 @@ class FmdlFile:
 		return assignments
 	
 	@staticmethod
-	def parseMeshes(fmdl, bones, materialInstances, extensionHeaders):
+	def parseMeshes(fmdl, bones, materialInstances, extensionHeaders, columnar = False, lazy = False):
 		if 3 not in fmdl.segment0Blocks:
 			return []
 		
@@ -708,30 +1251,42 @@ class FmdlFile:
 				raise InvalidFmdl("Invalid face index ID %d referenced by mesh" % firstFaceIndexID)
 			(lodFirstFaceVertexIndex, lodFaceVertexCount) = faceIndices[firstFaceIndexID]
 			
-			(vertices, vertexEncodings) = FmdlFile.parseVertices(fmdl, meshFormats[meshFormatID], boneGroup, vertexCount)
-			faces = FmdlFile.parseFaces(fmdl, bufferOffsets[2], firstFaceVertexIndex + lodFirstFaceVertexIndex, lodFaceVertexCount, vertices)
-			
-			mesh = FmdlFile.Mesh()
-			mesh.vertices = vertices
-			mesh.faces = faces
+			if columnar:
+				mesh = FmdlFile.ColumnarMesh()
+				mesh.setVertexRecords(FmdlFile.parseVertexRecords(fmdl, meshFormats[meshFormatID], vertexCount), vertexCount)
+				mesh.faceIndices = FmdlFile.parseFaceIndexArray(fmdl, bufferOffsets[2], firstFaceVertexIndex + lodFirstFaceVertexIndex, lodFaceVertexCount, vertexCount)
+			elif lazy:
+				mesh = FmdlFile.LazyMesh(fmdl, meshFormats[meshFormatID], vertexCount, bufferOffsets[2], firstFaceVertexIndex + lodFirstFaceVertexIndex, lodFaceVertexCount)
+			else:
+				(vertices, vertexEncodings) = FmdlFile.parseVerticesVectorized(fmdl, meshFormats[meshFormatID], boneGroup, vertexCount)
+				faces = FmdlFile.parseFaces(fmdl, bufferOffsets[2], firstFaceVertexIndex + lodFirstFaceVertexIndex, lodFaceVertexCount, vertices)
+				
+				mesh = FmdlFile.Mesh()
+				mesh.vertices = vertices
+				mesh.faces = faces
+				mesh.vertexEncoding = vertexEncodings
 			mesh.boneGroup = boneGroup
 			mesh.materialInstance = materialInstance
 			mesh.alphaFlags = alphaFlags
 			mesh.shadowFlags = shadowFlags
 			mesh.vertexFields = vertexFields
-			mesh.vertexEncoding = vertexEncodings
 			mesh.extensionHeaders = FmdlFile.parseObjectExtensionHeaders(extensionHeaders, FmdlFile.Mesh.extensionHeaders, len(meshes))
 			meshes.append(mesh)
 		return meshes
 	
+	#
+	# If parameterValues is False, material parameter values are not read,
+	# and material instance parameters are stored as (name, None) pairs.
+	#
 	@staticmethod
-	def parseMaterialInstances(fmdl, strings):
+	def parseMaterialInstances(fmdl, strings, parameterValues = True):
 		if 4 not in fmdl.segment0Blocks:
 			return []
 		
 		materials = FmdlFile.parseMaterials(fmdl, strings)
 		textures = FmdlFile.parseTextures(fmdl, strings)
-		materialParameters = FmdlFile.parseMaterialParameters(fmdl)
+		if parameterValues:
+			materialParameters = FmdlFile.parseMaterialParameters(fmdl)
 		assignments = FmdlFile.parseTextureMaterialParameterAssignments(fmdl, strings)
 		
 		materialInstances = []
@@ -776,9 +1331,12 @@ class FmdlFile:
 					raise InvalidFmdl("Invalid texture / material parameter assignment %d referenced by material instance" % i)
 				(materialParameterName, materialParameterID) = assignments[i]
 				
-				if not materialParameterID < len(materialParameters):
+				if not parameterValues:
+					parameters = None
+				elif not materialParameterID < len(materialParameters):
 					raise InvalidFmdl("Invalid material parameter %d referenced by material parameter assignment" % materialParameterID)
-				parameters = materialParameters[materialParameterID]
+				else:
+					parameters = materialParameters[materialParameterID]
 				
 				if materialParameterName in instanceMaterialParameters:
 					raise InvalidFmdl("Duplicate material parameters '%s' used by material instance" % materialParameterName)
@@ -1127,144 +1685,196 @@ class FmdlFile:
 			materialParameters.append(parameters)
 		return materialParameters
 	
+	#
+	# Decodes the vertex data of all vertices of a mesh at once.
+	# Returns a dict mapping VERTEX_DATUM_FIELDS field names to
+	# (vertexCount, N) numpy arrays. All datums sharing a buffer stride are
+	# decoded through a single structured dtype laid over the vertex buffer,
+	# so the returned arrays are views of the vertex buffer, not copies.
+	#
 	@staticmethod
-	def parseVertices(fmdl, format, boneGroup, vertexCount):
-		#
-		# This function assumes that:
-		# - no datum type in format occurs more than once;
-		# - each uv field is present only if all preceeding ones are also present;
-		# - boneWeights is present if and only if boneIndices is present.
-		#
-		
+	def parseVertexRecords(fmdl, format, vertexCount):
 		if 2 not in fmdl.segment1Blocks:
 			raise InvalidFmdl("Vertex block not found")
 		
 		vertexBuffer = fmdl.segment1Blocks[2]
 		
-		vertices = []
-		vertexEncodings = []
-		for vertexIndex in range(vertexCount):
-			vertex = FmdlFile.Vertex()
-			vertexEncoding = FmdlFile.VertexEncoding()
-			vertexEncoding.vertex = vertex
-			
-			uvEncoding = [None for i in range(4)]
-			uv = [None for i in range(4)]
-			boneWeights = None
-			boneIndices = None
+		fields = {}
+		for (datumType, datumFormat, offset, increment) in format:
+			if datumType not in FmdlFile.VERTEX_DATUM_FIELDS:
+				raise InvalidFmdl("Unexpected vertex datum type %d" % datumType)
+			(fieldName, description, fieldFormats) = FmdlFile.VERTEX_DATUM_FIELDS[datumType]
+			if datumFormat not in fieldFormats:
+				#
+				# Formats only matter for decoding vertices, so an empty mesh
+				# with an invalid format is fine.
+				#
+				if vertexCount == 0:
+					continue
+				raise InvalidFmdl("Unexpected format %d for vertex %s data" % (datumFormat, description))
+			(elementType, elementCount) = fieldFormats[datumFormat]
+			fields[fieldName] = (numpy.dtype((elementType, elementCount)), offset, increment)
+		
+		if vertexCount == 0:
+			return dict((fieldName, numpy.zeros((0,) + dtype.shape, dtype.base)) for (fieldName, (dtype, offset, increment)) in fields.items())
+		
+		fieldsPerIncrement = {}
+		for (fieldName, (dtype, offset, increment)) in fields.items():
+			if increment not in fieldsPerIncrement:
+				fieldsPerIncrement[increment] = []
+			fieldsPerIncrement[increment].append((fieldName, dtype, offset))
+		
+		records = {}
+		for (increment, recordFields) in fieldsPerIncrement.items():
+			baseOffset = min(offset for (fieldName, dtype, offset) in recordFields)
+			recordType = numpy.dtype({
+				'names': [fieldName for (fieldName, dtype, offset) in recordFields],
+				'formats': [dtype for (fieldName, dtype, offset) in recordFields],
+				'offsets': [offset - baseOffset for (fieldName, dtype, offset) in recordFields],
+			})
+			if baseOffset + (vertexCount - 1) * increment + recordType.itemsize > len(vertexBuffer):
+				raise InvalidFmdl("Vertex buffer too small for %d vertices" % vertexCount)
+			recordArray = numpy.ndarray((vertexCount, ), recordType, vertexBuffer, baseOffset, (increment, ))
+			for (fieldName, dtype, offset) in recordFields:
+				records[fieldName] = recordArray[fieldName]
+		return records
+	
+	#
+	# Builds the Vertex and VertexEncoding objects of a mesh from the vertex
+	# records returned by parseVertexRecords().
+	# If values is given, it maps field names to arrays from which the Vertex
+	# objects take their values, instead of decoding them from the records.
+	#
+	@staticmethod
+	def makeVertices(records, boneGroup, vertexCount, values = None):
+		def rowEncodings(fieldName):
+			if fieldName not in records:
+				return None
+			return FmdlFile.encodedRows(records[fieldName], vertexCount)
+		
+		def rowValues(fieldName):
+			if fieldName not in records:
+				return None
+			if values is not None and values.get(fieldName) is not None:
+				return numpy.asarray(values[fieldName]).tolist()
+			return records[fieldName].tolist()
+		
+		if vertexCount == 0:
+			return ([], [])
+		
+		Vertex = FmdlFile.Vertex
+		VertexEncoding = FmdlFile.VertexEncoding
+		Vector2 = FmdlFile.Vector2
+		Vector3 = FmdlFile.Vector3
+		Vector4 = FmdlFile.Vector4
+		
+		with suspendedGarbageCollection():
+			positions = rowValues('position')
+			positionEncodings = rowEncodings('position')
+			normals = rowValues('normal')
+			normalEncodings = rowEncodings('normal')
+			tangents = rowValues('tangent')
+			tangentEncodings = rowEncodings('tangent')
+			if 'color' not in records:
+				colors = None
+			elif values is not None and values.get('color') is not None:
+				colors = numpy.asarray(values['color']).tolist()
+			else:
+				colors = (records['color'] / 255.0).tolist()
+			colorEncodings = rowEncodings('color')
+			uvs = []
+			uvEncodings = []
+			for i in range(4):
+				if 'uv%d' % i in records:
+					uvs.append(rowValues('uv%d' % i))
+					uvEncodings.append(rowEncodings('uv%d' % i))
+			boneWeights = rowValues('boneWeights')
+			boneIndices = rowValues('boneIndices')
 			
-			for (datumType, datumFormat, offset, increment) in format:
-				position = offset + vertexIndex * increment
+			vertices = []
+			vertexEncodings = []
+			for vertexIndex in range(vertexCount):
+				vertex = Vertex()
+				vertexEncoding = VertexEncoding()
+				vertexEncoding.vertex = vertex
 				
-				if datumType == FmdlFile.FmdlVertexDatumType.position:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.tripleFloat32:
-						raise InvalidFmdl("Unexpected format %d for vertex position data" % datumFormat)
-					vertexEncoding.position = vertexBuffer[position : position + 12]
-					value = unpack('< 3f', vertexEncoding.position)
-					vertex.position = FmdlFile.Vector3(value[0], value[1], value[2])
-				elif datumType == FmdlFile.FmdlVertexDatumType.boneWeights:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat8:
-						raise InvalidFmdl("Unexpected format %d for vertex bone weight data" % datumFormat)
-					boneWeights = unpack('< 4B', vertexBuffer[position : position + 4])
-				elif datumType == FmdlFile.FmdlVertexDatumType.normal:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat16:
-						raise InvalidFmdl("Unexpected format %d for vertex normal data" % datumFormat)
-					vertexEncoding.normal = vertexBuffer[position : position + 8]
-					value = [FmdlFile.parseFloat16(x) for x in unpack('< 4H', vertexEncoding.normal)]
-					vertex.normal = FmdlFile.Vector4(value[0], value[1], value[2], value[3])
-				elif datumType == FmdlFile.FmdlVertexDatumType.color:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat8:
-						raise InvalidFmdl("Unexpected format %d for vertex color data" % datumFormat)
-					vertexEncoding.color = vertexBuffer[position : position + 4]
-					vertex.color = [x / 255.0 for x in unpack('< 4B', vertexEncoding.color)]
-				elif datumType == FmdlFile.FmdlVertexDatumType.boneIndices:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadInt8:
-						raise InvalidFmdl("Unexpected format %d for vertex bone index data" % datumFormat)
-					boneIndices = unpack('< 4B', vertexBuffer[position : position + 4])
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv0:
-					if datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
-						uvEncoding[0] = vertexBuffer[position : position + 4]
-						value = [FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[0])]
-					elif datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
-						uvEncoding[0] = vertexBuffer[position : position + 8]
-						value = unpack('< 2f', uvEncoding[0])
-					else:
-						raise InvalidFmdl("Unexpected format %d for vertex uv data" % datumFormat)
-					uv[0] = FmdlFile.Vector2(value[0], value[1])
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv1:
-					if datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
-						uvEncoding[1] = vertexBuffer[position : position + 4]
-						value = [FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[1])]
-					elif datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
-						uvEncoding[1] = vertexBuffer[position : position + 8]
-						value = unpack('< 2f', uvEncoding[1])
-					uv[1] = FmdlFile.Vector2(value[0], value[1])
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv2:
-					if datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
-						uvEncoding[2] = vertexBuffer[position : position + 4]
-						value = [FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[2])]
-					elif datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
-						uvEncoding[2] = vertexBuffer[position : position + 8]
-						value = unpack('< 2f', uvEncoding[2])
-					uv[2] = FmdlFile.Vector2(value[0], value[1])
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv3:
-					if datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
-						uvEncoding[3] = vertexBuffer[position : position + 4]
-						value = [FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[3])]
-					elif datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
-						uvEncoding[3] = vertexBuffer[position : position + 8]
-						value = unpack('< 2f', uvEncoding[3])
-					uv[3] = FmdlFile.Vector2(value[0], value[1])
-				elif datumType == FmdlFile.FmdlVertexDatumType.tangent:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat16:
-						raise InvalidFmdl("Unexpected format %d for vertex tangent data" % datumFormat)
-					vertexEncoding.tangent = vertexBuffer[position : position + 8]
-					value = [FmdlFile.parseFloat16(x) for x in unpack('< 4H', vertexEncoding.tangent)]
-					vertex.tangent = FmdlFile.Vector4(value[0], value[1], value[2], value[3])
-				else:
-					raise InvalidFmdl("Unexpected vertex datum type %d" % datumType)
-			
-			for i in range(4):
-				if uv[i] != None:
-					vertex.uv.append(uv[i])
-					vertexEncoding.uv.append(uvEncoding[i])
-			
-			if boneWeights != None:
-				vertex.boneMapping = {}
-				vertexEncoding.boneMapping = []
-				for i in range(4):
-					if boneWeights[i] > 0:
-						if not boneIndices[i] < len(boneGroup.bones):
-							#
-							# This happens a fair few times in real models.
-							# Let's just ignore the bone weighting instead.
-							#
-							# WARNING
-							#raise InvalidFmdl("Invalid bone ID %d referenced by vertex" % boneIndices[i])
-							continue
-						
-						vertex.boneMapping[boneGroup.bones[boneIndices[i]]] = boneWeights[i] / 255.0
-						vertexEncoding.boneMapping.append((boneGroup.bones[boneIndices[i]], boneWeights[i]))
-			
-			vertices.append(vertex)
-			vertexEncodings.append(vertexEncoding)
+				if positions is not None:
+					vertex.position = Vector3(*positions[vertexIndex])
+					vertexEncoding.position = positionEncodings[vertexIndex]
+				if normals is not None:
+					vertex.normal = Vector4(*normals[vertexIndex])
+					vertexEncoding.normal = normalEncodings[vertexIndex]
+				if tangents is not None:
+					vertex.tangent = Vector4(*tangents[vertexIndex])
+					vertexEncoding.tangent = tangentEncodings[vertexIndex]
+				if colors is not None:
+					vertex.color = colors[vertexIndex]
+					vertexEncoding.color = colorEncodings[vertexIndex]
+				for i in range(len(uvs)):
+					vertex.uv.append(Vector2(*uvs[i][vertexIndex]))
+					vertexEncoding.uv.append(uvEncodings[i][vertexIndex])
+				
+				if boneWeights is not None:
+					vertex.boneMapping = {}
+					vertexEncoding.boneMapping = []
+					weights = boneWeights[vertexIndex]
+					indices = boneIndices[vertexIndex]
+					for i in range(4):
+						if weights[i] > 0:
+							if not indices[i] < len(boneGroup.bones):
+								#
+								# This happens a fair few times in real models.
+								# Let's just ignore the bone weighting instead.
+								#
+								continue
+							
+							vertex.boneMapping[boneGroup.bones[indices[i]]] = weights[i] / 255.0
+							vertexEncoding.boneMapping.append((boneGroup.bones[indices[i]], weights[i]))
+				
+				vertices.append(vertex)
+				vertexEncodings.append(vertexEncoding)
 		return (vertices, vertexEncodings)
 	
+	@staticmethod
+	def parseVerticesVectorized(fmdl, format, boneGroup, vertexCount):
+		records = FmdlFile.parseVertexRecords(fmdl, format, vertexCount)
+		return FmdlFile.makeVertices(records, boneGroup, vertexCount)
+	
 	@staticmethod
 	def parseFaces(fmdl, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount, vertices):
+		faceIndices = FmdlFile.parseFaceIndexArray(fmdl, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount, len(vertices))
+		return FmdlFile.makeFaces(faceIndices, vertices)
+	
+	#
+	# Reads the faces of a mesh as an (n, 3) int32 array of vertex indices,
+	# checking all of them against vertexCount at once. This reads the same
+	# faces as parseFaces(), for consumers that do not need Face objects.
+	#
+	@staticmethod
+	def parseFaceIndexArray(fmdl, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount, vertexCount):
 		if 2 not in fmdl.segment1Blocks:
 			raise InvalidFmdl("Vertex block not found")
 		
 		vertexBuffer = fmdl.segment1Blocks[2]
 		
-		faces = []
-		for faceVertexIndex in range(firstFaceVertexIndex, firstFaceVertexIndex + faceVertexCount, 3):
-			position = faceVertexIndex * 2 + vertexBufferOffset
-			(index1, index2, index3) = unpack_from('< HHH', vertexBuffer, position)
-			if not index1 < len(vertices) and index2 < len(vertices) and index3 < len(vertices):
-				raise InvalidFmdl("Invalid vertex referenced by face")
-			faces.append(FmdlFile.Face(vertices[index1], vertices[index2], vertices[index3]))
-		return faces
+		faceCount = (faceVertexCount + 2) // 3
+		if faceCount == 0:
+			return numpy.zeros((0, 3), dtype = numpy.int32)
+		
+		position = firstFaceVertexIndex * 2 + vertexBufferOffset
+		if position + faceCount * 6 > len(vertexBuffer):
+			raise InvalidFmdl("Face buffer too small for %d faces" % faceCount)
+		
+		faceIndices = numpy.frombuffer(vertexBuffer, dtype = '<u2', count = faceCount * 3, offset = position).reshape((faceCount, 3))
+		if faceIndices.max() >= vertexCount:
+			raise InvalidFmdl("Invalid vertex referenced by face")
+		return faceIndices.astype(numpy.int32)
+	
+	@staticmethod
+	def makeFaces(faceIndices, vertices):
+		Face = FmdlFile.Face
+		with suspendedGarbageCollection():
+			return [Face(vertices[index1], vertices[index2], vertices[index3]) for (index1, index2, index3) in faceIndices.tolist()]
 	
 	@staticmethod
 	def parseObjectExtensionHeaders(extensionHeaders, headerList, objectID):
@@ -1275,15 +1885,24 @@ class FmdlFile:
 				output.add(key)
 		return output
 	
-	def readFile(self, filename):
+	#
+	# If columnar is set, meshes are read as ColumnarMesh objects.
+	#
+	# If lazy is set, meshes are read as LazyMesh objects, whose geometry is
+	# not decoded until it is needed. Columnar meshes are not affected by lazy,
+	# as they are cheap to read eagerly. The file is read into memory and
+	# closed, unless mapped is set as well; then it stays mapped, and on some
+	# platforms locked, until every mesh is decoded or close() is called.
+	#
+	def readFile(self, filename, mapped = False, columnar = False, lazy = False):
 		fmdl = FmdlContainer()
-		fmdl.readFile(filename)
+		fmdl.readFile(filename, mapped)
 		
 		(strings, extensionHeaders) = self.parseStrings(fmdl)
 		boundingBoxes = self.parseBoundingBoxes(fmdl)
 		bones = self.parseBones(fmdl, strings, boundingBoxes)
 		materialInstances = self.parseMaterialInstances(fmdl, strings)
-		meshes = self.parseMeshes(fmdl, bones, materialInstances, extensionHeaders)
+		meshes = self.parseMeshes(fmdl, bones, materialInstances, extensionHeaders, columnar, lazy)
 		meshGroups = self.parseMeshGroups(fmdl, strings, boundingBoxes, meshes, extensionHeaders)
 		
 		self.bones = bones
@@ -1371,10 +1990,18 @@ class FmdlFile:
 	
 	@staticmethod
 	def addMesh(fmdl, mesh, boneIndices, materialInstanceID, levelsOfDetail, vertexPositionBuffer, vertexDataBuffer, faceBuffer):
-		if mesh.vertexEncoding == None:
-			vertexEncoding = FmdlFile.encodeVertices(mesh.vertices, mesh.vertexFields)
+		columnar = mesh.isColumnar()
+		if columnar:
+			vertexRecords = mesh.encodeColumns()
+			vertexCount = len(mesh.positions)
+			faces = mesh.faceIndices
 		else:
-			vertexEncoding = mesh.vertexEncoding
+			if mesh.vertexEncoding == None:
+				vertexEncoding = FmdlFile.encodeVertices(mesh.vertices, mesh.vertexFields)
+			else:
+				vertexEncoding = mesh.vertexEncoding
+			vertexCount = len(mesh.vertices)
+			faces = mesh.faces
 		
 		if mesh.vertexFields.hasBoneMapping:
 			(boneGroupID, boneGroupIndices) = FmdlFile.addBoneGroup(fmdl, mesh.boneGroup, boneIndices)
@@ -1389,21 +2016,42 @@ class FmdlFile:
 			dataBufferEntrySize,
 		) = FmdlFile.addMeshFormatAssignment(fmdl, mesh.vertexFields, len(vertexPositionBuffer), len(vertexDataBuffer))
 		
-		vertexIndices = FmdlFile.addVertices(
-			vertexEncoding,
-			vertexFormatEntries,
-			positionBufferEntrySize,
-			dataBufferEntrySize,
-			boneGroupIndices,
-			vertexPositionBuffer,
-			vertexDataBuffer,
-		)
+		if columnar:
+			if mesh.vertexFields.hasBoneMapping:
+				groupIndices = numpy.array([boneGroupIndices[bone] for bone in mesh.boneGroup.bones] + [0], dtype = numpy.uint8)
+				vertexRecords['boneIndices'] = numpy.where(
+					vertexRecords['boneWeights'] > 0,
+					groupIndices[vertexRecords['boneIndices']],
+					0,
+				).astype(numpy.uint8)
+			FmdlFile.addVertexRecords(
+				vertexRecords,
+				vertexCount,
+				vertexFormatEntries,
+				positionBufferEntrySize,
+				dataBufferEntrySize,
+				vertexPositionBuffer,
+				vertexDataBuffer,
+			)
+		else:
+			vertexIndices = FmdlFile.addVertices(
+				vertexEncoding,
+				vertexFormatEntries,
+				positionBufferEntrySize,
+				dataBufferEntrySize,
+				boneGroupIndices,
+				vertexPositionBuffer,
+				vertexDataBuffer,
+			)
 		
 		firstFaceIndexID = FmdlFile.newSegment0BlockDescriptorID(fmdl, 17)
 		for i in range(levelsOfDetail):
-			FmdlFile.addFaceIndex(fmdl, mesh.faces)
+			FmdlFile.addFaceIndex(fmdl, faces)
 		
-		firstFaceVertexID = FmdlFile.addFaces(fmdl, mesh.faces, faceBuffer, vertexIndices)
+		if columnar:
+			firstFaceVertexID = FmdlFile.addFaceIndexArray(fmdl, faces, vertexCount, faceBuffer)
+		else:
+			firstFaceVertexID = FmdlFile.addFaces(fmdl, faces, faceBuffer, vertexIndices)
 		
 		return FmdlFile.addSegment0Block(fmdl, 3, pack('< BB 2x HHHH 4x IIQ 16x',
 			mesh.alphaFlags,
@@ -1411,9 +2059,9 @@ class FmdlFile:
 			materialInstanceID,
 			boneGroupID,
 			meshFormatAssignmentID,
-			len(mesh.vertices),
+			vertexCount,
 			firstFaceVertexID,
-			len(mesh.faces) * 3,
+			len(faces) * 3,
 			firstFaceIndexID,
 		))
 	
@@ -1651,146 +2299,362 @@ class FmdlFile:
 		fmdl.segment1Blocks[0] += pack('< 4f', *parameterValues)
 		return index
 	
+	#
+	# Converts columns of vertex data to the representation stored in the
+	# file, as a dictionary from VERTEX_DATUM_FIELDS field names to arrays of
+	# the corresponding element types. Columns of numpy dtype float16 are
+	# stored as they are; other columns are converted the same way that
+	# encodeVertices() has always converted individual vertices.
+	#
+	@staticmethod
+	def encodeVertexColumns(vertexFields, positions, normals, tangents, colors, uvs):
+		def halfFloats(values):
+			values = numpy.asarray(values)
+			if values.dtype == numpy.float16:
+				return values
+			return FmdlFile.encodeFloat16Array(values).view(numpy.float16)
+		
+		records = {}
+		records['position'] = numpy.asarray(positions, dtype = numpy.float32)
+		if vertexFields.hasNormal:
+			records['normal'] = halfFloats(normals)
+		if vertexFields.hasTangent:
+			records['tangent'] = halfFloats(tangents)
+		if vertexFields.hasColor:
+			quantizedColors = numpy.trunc(numpy.asarray(colors, dtype = numpy.float64) * 255 + 0.5)
+			records['color'] = numpy.clip(quantizedColors, 0, 255).astype(numpy.uint8)
+		for i in range(vertexFields.uvCount):
+			if vertexFields.highPrecisionUv:
+				records['uv%d' % i] = numpy.asarray(uvs[i], dtype = numpy.float32)
+			else:
+				records['uv%d' % i] = halfFloats(uvs[i])
+		return records
+	
+	#
+	# Splits an array with one row per vertex into the bytes of each row.
+	#
+	@staticmethod
+	def encodedRows(values, rowCount):
+		if rowCount == 0:
+			return []
+		raw = numpy.ascontiguousarray(values).tobytes()
+		width = len(raw) // rowCount
+		return [raw[offset : offset + width] for offset in range(0, len(raw), width)]
+	
+	#
+	# The inverse of encodedRows(): joins the bytes of one field of each
+	# VertexEncoding into a (vertexCount, width) uint8 array. fieldName is one
+	# of 'position', 'normal', 'tangent', 'color' or 'uv0' to 'uv3'.
+	#
+	@staticmethod
+	def encodedFieldRows(vertexEncoding, fieldName):
+		if fieldName.startswith('uv'):
+			uvIndex = int(fieldName[2:])
+			encodings = [encodedVertex.uv[uvIndex] for encodedVertex in vertexEncoding]
+		else:
+			encodings = list(map(operator.attrgetter(fieldName), vertexEncoding))
+		return numpy.frombuffer(b''.join(encodings), dtype = numpy.uint8).reshape((len(vertexEncoding), -1))
+	
+	#
+	# Returns the bone mappings of a list of VertexEncodings as a pair of
+	# (vertexCount, 4) arrays: uint16 bone IDs, looked up in the dictionary
+	# boneIDs, and uint8 weights. Unused bone slots are (0xffff, 0). Bones
+	# missing from boneIDs are added to it, with the next unused ID.
+	#
+	@staticmethod
+	def encodedBoneMappingRows(vertexEncoding, boneIDs):
+		vertexCount = len(vertexEncoding)
+		boneMappings = [encodedVertex.boneMapping for encodedVertex in vertexEncoding]
+		boneCounts = numpy.array([len(boneMapping) for boneMapping in boneMappings], dtype = numpy.int64)
+		rowIndices = numpy.repeat(numpy.arange(vertexCount), boneCounts)
+		slotIndices = numpy.arange(len(rowIndices)) - numpy.repeat(numpy.cumsum(boneCounts) - boneCounts, boneCounts)
+		boneMappingIDs = numpy.full((vertexCount, 4), 0xffff, dtype = numpy.uint16)
+		boneWeights = numpy.zeros((vertexCount, 4), dtype = numpy.uint8)
+		boneMappingIDs[rowIndices, slotIndices] = [boneIDs.setdefault(bone, len(boneIDs)) for boneMapping in boneMappings for (bone, weight) in boneMapping]
+		boneWeights[rowIndices, slotIndices] = [weight for boneMapping in boneMappings for (bone, weight) in boneMapping]
+		return (boneMappingIDs, boneWeights)
+	
+	#
+	# fmdl bone mappings support at most 4 bones, and store weights as 8-bit integers.
+	# Pack the desired bone mapping into this constraint as accurately as possible:
+	# - If the desired bone mapping contains more than 4 bones, simplify it
+	#   down to 4 bones, keeping the total weight identical
+	# - Round bone weights to units of N/255, in such a way that the total bone weight
+	#   does not change more than one rounding error. In particular, a rounded total weight
+	#   of 1 must remain a total weight of 1 after elementwise rounding.
+	#
+	# Takes a list of {bone: weight} dictionaries, and returns a list of
+	# [(bone, integral weight)] lists. All bone mappings are processed at
+	# once: the bones of each mapping are sorted into a row of a matrix by
+	# descending weight and name, after which the weights are distributed one
+	# column at a time. The floating point operations are the same, and done
+	# in the same order, as when rounding each bone mapping on its own:
+	#
+	#   orderedBones = sorted(boneMapping.items(), key = (lambda pair: (pair[1], pair[0].name)), reverse = True)
+	#   totalWeight = sum([weight for (bone, weight) in orderedBones])
+	#   integralTotalWeight = int((totalWeight * 255) + 0.5)
+	#   selectedBones = orderedBones[0:4]
+	#   selectedWeight = sum([weight for (bone, weight) in selectedBones])
+	#
+	#   remainingIntegralWeight = integralTotalWeight
+	#   remainingSelectedWeight = selectedWeight
+	#   for i in range(len(selectedBones)):
+	#   	(bone, weight) = selectedBones[i]
+	#   	if i == len(selectedBones) - 1:
+	#   		boneWeight = max(0, min(255, remainingIntegralWeight))
+	#   	elif remainingSelectedWeight <= 0:
+	#   		boneWeight = 0
+	#   	else:
+	#   		boneWeight = int((weight / remainingSelectedWeight) * remainingIntegralWeight + 0.5)
+	#   		boneWeight = max(0, min(255, boneWeight))
+	#   		remainingIntegralWeight -= boneWeight
+	#   		remainingSelectedWeight -= weight
+	#   	if boneWeight > 0:
+	#   		output.append((bone, boneWeight))
+	#
+	@staticmethod
+	def quantizeBoneMappings(boneMappings):
+		#
+		# Sums the rows of a matrix the way sum() adds up a list of floats,
+		# which is a plain left to right sum before python 3.12, and a
+		# compensated sum since.
+		#
+		def sumRows(values):
+			total = values[:, 0].copy()
+			if sys.version_info < (3, 12):
+				for column in range(1, values.shape[1]):
+					total += values[:, column]
+				return total
+			compensation = numpy.zeros(len(values))
+			for column in range(1, values.shape[1]):
+				value = values[:, column]
+				newTotal = total + value
+				compensation += numpy.where(
+					numpy.abs(total) >= numpy.abs(value),
+					(total - newTotal) + value,
+					(value - newTotal) + total,
+				)
+				total = newTotal
+			compensate = (compensation != 0) & numpy.isfinite(compensation)
+			total[compensate] += compensation[compensate]
+			return total
+		
+		mappingCount = len(boneMappings)
+		if mappingCount == 0:
+			return []
+		
+		with suspendedGarbageCollection():
+			counts = numpy.array([len(boneMapping) for boneMapping in boneMappings], dtype = numpy.int64)
+			entries = [entry for boneMapping in boneMappings for entry in boneMapping.items()]
+			bones = [bone for (bone, weight) in entries]
+			weights = numpy.array([weight for (bone, weight) in entries], dtype = numpy.float64)
+			nameRanks = dict((name, rank) for (rank, name) in enumerate(sorted(set(bone.name for bone in bones))))
+			ranks = numpy.array([nameRanks[bone.name] for bone in bones], dtype = numpy.int64)
+		
+		mappingIDs = numpy.repeat(numpy.arange(mappingCount), counts)
+		entryIDs = numpy.arange(len(entries))
+		columns = entryIDs - (numpy.cumsum(counts) - counts)[mappingIDs]
+		columnCount = max(4, int(counts.max()))
+		
+		#
+		# Sort by mapping, descending weight, descending name, and original
+		# position, as sorted() is stable also with reverse = True. The keys
+		# are combined into two integer keys, which sort a lot faster.
+		#
+		weightRanks = numpy.unique(-weights, return_inverse = True)[1].reshape(-1)
+		mappingWeightKeys = mappingIDs * (len(entries) + 1) + weightRanks
+		nameColumnKeys = (len(nameRanks) - 1 - ranks) * columnCount + columns
+		order = numpy.lexsort((nameColumnKeys, mappingWeightKeys))
+		
+		orderedWeights = numpy.zeros((mappingCount, columnCount))
+		orderedWeights[mappingIDs, columns] = weights[order]
+		orderedBones = numpy.zeros((mappingCount, columnCount), dtype = numpy.int64)
+		orderedBones[mappingIDs, columns] = order
+		
+		totalWeight = sumRows(orderedWeights)
+		integralTotalWeight = numpy.trunc(totalWeight * 255 + 0.5)
+		selectedCount = numpy.minimum(counts, 4)
+		selectedWeight = sumRows(orderedWeights[:, 0:4])
+		
+		remainingIntegralWeight = integralTotalWeight
+		remainingSelectedWeight = selectedWeight
+		integralWeights = numpy.zeros((mappingCount, 4), dtype = numpy.int64)
+		for i in range(4):
+			last = (selectedCount - 1 == i)
+			integralWeights[last, i] = numpy.clip(remainingIntegralWeight[last], 0, 255)
+			
+			distributed = (selectedCount - 1 > i) & (remainingSelectedWeight > 0)
+			weight = orderedWeights[distributed, i]
+			boneWeight = numpy.trunc((weight / remainingSelectedWeight[distributed]) * remainingIntegralWeight[distributed] + 0.5)
+			boneWeight = numpy.clip(boneWeight, 0, 255)
+			integralWeights[distributed, i] = boneWeight
+			remainingIntegralWeight[distributed] -= boneWeight
+			remainingSelectedWeight[distributed] -= weight
+		
+		with suspendedGarbageCollection():
+			output = []
+			for (rowBones, rowWeights) in zip(orderedBones[:, 0:4].tolist(), integralWeights.tolist()):
+				output.append([(bones[entryID], boneWeight) for (entryID, boneWeight) in zip(rowBones, rowWeights) if boneWeight > 0])
+		return output
+	
+	#
+	# The vertex attributes are encoded column by column using
+	# encodeVertexColumns(). Colors are encoded as 4 bytes; the fifth color
+	# component added by the exporter is not stored in the file.
+	#
 	@staticmethod
 	def encodeVertices(vertices, vertexFields):
-		vertexEncodings = []
-		for vertexIndex in range(len(vertices)):
-			vertexEncoding = FmdlFile.VertexEncoding()
-			vertex = vertices[vertexIndex]
-			vertexEncoding.vertex = vertex
-			if True:
-				# position is always present
-				vertexEncoding.position = pack('< 3f', vertex.position.x, vertex.position.y, vertex.position.z)
+		vertexCount = len(vertices)
+		
+		with suspendedGarbageCollection():
+			positions = [(vertex.position.x, vertex.position.y, vertex.position.z) for vertex in vertices]
 			if vertexFields.hasNormal:
-				vertexEncoding.normal = pack('< 4H', *(FmdlFile.encodeFloat16(x) for x in
-					(vertex.normal.x, vertex.normal.y, vertex.normal.z, vertex.normal.w)
-				))
+				normals = [(vertex.normal.x, vertex.normal.y, vertex.normal.z, vertex.normal.w) for vertex in vertices]
+			else:
+				normals = None
 			if vertexFields.hasTangent:
-				vertexEncoding.tangent = pack('< 4H', *(FmdlFile.encodeFloat16(x) for x in
-					(vertex.tangent.x, vertex.tangent.y, vertex.tangent.z, vertex.tangent.w)
-				))
+				tangents = [(vertex.tangent.x, vertex.tangent.y, vertex.tangent.z, vertex.tangent.w) for vertex in vertices]
+			else:
+				tangents = None
 			if vertexFields.hasColor:
-				vertexEncoding.color = pack('< 5B', *(int(x * 255 + 0.5) for x in vertex.color))
-			for i in range(4):
-				if i < vertexFields.uvCount:
-					if vertexFields.highPrecisionUv:
-						vertexEncoding.uv.append(pack('< 2f', vertex.uv[i].u, vertex.uv[i].v))
-					else:
-						vertexEncoding.uv.append(pack('< 2H', *(FmdlFile.encodeFloat16(x) for x in
-								(vertex.uv[i].u, vertex.uv[i].v)
-						)))
+				colors = [vertex.color[0:4] for vertex in vertices]
+			else:
+				colors = None
+			uvs = [[(vertex.uv[i].u, vertex.uv[i].v) for vertex in vertices] for i in range(vertexFields.uvCount)]
+			
+			records = FmdlFile.encodeVertexColumns(
+				vertexFields,
+				numpy.reshape(positions, (vertexCount, 3)),
+				None if normals is None else numpy.reshape(normals, (vertexCount, 4)),
+				None if tangents is None else numpy.reshape(tangents, (vertexCount, 4)),
+				None if colors is None else numpy.reshape(colors, (vertexCount, 4)),
+				[numpy.reshape(uv, (vertexCount, 2)) for uv in uvs],
+			)
+			
+			positionEncodings = FmdlFile.encodedRows(records['position'], vertexCount)
+			if vertexFields.hasNormal:
+				normalEncodings = FmdlFile.encodedRows(records['normal'], vertexCount)
+			if vertexFields.hasTangent:
+				tangentEncodings = FmdlFile.encodedRows(records['tangent'], vertexCount)
+			if vertexFields.hasColor:
+				colorEncodings = FmdlFile.encodedRows(records['color'], vertexCount)
+			uvEncodings = [FmdlFile.encodedRows(records['uv%d' % i], vertexCount) for i in range(vertexFields.uvCount)]
 			if vertexFields.hasBoneMapping:
-				#
-				# fmdl bone mappings support at most 4 bones, and store weights as 8-bit integers.
-				# Pack the desired bone mapping into this constraint as accurately as possible:
-				# - If the desired bone mapping contains more than 4 bones, simplify it
-				#   down to 4 bones, keeping the total weight identical
-				# - Round bone weights to units of N/255, in such a way that the total bone weight
-				#   does not change more than one rounding error. In particular, a rounded total weight
-				#   of 1 must remain a total weight of 1 after elementwise rounding.
-				#
-				orderedBones = sorted(vertex.boneMapping.items(), key = (lambda pair: (pair[1], pair[0].name)), reverse = True)
-				totalWeight = sum([weight for (boneIndex, weight) in orderedBones])
-				integralTotalWeight = int((totalWeight * 255) + 0.5)
-				selectedBones = orderedBones[0:4]
-				selectedWeight = sum([weight for (boneIndex, weight) in selectedBones])
-				
-				remainingIntegralWeight = integralTotalWeight
-				remainingSelectedWeight = selectedWeight
-				vertexEncoding.boneMapping = []
-				for i in range(len(selectedBones)):
-					(bone, weight) = selectedBones[i]
-					if i == len(selectedBones) - 1:
-						boneWeight = max(0, min(255, remainingIntegralWeight))
-					elif remainingSelectedWeight <= 0:
-						boneWeight = 0
-					else:
-						boneWeight = int((weight / remainingSelectedWeight) * remainingIntegralWeight + 0.5)
-						boneWeight = max(0, min(255, boneWeight))
-						remainingIntegralWeight -= boneWeight
-						remainingSelectedWeight -= weight
-					
-					if boneWeight > 0:
-						vertexEncoding.boneMapping.append((bone, boneWeight))
-			vertexEncodings.append(vertexEncoding)
+				boneMappings = FmdlFile.quantizeBoneMappings([vertex.boneMapping for vertex in vertices])
+			
+			vertexEncodings = []
+			for vertexIndex in range(vertexCount):
+				vertexEncoding = FmdlFile.VertexEncoding()
+				vertex = vertices[vertexIndex]
+				vertexEncoding.vertex = vertex
+				vertexEncoding.position = positionEncodings[vertexIndex]
+				if vertexFields.hasNormal:
+					vertexEncoding.normal = normalEncodings[vertexIndex]
+				if vertexFields.hasTangent:
+					vertexEncoding.tangent = tangentEncodings[vertexIndex]
+				if vertexFields.hasColor:
+					vertexEncoding.color = colorEncodings[vertexIndex]
+				for i in range(vertexFields.uvCount):
+					vertexEncoding.uv.append(uvEncodings[i][vertexIndex])
+				if vertexFields.hasBoneMapping:
+					vertexEncoding.boneMapping = boneMappings[vertexIndex]
+				vertexEncodings.append(vertexEncoding)
 		return vertexEncodings
 	
+	#
+	# Gathers each vertex field of encodedVertices into a single array, and
+	# stores them using addVertexRecords().
+	#
 	@staticmethod
 	def addVertices(encodedVertices, formatEntries, positionBufferEntrySize, dataBufferEntrySize, boneGroupIndices, vertexPositionBuffer, vertexDataBuffer):
-		positionBuffer = bytearray(len(encodedVertices) * positionBufferEntrySize)
-		dataBuffer = bytearray(len(encodedVertices) * dataBufferEntrySize)
-		buffers = [positionBuffer, dataBuffer]
-		entrySizes = [positionBufferEntrySize, dataBufferEntrySize]
-		
-		vertexIndices = {}
+		vertexCount = len(encodedVertices)
 		
-		for vertexIndex in range(len(encodedVertices)):
-			vertexEncoding = encodedVertices[vertexIndex]
-			vertexIndices[vertexEncoding.vertex] = vertexIndex
-			
+		records = {}
+		with suspendedGarbageCollection():
 			for (bufferID, datumType, datumFormat, offset) in formatEntries:
-				if datumType == FmdlFile.FmdlVertexDatumType.position:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.tripleFloat32:
-						raise InvalidFmdl("Unexpected format %d for vertex position data" % datumFormat)
-					value = vertexEncoding.position
-				elif datumType == FmdlFile.FmdlVertexDatumType.boneWeights:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat8:
-						raise InvalidFmdl("Unexpected format %d for vertex bone weight data" % datumFormat)
-					boneWeights = [weight for (bone, weight) in vertexEncoding.boneMapping]
-					if len(boneWeights) < 4:
-						boneWeights += ((0,) * (4 - len(boneWeights)))
-					value = pack('< 4B', *boneWeights)
-				elif datumType == FmdlFile.FmdlVertexDatumType.normal:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat16:
-						raise InvalidFmdl("Unexpected format %d for vertex normal data" % datumFormat)
-					value = vertexEncoding.normal
-				elif datumType == FmdlFile.FmdlVertexDatumType.color:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat8:
-						raise InvalidFmdl("Unexpected format %d for vertex color data" % datumFormat)
-					value = vertexEncoding.color
-				elif datumType == FmdlFile.FmdlVertexDatumType.boneIndices:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadInt8:
-						raise InvalidFmdl("Unexpected format %d for vertex bone index data" % datumFormat)
-					boneIndices = [boneGroupIndices[bone] for (bone, weight) in vertexEncoding.boneMapping]
-					if len(boneIndices) < 4:
-						boneIndices += ((0,) * (4 - len(boneIndices)))
-					value = pack('< 4B', *boneIndices)
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv0:
-					if datumFormat not in [FmdlFile.FmdlVertexDatumFormat.doubleFloat16, FmdlFile.FmdlVertexDatumFormat.doubleFloat32]:
-						raise InvalidFmdl("Unexpected format %d for vertex uv data" % datumFormat)
-					value = vertexEncoding.uv[0]
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv1:
-					if datumFormat not in [FmdlFile.FmdlVertexDatumFormat.doubleFloat16, FmdlFile.FmdlVertexDatumFormat.doubleFloat32]:
-						raise InvalidFmdl("Unexpected format %d for vertex uv data" % datumFormat)
-					value = vertexEncoding.uv[1]
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv2:
-					if datumFormat not in [FmdlFile.FmdlVertexDatumFormat.doubleFloat16, FmdlFile.FmdlVertexDatumFormat.doubleFloat32]:
-						raise InvalidFmdl("Unexpected format %d for vertex uv data" % datumFormat)
-					value = vertexEncoding.uv[2]
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv3:
-					if datumFormat not in [FmdlFile.FmdlVertexDatumFormat.doubleFloat16, FmdlFile.FmdlVertexDatumFormat.doubleFloat32]:
-						raise InvalidFmdl("Unexpected format %d for vertex uv data" % datumFormat)
-					value = vertexEncoding.uv[3]
-				elif datumType == FmdlFile.FmdlVertexDatumType.tangent:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat16:
-						raise InvalidFmdl("Unexpected format %d for vertex tangent data" % datumFormat)
-					value = vertexEncoding.tangent
-				else:
+				if datumType not in FmdlFile.VERTEX_DATUM_FIELDS:
 					raise InvalidFmdl("Unexpected vertex datum type %d" % datumType)
+				(fieldName, description, fieldFormats) = FmdlFile.VERTEX_DATUM_FIELDS[datumType]
+				if datumFormat not in fieldFormats:
+					raise InvalidFmdl("Unexpected format %d for vertex %s data" % (datumFormat, description))
+				(elementType, elementCount) = fieldFormats[datumFormat]
+				
+				if datumType == FmdlFile.FmdlVertexDatumType.boneWeights:
+					records[fieldName] = numpy.array([
+						[weight for (bone, weight) in vertexEncoding.boneMapping] + [0] * (4 - len(vertexEncoding.boneMapping))
+						for vertexEncoding in encodedVertices
+					], dtype = numpy.uint8).reshape((vertexCount, 4))
+					continue
+				if datumType == FmdlFile.FmdlVertexDatumType.boneIndices:
+					records[fieldName] = numpy.array([
+						[boneGroupIndices[bone] for (bone, weight) in vertexEncoding.boneMapping] + [0] * (4 - len(vertexEncoding.boneMapping))
+						for vertexEncoding in encodedVertices
+					], dtype = numpy.uint8).reshape((vertexCount, 4))
+					continue
+				
+				if fieldName.startswith('uv'):
+					uvIndex = int(fieldName[2:])
+					encodedValues = b''.join([vertexEncoding.uv[uvIndex] for vertexEncoding in encodedVertices])
+				else:
+					encodedValues = b''.join([getattr(vertexEncoding, fieldName) for vertexEncoding in encodedVertices])
 				
-				position = entrySizes[bufferID] * vertexIndex + offset
-				buffer = buffers[bufferID]
-				buffer[position : position + len(value)] = value
+				size = numpy.dtype(elementType).itemsize * elementCount
+				raw = numpy.frombuffer(encodedValues, dtype = numpy.uint8).reshape((vertexCount, -1 if vertexCount > 0 else size))
+				records[fieldName] = numpy.ascontiguousarray(raw[:, 0:size]).view(elementType)
+		
+		FmdlFile.addVertexRecords(
+			records,
+			vertexCount,
+			formatEntries,
+			positionBufferEntrySize,
+			dataBufferEntrySize,
+			vertexPositionBuffer,
+			vertexDataBuffer,
+		)
 		
-		if len(positionBuffer) % 16:
-			positionBuffer += bytearray(16 - (len(positionBuffer) % 16))
-		if len(dataBuffer) % 16:
-			dataBuffer += bytearray(16 - (len(dataBuffer) % 16))
+		vertexIndices = {}
+		for vertexIndex in range(vertexCount):
+			vertexIndices[encodedVertices[vertexIndex].vertex] = vertexIndex
+		return vertexIndices
+	
+	#
+	# Stores vertex records, as returned by ColumnarMesh.encodeColumns(), in
+	# the layout described by formatEntries.
+	#
+	@staticmethod
+	def addVertexRecords(records, vertexCount, formatEntries, positionBufferEntrySize, dataBufferEntrySize, vertexPositionBuffer, vertexDataBuffer):
+		positionBuffer = numpy.zeros((vertexCount, positionBufferEntrySize), dtype = numpy.uint8)
+		dataBuffer = numpy.zeros((vertexCount, dataBufferEntrySize), dtype = numpy.uint8)
+		buffers = [positionBuffer, dataBuffer]
 		
-		vertexPositionBuffer += positionBuffer
-		vertexDataBuffer += dataBuffer
+		for (bufferID, datumType, datumFormat, offset) in formatEntries:
+			if datumType not in FmdlFile.VERTEX_DATUM_FIELDS:
+				raise InvalidFmdl("Unexpected vertex datum type %d" % datumType)
+			(fieldName, description, fieldFormats) = FmdlFile.VERTEX_DATUM_FIELDS[datumType]
+			if datumFormat not in fieldFormats:
+				raise InvalidFmdl("Unexpected format %d for vertex %s data" % (datumFormat, description))
+			(elementType, elementCount) = fieldFormats[datumFormat]
+			values = numpy.ascontiguousarray(records[fieldName], dtype = elementType)
+			size = values.dtype.itemsize * elementCount
+			buffers[bufferID][:, offset : offset + size] = values.view(numpy.uint8).reshape((vertexCount, size))
+		
+		for (buffer, output) in [(positionBuffer, vertexPositionBuffer), (dataBuffer, vertexDataBuffer)]:
+			output += memoryview(buffer)
+			if buffer.size % 16:
+				output += bytearray(16 - (buffer.size % 16))
+	
+	#
+	# Stores an (n, 3) array of vertex indices as faces.
+	#
+	@staticmethod
+	def addFaceIndexArray(fmdl, faceIndices, vertexCount, faceBuffer):
+		faceIndices = numpy.asarray(faceIndices)
+		if len(faceIndices) > 0 and (faceIndices.min() < 0 or faceIndices.max() >= vertexCount):
+			raise InvalidFmdl("Invalid vertex referenced by face")
 		
-		return vertexIndices
+		firstFaceVertexID = len(faceBuffer) // 2
+		faceBuffer += memoryview(faceIndices.astype('<u2'))
+		return firstFaceVertexID
 	
 	@staticmethod
 	def addFaces(fmdl, faces, faceBuffer, vertexIndices):
@@ -1896,7 +2760,8 @@ class FmdlFile:
 		FmdlFile.addBufferOffset(fmdl, False, len(vertexPositionBuffer), 0)
 		FmdlFile.addBufferOffset(fmdl, False, len(vertexDataBuffer), len(vertexPositionBuffer))
 		FmdlFile.addBufferOffset(fmdl, True, len(faceBuffer), len(vertexPositionBuffer) + len(vertexDataBuffer))
-		fmdl.segment1Blocks[2] = vertexPositionBuffer + vertexDataBuffer + faceBuffer
+		# Stored as separate chunks, to avoid another copy of the geometry.
+		fmdl.segment1Blocks[2] = [vertexPositionBuffer, vertexDataBuffer, faceBuffer]
 		
 		return meshIndices
 	
@@ -1913,6 +2778,20 @@ class FmdlFile:
 		
 		return meshGroupIndices
 	
+	#
+	# Decodes the geometry of meshes read by readFile(lazy = True) that was not
+	# decoded yet, and releases the file mappings they kept open.
+	#
+	def close(self):
+		containers = []
+		for mesh in self.meshes:
+			if isinstance(mesh, FmdlFile.LazyMesh) and mesh.fmdl is not None:
+				if all(container is not mesh.fmdl for container in containers):
+					containers.append(mesh.fmdl)
+				mesh.decodeGeometry()
+		for container in containers:
+			container.close()
+	
 	def precomputeVertexEncoding(self):
 		for mesh in self.meshes:
 			if mesh.vertexEncoding == None:
@@ -1922,6 +2801,58 @@ class FmdlFile:
 		for mesh in self.meshes:
 			mesh.vertexEncoding = None
 	
+	#
+	# Returns a copy of this model with new Mesh and MeshGroup objects, and
+	# new lists and extension headers, that can be modified without affecting
+	# this model. Bones, material instances, vertices, faces and vertex
+	# encodings are shared.
+	#
+	def copyStructure(self):
+		output = FmdlFile()
+		output.bones = self.bones[:]
+		output.materialInstances = self.materialInstances[:]
+		if self.extensionHeaders is None:
+			output.extensionHeaders = None
+		else:
+			output.extensionHeaders = {}
+			for (key, value) in self.extensionHeaders.items():
+				output.extensionHeaders[key] = value[:]
+		
+		meshMap = {}
+		for mesh in self.meshes:
+			copiedMesh = FmdlFile.Mesh()
+			copiedMesh.vertices = mesh.vertices[:]
+			copiedMesh.faces = mesh.faces[:]
+			copiedMesh.boneGroup = mesh.boneGroup
+			copiedMesh.materialInstance = mesh.materialInstance
+			copiedMesh.alphaFlags = mesh.alphaFlags
+			copiedMesh.shadowFlags = mesh.shadowFlags
+			copiedMesh.vertexFields = mesh.vertexFields
+			copiedMesh.extensionHeaders = mesh.extensionHeaders.copy()
+			copiedMesh.vertexEncoding = None if mesh.vertexEncoding is None else mesh.vertexEncoding[:]
+			output.meshes.append(copiedMesh)
+			meshMap[mesh] = copiedMesh
+		
+		meshGroupMap = {}
+		for meshGroup in self.meshGroups:
+			copiedMeshGroup = FmdlFile.MeshGroup()
+			output.meshGroups.append(copiedMeshGroup)
+			meshGroupMap[meshGroup] = copiedMeshGroup
+		for meshGroup in self.meshGroups:
+			copiedMeshGroup = meshGroupMap[meshGroup]
+			copiedMeshGroup.name = meshGroup.name
+			copiedMeshGroup.boundingBox = meshGroup.boundingBox
+			copiedMeshGroup.visible = meshGroup.visible
+			copiedMeshGroup.extensionHeaders = meshGroup.extensionHeaders.copy()
+			if meshGroup.parent is None:
+				copiedMeshGroup.parent = None
+			else:
+				copiedMeshGroup.parent = meshGroupMap[meshGroup.parent]
+			copiedMeshGroup.children = [meshGroupMap[child] for child in meshGroup.children]
+			copiedMeshGroup.meshes = [meshMap[mesh] for mesh in meshGroup.meshes]
+		
+		return output
+	
 	def writeFile(self, filename):
 		fmdl = FmdlContainer()
 		
@@ -1950,3 +2881,75 @@ class FmdlFile:
 				fmdl.segment1Blocks[1] = bytearray()
 		
 		fmdl.writeFile(filename)
+
+
+
+#
+# The metadata of an fmdl file: its bones, material instances and textures,
+# the size of each mesh, and the extension headers. Reading it requires only
+# the header, the segment 0 tables and the string block; the vertex buffer
+# and the material parameter values are never read.
+#
+class FmdlSummary:
+	class Mesh:
+		def __init__(self):
+			self.vertexCount = None
+			self.faceCount = None
+			self.materialInstance = None
+	
+	def __init__(self):
+		self.boneNames = []
+		self.materialInstances = []
+		self.textures = []
+		self.meshes = []
+		self.extensionHeaders = None
+	
+	@staticmethod
+	def parseMeshes(fmdl, materialInstances):
+		if 3 not in fmdl.segment0Blocks:
+			return []
+		
+		faceIndices = FmdlFile.parseFaceIndices(fmdl)
+		
+		meshes = []
+		for definition in fmdl.segment0Blocks[3]:
+			(
+				alphaFlags,
+				shadowFlags,
+				materialInstanceID,
+				boneGroupID,
+				meshFormatID,
+				vertexCount,
+				firstFaceVertexIndex,
+				faceVertexCount,
+				firstFaceIndexID,
+			) = unpack('< BB 2x HHHH 4x IIQ 16x', definition)
+			
+			if not materialInstanceID < len(materialInstances):
+				raise InvalidFmdl("Invalid material instance ID %d referenced by mesh" % materialInstanceID)
+			if not firstFaceIndexID < len(faceIndices):
+				raise InvalidFmdl("Invalid face index ID %d referenced by mesh" % firstFaceIndexID)
+			(lodFirstFaceVertexIndex, lodFaceVertexCount) = faceIndices[firstFaceIndexID]
+			
+			mesh = FmdlSummary.Mesh()
+			mesh.vertexCount = vertexCount
+			mesh.faceCount = (lodFaceVertexCount + 2) // 3
+			mesh.materialInstance = materialInstances[materialInstanceID]
+			meshes.append(mesh)
+		return meshes
+	
+	def readFile(self, filename):
+		fmdl = FmdlContainer()
+		with open(filename, 'rb') as stream:
+			fmdl.readStream(stream, [3])
+		
+		(strings, extensionHeaders) = FmdlFile.parseStrings(fmdl)
+		boundingBoxes = FmdlFile.parseBoundingBoxes(fmdl)
+		bones = FmdlFile.parseBones(fmdl, strings, boundingBoxes)
+		materialInstances = FmdlFile.parseMaterialInstances(fmdl, strings, False)
+		
+		self.boneNames = [bone.name for bone in bones]
+		self.materialInstances = materialInstances
+		self.textures = FmdlFile.parseTextures(fmdl, strings)
+		self.meshes = self.parseMeshes(fmdl, materialInstances)
+		self.extensionHeaders = extensionHeaders
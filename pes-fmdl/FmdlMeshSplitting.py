@@ -1,4 +1,7 @@
 from . import FmdlFile, PesSkeletonData
+import collections
+import heapq
+import itertools
 import numpy
 
 #
@@ -103,10 +106,13 @@ def indistinguishableEncoding(encodedVertex, vertexFields):
 #
 # Sets of equipresent vertices are lists, which cannot be hashed.
 # A container object for it CAN be hashed, and therefore stored in sets.
+# Sets hash by identity, so wherever their order matters, they are ordered by
+# index, the position of their first vertex in the mesh.
 #
 class VertexSet:
-	def __init__(self, vertices):
+	def __init__(self, vertices, index):
 		self.vertices = vertices
+		self.index = index
 
 #
 # Stores a face as a sequence of *encoded* vertices
@@ -119,24 +125,81 @@ class StorableItems:
 	def __init__(self):
 		self.faces = set()
 		self.looseVertices = set()
+		
+		#
+		# Aggregates over the equipresent vertex sets used by the items,
+		# maintained by BoneDescendentStorableItems once aggregated is set:
+		# the number of uses of each vertex set by the items, the total number
+		# of vertices in those vertex sets, and the number of those vertex sets
+		# that reference each bone.
+		#
+		self.aggregated = False
+		self.vertexSetReferences = collections.Counter()
+		self.vertexCount = 0
+		self.boneReferences = collections.Counter()
+	
+	def addVertexSets(self, vertexSets):
+		for (vertexSet, count) in collections.Counter(vertexSets).items():
+			if vertexSet in self.vertexSetReferences:
+				self.vertexSetReferences[vertexSet] += count
+				continue
+			self.vertexSetReferences[vertexSet] = count
+			self.vertexCount += len(vertexSet.vertices)
+			for (bone, weight) in (vertexSet.vertices[0].boneMapping or []):
+				self.boneReferences[bone] += 1
+	
+	def clearVertexSets(self):
+		self.vertexSetReferences.clear()
+		self.vertexCount = 0
+		self.boneReferences.clear()
+	
+	def removeVertexSets(self, vertexSets):
+		for (vertexSet, count) in collections.Counter(vertexSets).items():
+			if self.vertexSetReferences[vertexSet] > count:
+				self.vertexSetReferences[vertexSet] -= count
+				continue
+			del self.vertexSetReferences[vertexSet]
+			self.vertexCount -= len(vertexSet.vertices)
+			for (bone, weight) in (vertexSet.vertices[0].boneMapping or []):
+				if self.boneReferences[bone] > 1:
+					self.boneReferences[bone] -= 1
+				else:
+					del self.boneReferences[bone]
 
 #
 # Maintains, for each bone, the set of faces and the set of looseVertexSets
 # that contain a bone that is a descendent of $bone.
 #
+# Each item is recorded under the chain of ancestor bones of the bones it
+# references. itemBones remembers those bones for every item, so that removing
+# a submesh only touches the bones its own items were recorded under, rather
+# than every bone in the model.
+#
+# The aggregates of a bone are computed the first time they are requested,
+# and from then on updated as items are removed. Only the bones whose
+# aggregates splitting actually inspects pay for maintaining them.
+#
 class BoneDescendentStorableItems:
-	def __init__(self, parentBones, encodedFaceIndices, looseVertexSets):
+	def __init__(self, parentBones, encodedFaceIndices, looseVertexSets, equipresentVertices):
 		self.itemsPerBone = {}
+		self.itemBones = {}
+		self.equipresentVertices = equipresentVertices
 		
 		# None functions as the root bone.
 		self.itemsPerBone[None] = StorableItems()
 		self.itemsPerBone[None].faces = set(encodedFaceIndices.keys())
 		self.itemsPerBone[None].looseVertices = looseVertexSets.copy()
+		for face in encodedFaceIndices.keys():
+			self.itemBones[face] = [None]
+		for vertexSet in looseVertexSets:
+			self.itemBones[vertexSet] = [None]
+		
 		if parentBones is not None:
 			for bone in parentBones.keys():
 				self.itemsPerBone[bone] = StorableItems()
 			
 			for face in encodedFaceIndices.keys():
+				faceBones = self.itemBones[face]
 				for vertex in face.vertices:
 					for (bone, weight) in vertex.boneMapping:
 						currentBone = bone
@@ -144,6 +207,7 @@ class BoneDescendentStorableItems:
 							if face in self.itemsPerBone[currentBone].faces:
 								break
 							self.itemsPerBone[currentBone].faces.add(face)
+							faceBones.append(currentBone)
 							currentBone = parentBones[currentBone]
 			
 			for vertexSet in looseVertexSets:
@@ -151,6 +215,7 @@ class BoneDescendentStorableItems:
 				# All vertices in a vertexSet have the same bone
 				# mapping, so we can just take one at random.
 				#
+				vertexSetBones = self.itemBones[vertexSet]
 				vertex = vertexSet.vertices[0]
 				for (bone, weight) in vertex.boneMapping:
 					currentBone = bone
@@ -158,18 +223,59 @@ class BoneDescendentStorableItems:
 						if vertexSet in self.itemsPerBone[currentBone].looseVertices:
 							break
 						self.itemsPerBone[currentBone].looseVertices.add(vertexSet)
+						vertexSetBones.append(currentBone)
 						currentBone = parentBones[currentBone]
 	
+	#
+	# The equipresent vertex sets used by a collection of items, one entry
+	# per use.
+	#
+	def itemVertexSets(self, faces, looseVertices):
+		return itertools.chain(
+			map(self.equipresentVertices.__getitem__, itertools.chain.from_iterable(face.vertices for face in faces)),
+			looseVertices,
+		)
+	
+	#
+	# Returns the live items of $bone. These must not be modified, and need to
+	# be copied before they are passed to remove().
+	#
 	def get(self, bone):
-		items = StorableItems()
-		items.faces = self.itemsPerBone[bone].faces.copy()
-		items.looseVertices = self.itemsPerBone[bone].looseVertices.copy()
+		return self.itemsPerBone[bone]
+	
+	#
+	# Returns the live items of $bone, with their aggregates.
+	#
+	def getAggregated(self, bone):
+		items = self.itemsPerBone[bone]
+		if not items.aggregated:
+			items.addVertexSets(self.itemVertexSets(items.faces, items.looseVertices))
+			items.aggregated = True
 		return items
 	
 	def remove(self, storedItems):
-		for key in self.itemsPerBone.keys():
-			self.itemsPerBone[key].faces -= storedItems.faces
-			self.itemsPerBone[key].looseVertices -= storedItems.looseVertices
+		removedFaces = {}
+		removedLooseVertices = {}
+		for face in storedItems.faces:
+			for bone in self.itemBones.pop(face):
+				self.itemsPerBone[bone].faces.discard(face)
+				if self.itemsPerBone[bone].aggregated:
+					removedFaces.setdefault(bone, []).append(face)
+		for vertexSet in storedItems.looseVertices:
+			for bone in self.itemBones.pop(vertexSet):
+				self.itemsPerBone[bone].looseVertices.discard(vertexSet)
+				if self.itemsPerBone[bone].aggregated:
+					removedLooseVertices.setdefault(bone, []).append(vertexSet)
+		
+		for bone in removedFaces.keys() | removedLooseVertices.keys():
+			items = self.itemsPerBone[bone]
+			if len(items.faces) == 0 and len(items.looseVertices) == 0:
+				items.clearVertexSets()
+			else:
+				items.removeVertexSets(self.itemVertexSets(
+					removedFaces.get(bone, []),
+					removedLooseVertices.get(bone, []),
+				))
 
 #
 # Vertex sequences with the same splitVertexKey need to preserve their relative
@@ -198,11 +304,11 @@ def computeEquipresentVertexSets(mesh):
 	#
 	output = {}
 	
-	for vertexEncoding in mesh.vertexEncoding:
+	for (index, vertexEncoding) in enumerate(mesh.vertexEncoding):
 		encoding = splitVertexKey(vertexEncoding, mesh.vertexFields)
 		if encoding not in equipresentVertices:
 			equipresentVertices[encoding] = [vertexEncoding]
-			output[vertexEncoding] = VertexSet(equipresentVertices[encoding])
+			output[vertexEncoding] = VertexSet(equipresentVertices[encoding], index)
 		else:
 			equipresentVertices[encoding].append(vertexEncoding)
 			output[vertexEncoding] = output[equipresentVertices[encoding][0]]
@@ -281,26 +387,25 @@ def selectSubmeshBaseBone(parentBones, storableItemsPerBone):
 	
 	return None
 
-def fitsInSubmesh(storableItems, equipresentVertices, vertexFields):
-	if len(storableItems.faces) > FACE_LIMIT_SOFT:
+def fitsInSubmesh(storableItemsPerBone, bone, vertexFields):
+	if len(storableItemsPerBone.get(bone).faces) > FACE_LIMIT_SOFT:
 		return False
-	equipresentVertices = set(equipresentVertices[vertex] for face in storableItems.faces for vertex in face.vertices) | storableItems.looseVertices
-	if sum(len(vertexSet.vertices) for vertexSet in equipresentVertices) > VERTEX_LIMIT_SOFT:
+	storableItems = storableItemsPerBone.getAggregated(bone)
+	if storableItems.vertexCount > VERTEX_LIMIT_SOFT:
 		return False
 	if vertexFields.hasBoneMapping:
-		bones = set(bone for vertexSet in equipresentVertices for (bone, weight) in vertexSet.vertices[0].boneMapping)
-		if len(bones) > BONE_LIMIT_SOFT:
+		if len(storableItems.boneReferences) > BONE_LIMIT_SOFT:
 			return False
 	return True
 
-def computeSortVector(storableItems, bone):
+def computeSortVector(storableItems, bone, encodedFaceIndices):
 	#
 	# Perform a principal component analysis on the set of vertices in
 	# storableItems, and order vertices on distance along this vector.
 	#
 	encodedVertices = (
-		  [vertex for face in storableItems.faces for vertex in face.vertices]
-		+ [vertexSet.vertices[0] for vertexSet in storableItems.looseVertices]
+		  [vertex for face in sorted(storableItems.faces, key = lambda face : encodedFaceIndices[face]) for vertex in face.vertices]
+		+ [vertexSet.vertices[0] for vertexSet in sorted(storableItems.looseVertices, key = lambda vertexSet : vertexSet.index)]
 	)
 	coordinates = numpy.array([(v.vertex.position.x, v.vertex.position.y, v.vertex.position.z) for v in encodedVertices])
 	coordinateMeans = numpy.mean(coordinates, axis = 0)
@@ -332,101 +437,222 @@ def computeSortVector(storableItems, bone):
 	
 	return sortVector
 
+#
+# A selection of storable items for a submesh, that grows one item at a time
+# for as long as the result stays within the soft submesh limits.
+#
+class Fragment:
+	def __init__(self):
+		self.faces = set()
+		self.looseVertices = set()
+		self.bones = set()
+		self.equipresentVertices = set()
+		self.vertexCount = 0
+	
+	def addFace(self, face, equipresentVertices):
+		addedBones = set()
+		addedEquipresentVertices = set()
+		addedVertexCount = 0
+		for encodedVertex in face.vertices:
+			equipresentVertex = equipresentVertices[encodedVertex]
+			if (
+				    equipresentVertex not in self.equipresentVertices
+				and equipresentVertex not in addedEquipresentVertices
+			):
+				addedEquipresentVertices.add(equipresentVertex)
+				addedVertexCount += len(equipresentVertex.vertices)
+				for (bone, weight) in (encodedVertex.boneMapping or []):
+					if bone not in self.bones:
+						addedBones.add(bone)
+		
+		if (
+			    len(self.bones) + len(addedBones) > BONE_LIMIT_SOFT
+			or self.vertexCount + addedVertexCount > VERTEX_LIMIT_SOFT
+		):
+			return False
+		
+		self.faces.add(face)
+		self.bones |= addedBones
+		self.equipresentVertices |= addedEquipresentVertices
+		self.vertexCount += addedVertexCount
+		return True
+	
+	def addLooseVertices(self, vertexSet):
+		addedBones = set()
+		for (bone, weight) in (vertexSet.vertices[0].boneMapping or []):
+			if bone not in self.bones:
+				addedBones.add(bone)
+		addedVertexCount = len(vertexSet.vertices)
+		
+		if (
+			    len(self.bones) + len(addedBones) > BONE_LIMIT_SOFT
+			or self.vertexCount + addedVertexCount > VERTEX_LIMIT_SOFT
+		):
+			return False
+		
+		self.looseVertices.add(vertexSet)
+		self.bones |= addedBones
+		self.equipresentVertices.add(vertexSet)
+		self.vertexCount += addedVertexCount
+		return True
+
+#
+# When a bone subtree does not fit a single submesh, a fragment of it is split
+# off instead. The sort vector strategy takes faces in decreasing order of
+# their score along the sort vector, which cuts the subtree into slices across
+# that vector. Slices of meshes that are not convex, such as a pair of legs,
+# fall apart into disconnected pieces, each of which duplicates the vertices on
+# its cut edges.
+#
+# The region growing strategy instead grows the fragment over the faces that
+# share an edge, starting from the highest scoring face, and always extending
+# it with the highest scoring face on its border. This still cuts along the
+# sort vector, but keeps to one connected piece of the mesh at a time. Only
+# when a piece is exhausted does it start over from the highest scoring face
+# not yet tried.
+#
+FRAGMENT_STRATEGY_SORT_VECTOR = 'sort-vector'
+FRAGMENT_STRATEGY_REGION_GROWING = 'region-growing'
+
+#
+# Builds the edge-to-face index of a mesh, and from it, for each face, the
+# faces that share an edge with it. Vertices of the same equipresent vertex
+# set, such as the loops of a vertex on a UV seam, count as the same vertex.
+#
+def computeFaceNeighbours(encodedFaceIndices, equipresentVertices):
+	edgeFaces = {}
+	for face in encodedFaceIndices.keys():
+		vertexSets = [equipresentVertices[encodedVertex] for encodedVertex in face.vertices]
+		for i in range(3):
+			(a, b) = (vertexSets[i], vertexSets[(i + 1) % 3])
+			if a is b:
+				continue
+			edge = (a, b) if a.index < b.index else (b, a)
+			if edge not in edgeFaces:
+				edgeFaces[edge] = [face]
+			else:
+				edgeFaces[edge].append(face)
+	
+	faceNeighbours = {}
+	for face in encodedFaceIndices.keys():
+		faceNeighbours[face] = []
+	for faces in edgeFaces.values():
+		for face in faces:
+			for neighbour in faces:
+				if neighbour is not face:
+					faceNeighbours[face].append(neighbour)
+	return faceNeighbours
+
+#
+# Grows $fragment over the faces in $orderedFaces, which are ordered by
+# decreasing score. The border face that comes first in that order is always
+# tried next.
+#
+def growFragment(fragment, orderedFaces, faceNeighbours, equipresentVertices):
+	faceOrder = {}
+	for face in orderedFaces:
+		faceOrder[face] = len(faceOrder)
+	
+	triedFaces = set()
+	for seedFace in orderedFaces:
+		if len(fragment.faces) >= FACE_LIMIT_SOFT:
+			break
+		if seedFace in triedFaces:
+			continue
+		
+		triedFaces.add(seedFace)
+		border = [faceOrder[seedFace]]
+		while len(border) > 0 and len(fragment.faces) < FACE_LIMIT_SOFT:
+			face = orderedFaces[heapq.heappop(border)]
+			if not fragment.addFace(face, equipresentVertices):
+				continue
+			for neighbour in faceNeighbours[face]:
+				if neighbour in faceOrder and neighbour not in triedFaces:
+					triedFaces.add(neighbour)
+					heapq.heappush(border, faceOrder[neighbour])
+
 #
 # Split off a subset of storable items into a new mesh object.
 #
-def buildSubmesh(mesh, parentBones, storableItemsPerBone, equipresentVertices, encodedFaceIndices):
+def buildSubmesh(mesh, parentBones, storableItemsPerBone, equipresentVertices, encodedFaceIndices, fragmentStrategy, faceNeighbours):
 	baseBone = selectSubmeshBaseBone(parentBones, storableItemsPerBone)
 	storableItems = storableItemsPerBone.get(baseBone)
 	
-	if fitsInSubmesh(storableItems, equipresentVertices, mesh.vertexFields):
+	if fitsInSubmesh(storableItemsPerBone, baseBone, mesh.vertexFields):
 		#
 		# Find the highest up ancestor bone that still fits a single submesh
 		#
 		while baseBone is not None:
 			childBone = parentBones[baseBone]
 			childStorableItems = storableItemsPerBone.get(childBone)
-			if not fitsInSubmesh(childStorableItems, equipresentVertices, mesh.vertexFields):
+			if not fitsInSubmesh(storableItemsPerBone, childBone, mesh.vertexFields):
 				break
 			baseBone = childBone
 			storableItems = childStorableItems
 		
-		storedItems = storableItems
-		selectedEquipresentVertices = set(equipresentVertices[vertex] for face in storedItems.faces for vertex in face.vertices) | storedItems.looseVertices
+		storedItems = StorableItems()
+		storedItems.faces = storableItems.faces.copy()
+		storedItems.looseVertices = storableItems.looseVertices.copy()
+		selectedEquipresentVertices = set(storableItems.vertexSetReferences.keys())
 		if mesh.vertexFields.hasBoneMapping:
-			selectedBones = set(bone for vertexSet in selectedEquipresentVertices for (bone, weight) in vertexSet.vertices[0].boneMapping)
+			selectedBones = set(storableItems.boneReferences.keys())
 		else:
 			selectedBones = set()
 	else:
 		#
 		# Build a fragment of the storable items.
 		#
-		selectedFaces = set()
-		selectedLooseVertices = set()
-		selectedBones = set()
-		selectedEquipresentVertices = set()
-		totalVertexCount = 0
-		
-		sortVector = computeSortVector(storableItems, baseBone)
+		sortVector = computeSortVector(storableItems, baseBone, encodedFaceIndices)
 		def vectorScore(encodedVertex):
 			vector = (encodedVertex.vertex.position.x, encodedVertex.vertex.position.y, encodedVertex.vertex.position.z)
 			return sum(vector[i] * sortVector[i] for i in range(len(vector)))
 		
-		for face in sorted(storableItems.faces, reverse = True, key = lambda face :
+		fragment = Fragment()
+		
+		#
+		# Items that score equally are taken in mesh order.
+		#
+		faces = sorted(storableItems.faces, key = lambda face : encodedFaceIndices[face])
+		faces = sorted(faces, reverse = True, key = lambda face :
 			max(vectorScore(v) for v in face.vertices)
-		):
-			if len(selectedFaces) >= FACE_LIMIT_SOFT:
-				break
-			
-			addedBones = set()
-			addedEquipresentVertices = set()
-			addedVertexCount = 0
-			for encodedVertex in face.vertices:
-				equipresentVertex = equipresentVertices[encodedVertex]
-				if (
-					    equipresentVertex not in selectedEquipresentVertices
-					and equipresentVertex not in addedEquipresentVertices
-				):
-					addedEquipresentVertices.add(equipresentVertex)
-					addedVertexCount += len(equipresentVertex.vertices)
-					for (bone, weight) in (encodedVertex.boneMapping or []):
-						if bone not in selectedBones:
-							addedBones.add(bone)
-			
-			if (
-				    len(selectedBones) + len(addedBones) <= BONE_LIMIT_SOFT
-				and totalVertexCount + addedVertexCount <= VERTEX_LIMIT_SOFT
-			):
-				selectedFaces.add(face)
-				selectedBones |= addedBones
-				selectedEquipresentVertices |= addedEquipresentVertices
-				totalVertexCount += addedVertexCount
+		)
+		if fragmentStrategy == FRAGMENT_STRATEGY_REGION_GROWING:
+			growFragment(fragment, faces, faceNeighbours, equipresentVertices)
+		else:
+			for face in faces:
+				if len(fragment.faces) >= FACE_LIMIT_SOFT:
+					break
+				fragment.addFace(face, equipresentVertices)
 		
-		for looseVertex in sorted(storableItems.looseVertices, reverse = True, key = lambda vertex : vectorScore(vertex)):
-			if totalVertexCount >= VERTEX_LIMIT_SOFT:
+		looseVertices = sorted(storableItems.looseVertices, key = lambda vertexSet : vertexSet.index)
+		for looseVertex in sorted(looseVertices, reverse = True, key = lambda vertexSet : vectorScore(vertexSet.vertices[0])):
+			if fragment.vertexCount >= VERTEX_LIMIT_SOFT:
 				break
-			
-			encodedVertex = looseVertex.vertices[0]
-			
-			addedBones = set()
-			for (bone, weight) in (encodedVertex.boneMapping or []):
-				if bone not in selectedBones:
-					addedBones.add(bone)
-			addedVertexCount = len(looseVertex.vertices)
-			
-			if (
-				    len(selectedBones) + len(addedBones) <= BONE_LIMIT_SOFT
-				and totalVertexCount + addedVertexCount <= VERTEX_LIMIT_SOFT
-			):
-				selectedLooseVertices.add(looseVertex)
-				selectedBones |= addedBones
-				selectedEquipresentVertices.add(looseVertex)
-				totalVertexCount += addedVertexCount
+			fragment.addLooseVertices(looseVertex)
 		
 		storedItems = StorableItems()
-		storedItems.faces = selectedFaces
-		storedItems.looseVertices = selectedLooseVertices
+		storedItems.faces = fragment.faces
+		storedItems.looseVertices = fragment.looseVertices
+		selectedBones = fragment.bones
+		selectedEquipresentVertices = fragment.equipresentVertices
 	
+	submesh = createSubmesh(
+		mesh,
+		selectedBones,
+		[vertex for vertexSet in sorted(selectedEquipresentVertices, key = lambda vertexSet : vertexSet.index) for vertex in vertexSet.vertices],
+		[
+			FmdlFile.FmdlFile.Face(*(encodedVertex.vertex for encodedVertex in face.vertices))
+			for face in sorted(storedItems.faces, key = lambda face : encodedFaceIndices[face])
+		],
+	)
+	
+	return (submesh, storedItems)
+
+#
+# Creates a submesh of $mesh out of a selection of its bones, encoded vertices,
+# and faces.
+#
+def createSubmesh(mesh, selectedBones, vertexEncoding, faces):
 	submesh = FmdlFile.FmdlFile.Mesh()
 	submesh.materialInstance = mesh.materialInstance
 	submesh.alphaFlags = mesh.alphaFlags
@@ -435,32 +661,33 @@ def buildSubmesh(mesh, parentBones, storableItemsPerBone, equipresentVertices, e
 	submesh.extensionHeaders = mesh.extensionHeaders.copy()
 	submesh.boneGroup = FmdlFile.FmdlFile.BoneGroup()
 	submesh.boneGroup.bones = [bone for bone in mesh.boneGroup.bones if bone in selectedBones]
-	submesh.vertexEncoding = [vertex for vertexSet in selectedEquipresentVertices for vertex in vertexSet.vertices]
+	submesh.vertexEncoding = vertexEncoding
 	submesh.vertices = [encodedVertex.vertex for encodedVertex in submesh.vertexEncoding]
-	submesh.faces = [
-		FmdlFile.FmdlFile.Face(*(encodedVertex.vertex for encodedVertex in face.vertices))
-		for face in sorted(storedItems.faces, key = lambda face : encodedFaceIndices[face])
-	]
-	
-	return (submesh, storedItems)
+	submesh.faces = faces
+	return submesh
 
 #
 # Splits a mesh into a collection of submeshes that each fit within an fmdl
 # mesh object.
 #
-def splitMesh(mesh, parentBones, descendentBones):
-	equipresentVertices = computeEquipresentVertexSets(mesh)
-	(encodedFaceIndices, looseVertexSets) = makeStorableItems(mesh.vertexEncoding, equipresentVertices, mesh.faces)
-	
-	storableItemsPerBone = BoneDescendentStorableItems(parentBones if mesh.vertexFields.hasBoneMapping else None, encodedFaceIndices, looseVertexSets)
-	
-	submeshes = []
-	while len(storableItemsPerBone.get(None).faces) > 0 or len(storableItemsPerBone.get(None).looseVertices) > 0:
-		(submesh, storedItems) = buildSubmesh(mesh, parentBones, storableItemsPerBone, equipresentVertices, encodedFaceIndices)
-		storableItemsPerBone.remove(storedItems)
-		submeshes.append(submesh)
-	
-	return submeshes
+def splitMesh(mesh, parentBones, descendentBones, fragmentStrategy = FRAGMENT_STRATEGY_SORT_VECTOR):
+	with FmdlFile.suspendedGarbageCollection():
+		equipresentVertices = computeEquipresentVertexSets(mesh)
+		(encodedFaceIndices, looseVertexSets) = makeStorableItems(mesh.vertexEncoding, equipresentVertices, mesh.faces)
+		if fragmentStrategy == FRAGMENT_STRATEGY_REGION_GROWING:
+			faceNeighbours = computeFaceNeighbours(encodedFaceIndices, equipresentVertices)
+		else:
+			faceNeighbours = None
+		
+		storableItemsPerBone = BoneDescendentStorableItems(parentBones if mesh.vertexFields.hasBoneMapping else None, encodedFaceIndices, looseVertexSets, equipresentVertices)
+		
+		submeshes = []
+		while len(storableItemsPerBone.get(None).faces) > 0 or len(storableItemsPerBone.get(None).looseVertices) > 0:
+			(submesh, storedItems) = buildSubmesh(mesh, parentBones, storableItemsPerBone, equipresentVertices, encodedFaceIndices, fragmentStrategy, faceNeighbours)
+			storableItemsPerBone.remove(storedItems)
+			submeshes.append(submesh)
+		
+		return submeshes
 
 #
 # Compute the effective parent bone for each bone in the model, used for
@@ -561,68 +788,74 @@ def meshNeedsSplitting(mesh):
 		or len(mesh.faces) > FACE_LIMIT_HARD
 	)
 
-def encodeFmdlSplitMeshes(fmdl):
+#
+# Replaces the oversized meshes of fmdl by split mesh groups, in place.
+# sourceMeshes optionally maps meshes to other meshes of fmdl with the same
+# vertices, faces, vertex fields and bone group, whose submeshes they copy
+# rather than splitting them again; it is extended with the corresponding
+# submeshes.
+#
+def encodeFmdlSplitMeshesInPlace(fmdl, fragmentStrategy = FRAGMENT_STRATEGY_SORT_VECTOR, sourceMeshes = None):
+	if sourceMeshes is None:
+		sourceMeshes = {}
+	
 	fmdl.precomputeVertexEncoding()
 	
-	didSplitFmdl = False
 	parentBones = computeParentBones(fmdl.bones)
 	descendentBones = computeDescendentBones(parentBones)
-	replacedMeshes = {}
 	
-	output = FmdlFile.FmdlFile()
-	output.bones = fmdl.bones
-	output.materialInstances = fmdl.materialInstances
-	output.extensionHeaders = fmdl.extensionHeaders.copy()
-	output.meshes = []
-	for mesh in fmdl.meshes:
-		if not meshNeedsSplitting(mesh):
-			output.meshes.append(mesh)
-			continue
-		
-		didSplitFmdl = True
-		meshes = splitMesh(mesh, parentBones, descendentBones)
-		output.meshes += meshes
-		replacedMeshes[mesh] = meshes
+	oversizedMeshes = [mesh for mesh in fmdl.meshes if meshNeedsSplitting(mesh)]
+	if len(oversizedMeshes) == 0:
+		return
 	
-	if not didSplitFmdl:
-		return fmdl
+	replacedMeshes = {}
+	for mesh in oversizedMeshes:
+		if sourceMeshes.get(mesh) not in oversizedMeshes:
+			replacedMeshes[mesh] = splitMesh(mesh, parentBones, descendentBones, fragmentStrategy)
+	for mesh in oversizedMeshes:
+		if mesh not in replacedMeshes:
+			replacedMeshes[mesh] = []
+			for sourceSubmesh in replacedMeshes[sourceMeshes[mesh]]:
+				submesh = createSubmesh(mesh, set(sourceSubmesh.boneGroup.bones), sourceSubmesh.vertexEncoding[:], sourceSubmesh.faces[:])
+				replacedMeshes[mesh].append(submesh)
+				sourceMeshes[submesh] = sourceSubmesh
 	
-	meshGroupMap = {}
-	for meshGroup in fmdl.meshGroups:
-		encodedMeshGroup = FmdlFile.FmdlFile.MeshGroup()
-		output.meshGroups.append(encodedMeshGroup)
-		meshGroupMap[meshGroup] = encodedMeshGroup
-	for meshGroup in fmdl.meshGroups:
-		encodedMeshGroup = meshGroupMap[meshGroup]
-		encodedMeshGroup.name = meshGroup.name
-		encodedMeshGroup.boundingBox = meshGroup.boundingBox
-		encodedMeshGroup.visible = meshGroup.visible
-		if meshGroup.parent is None:
-			encodedMeshGroup.parent = None
+	meshes = fmdl.meshes
+	fmdl.meshes = []
+	for mesh in meshes:
+		if mesh in replacedMeshes:
+			fmdl.meshes += replacedMeshes[mesh]
 		else:
-			encodedMeshGroup.parent = meshGroupMap[meshGroup.parent]
-		encodedMeshGroup.children = []
-		for child in meshGroup.children:
-			encodedMeshGroup.children.append(meshGroupMap[child])
-		encodedMeshGroup.meshes = []
-		for mesh in meshGroup.meshes:
+			fmdl.meshes.append(mesh)
+	
+	for meshGroup in fmdl.meshGroups[:]:
+		meshes = meshGroup.meshes
+		meshGroup.meshes = []
+		for mesh in meshes:
 			if mesh in replacedMeshes:
 				newMeshGroup = FmdlFile.FmdlFile.MeshGroup()
 				newMeshGroup.name = 'split-mesh'
 				newMeshGroup.boundingBox = meshGroup.boundingBox
 				newMeshGroup.visible = meshGroup.visible
-				newMeshGroup.parent = encodedMeshGroup
-				encodedMeshGroup.children.append(newMeshGroup)
+				newMeshGroup.parent = meshGroup
+				meshGroup.children.append(newMeshGroup)
 				newMeshGroup.meshes = replacedMeshes[mesh]
 				newMeshGroup.extensionHeaders = { 'Split-Mesh-Groups' }
-				output.meshGroups.append(newMeshGroup)
+				fmdl.meshGroups.append(newMeshGroup)
 			else:
-				encodedMeshGroup.meshes.append(mesh)
+				meshGroup.meshes.append(mesh)
 	
-	if 'X-FMDL-Extensions' not in output.extensionHeaders:
-		output.extensionHeaders['X-FMDL-Extensions'] = []
-	output.extensionHeaders['X-FMDL-Extensions'].append("mesh-splitting")
+	if 'X-FMDL-Extensions' not in fmdl.extensionHeaders:
+		fmdl.extensionHeaders['X-FMDL-Extensions'] = []
+	fmdl.extensionHeaders['X-FMDL-Extensions'].append("mesh-splitting")
+
+def encodeFmdlSplitMeshes(fmdl, fragmentStrategy = FRAGMENT_STRATEGY_SORT_VECTOR):
+	fmdl.precomputeVertexEncoding()
+	if not any(meshNeedsSplitting(mesh) for mesh in fmdl.meshes):
+		return fmdl
 	
+	output = fmdl.copyStructure()
+	encodeFmdlSplitMeshesInPlace(output, fragmentStrategy)
 	return output
 
 
@@ -655,31 +888,207 @@ def combineMesh(outputMesh, inputMesh, mergedEncodedVertices):
 			*(vertexEncodings[vertex].vertex for vertex in face.vertices)
 		))
 
-def combineMeshes(meshes, bones):
-	output = FmdlFile.FmdlFile.Mesh()
-	output.materialInstance = meshes[0].materialInstance
-	output.alphaFlags = meshes[0].alphaFlags
-	output.shadowFlags = meshes[0].shadowFlags
-	output.vertexFields = meshes[0].vertexFields
-	output.extensionHeaders = meshes[0].extensionHeaders.copy()
+#
+# Encodes the indistinguishableEncoding() of each vertex of a mesh as a row of
+# a (vertexCount, width) uint8 array, so that the vertices of all submeshes can
+# be compared at once. Bone mappings are stored as four (bone ID, weight)
+# pairs, with bones identified by their index in boneIDs rather than in the
+# bone group of the mesh, and unused pairs set to (0xffff, 0).
+#
+# Columnar meshes are encoded straight from their columns, as they would be
+# stored in the vertex buffer. For other meshes, the byte strings of their
+# vertexEncoding are joined per field.
+#
+def indistinguishableEncodingRows(mesh, boneIDs):
+	vertexFields = mesh.vertexFields
+	if mesh.isColumnar():
+		vertexCount = len(mesh.positions)
+		records = mesh.encodeColumns()
+		def fieldRows(fieldName):
+			return numpy.ascontiguousarray(records[fieldName]).view(numpy.uint8).reshape((vertexCount, -1))
+		
+		if vertexFields.hasBoneMapping:
+			boneGroupIDs = numpy.array([boneIDs[bone] for bone in mesh.boneGroup.bones] + [0xffff], dtype = numpy.uint16)
+			boneWeights = records['boneWeights']
+			boneMappingIDs = numpy.where(boneWeights > 0, boneGroupIDs[records['boneIndices']], 0xffff).astype(numpy.uint16)
+	else:
+		vertexCount = len(mesh.vertexEncoding)
+		def fieldRows(fieldName):
+			return FmdlFile.FmdlFile.encodedFieldRows(mesh.vertexEncoding, fieldName)
+		
+		if vertexFields.hasBoneMapping:
+			(boneMappingIDs, boneWeights) = FmdlFile.FmdlFile.encodedBoneMappingRows(mesh.vertexEncoding, boneIDs)
+	
+	fieldNames = ['position']
+	if vertexFields.hasNormal:
+		fieldNames.append('normal')
+	if vertexFields.hasColor:
+		fieldNames.append('color')
+	for i in range(4):
+		if vertexFields.uvCount > i:
+			fieldNames.append('uv%d' % i)
+	if vertexFields.hasTangent:
+		fieldNames.append('tangent')
+	
+	if vertexCount == 0:
+		columns = [numpy.zeros((0, 0), dtype = numpy.uint8)]
+	else:
+		columns = [fieldRows(fieldName) for fieldName in fieldNames]
+	if vertexFields.hasBoneMapping:
+		columns.append(boneMappingIDs.view(numpy.uint8).reshape((vertexCount, -1)))
+		columns.append(numpy.asarray(boneWeights, dtype = numpy.uint8).reshape((vertexCount, -1)))
+	return numpy.ascontiguousarray(numpy.hstack(columns))
+
+#
+# Computes, for each vertex of the concatenation of meshes, the index of the
+# vertex of the combined mesh it represents, as well as the indices of the
+# vertices that make up the combined mesh. This is equivalent to running
+# combineMesh() on each mesh in turn: a vertex that is the Nth vertex with a
+# particular indistinguishableEncoding() in its mesh is replaced by the first
+# vertex that is the Nth vertex with that encoding in any mesh.
+#
+# Returns None if the meshes do not encode their vertices with the same width,
+# which does not happen for meshes split by this extension.
+#
+def combineVertexIndices(meshes, bones):
+	boneIDs = {}
+	for (index, bone) in enumerate(bones):
+		boneIDs[bone] = index
+	for mesh in meshes:
+		if mesh.boneGroup is not None:
+			for bone in mesh.boneGroup.bones:
+				if bone not in boneIDs:
+					boneIDs[bone] = len(boneIDs)
 	
-	output.vertexEncoding = []
-	output.vertices = []
-	output.faces = []
+	rows = [indistinguishableEncodingRows(mesh, boneIDs) for mesh in meshes]
+	widths = set(meshRows.shape[1] for meshRows in rows if len(meshRows) > 0)
+	if len(widths) > 1:
+		return None
+	width = widths.pop() if len(widths) > 0 else 0
+	
+	vertexCount = sum(len(meshRows) for meshRows in rows)
+	if vertexCount == 0:
+		return (numpy.zeros(0, dtype = numpy.int64), numpy.zeros(0, dtype = numpy.int64))
+	allRows = numpy.concatenate([meshRows.reshape((-1, width)) for meshRows in rows])
+	(uniqueEncodings, encodingIDs) = numpy.unique(allRows.view(numpy.dtype((numpy.void, width))).ravel(), return_inverse = True)
+	encodingIDs = encodingIDs.ravel()
 	
 	#
-	# Maintain, for each indistinguishableEncoding, the sequence of
-	# encodedVertices in the outpush mesh using this encoding.
+	# Number each vertex by the number of vertices before it in the same mesh
+	# with the same encoding.
 	#
-	mergedEncodedVertices = {}
-	for mesh in meshes:
-		combineMesh(output, mesh, mergedEncodedVertices)
+	meshIDs = numpy.repeat(numpy.arange(len(meshes)), [len(meshRows) for meshRows in rows])
+	order = numpy.lexsort((numpy.arange(vertexCount), encodingIDs, meshIDs))
+	runStarts = numpy.ones(vertexCount, dtype = bool)
+	runStarts[1:] = (meshIDs[order][1:] != meshIDs[order][:-1]) | (encodingIDs[order][1:] != encodingIDs[order][:-1])
+	runStartPositions = numpy.maximum.accumulate(numpy.where(runStarts, numpy.arange(vertexCount), 0))
+	occurrences = numpy.empty(vertexCount, dtype = numpy.int64)
+	occurrences[order] = numpy.arange(vertexCount) - runStartPositions
+	
+	keys = encodingIDs.astype(numpy.int64) * (int(occurrences.max()) + 1) + occurrences
+	(uniqueKeys, firstIndices, keyIDs) = numpy.unique(keys, return_index = True, return_inverse = True)
+	representatives = firstIndices[keyIDs.ravel()]
+	selectedIndices = numpy.flatnonzero(representatives == numpy.arange(vertexCount))
+	combinedIndices = numpy.empty(vertexCount, dtype = numpy.int64)
+	combinedIndices[selectedIndices] = numpy.arange(len(selectedIndices))
+	return (combinedIndices[representatives], selectedIndices)
+
+def combineColumnarMeshes(output, meshes, bones, vertexIndices, selectedIndices):
+	def combinedColumn(columns):
+		if any(column is None for column in columns):
+			return None
+		return numpy.concatenate(columns)[selectedIndices]
+	
+	output.positions = combinedColumn([mesh.positions for mesh in meshes])
+	output.normals = combinedColumn([mesh.normals for mesh in meshes])
+	output.tangents = combinedColumn([mesh.tangents for mesh in meshes])
+	output.colors = combinedColumn([mesh.colors for mesh in meshes])
+	output.uvs = [combinedColumn([mesh.uvs[i] for mesh in meshes]) for i in range(len(meshes[0].uvs))]
 	
 	output.boneGroup = FmdlFile.FmdlFile.BoneGroup()
 	if output.vertexFields.hasBoneMapping:
-		selectedBones = set(bone for encodedVertex in output.vertexEncoding for (bone, weight) in encodedVertex.boneMapping)
-		output.boneGroup.bones = [bone for bone in bones if bone in selectedBones]
-	return output
+		#
+		# Translate bone indices into indices in bones, select the bones used
+		# by the combined vertices, and translate them into indices in the
+		# combined bone group.
+		#
+		boneIDs = {}
+		for (index, bone) in enumerate(bones):
+			boneIDs[bone] = index
+		meshBoneIDs = []
+		meshWeights = []
+		for mesh in meshes:
+			boneGroupIDs = numpy.array([boneIDs.get(bone, -1) for bone in mesh.boneGroup.bones] + [-1], dtype = numpy.int64)
+			indices = numpy.asarray(mesh.boneIndices, dtype = numpy.int64)
+			weights = numpy.asarray(mesh.boneWeights, dtype = numpy.uint8)
+			used = (weights > 0) & (indices < len(mesh.boneGroup.bones))
+			meshBoneIDs.append(numpy.where(used, boneGroupIDs[numpy.minimum(indices, len(mesh.boneGroup.bones))], -1))
+			meshWeights.append(numpy.where(used, weights, 0))
+		boneMappingIDs = numpy.concatenate(meshBoneIDs)[selectedIndices]
+		boneWeights = numpy.concatenate(meshWeights)[selectedIndices]
+		usedBoneIDs = numpy.unique(boneMappingIDs[(boneWeights > 0) & (boneMappingIDs >= 0)])
+		output.boneGroup.bones = [bones[boneID] for boneID in usedBoneIDs.tolist()]
+		combinedBoneIndices = numpy.searchsorted(usedBoneIDs, boneMappingIDs)
+		output.boneIndices = numpy.where(boneWeights > 0, combinedBoneIndices, 0).astype(numpy.uint8)
+		output.boneWeights = boneWeights.astype(numpy.uint8)
+	
+	offsets = numpy.cumsum([0] + [len(mesh.positions) for mesh in meshes])
+	output.faceIndices = numpy.concatenate([
+		vertexIndices[offset + numpy.asarray(mesh.faceIndices, dtype = numpy.int64)].reshape((-1, 3))
+		for (offset, mesh) in zip(offsets.tolist(), meshes)
+	]).astype(numpy.int32)
+
+def combineMeshes(meshes, bones):
+	with FmdlFile.suspendedGarbageCollection():
+		combinedIndices = combineVertexIndices(meshes, bones)
+		
+		if combinedIndices is not None and all(mesh.isColumnar() for mesh in meshes):
+			output = FmdlFile.FmdlFile.ColumnarMesh()
+		else:
+			output = FmdlFile.FmdlFile.Mesh()
+		output.materialInstance = meshes[0].materialInstance
+		output.alphaFlags = meshes[0].alphaFlags
+		output.shadowFlags = meshes[0].shadowFlags
+		output.vertexFields = meshes[0].vertexFields
+		output.extensionHeaders = meshes[0].extensionHeaders.copy()
+		
+		if isinstance(output, FmdlFile.FmdlFile.ColumnarMesh):
+			(vertexIndices, selectedIndices) = combinedIndices
+			combineColumnarMeshes(output, meshes, bones, vertexIndices, selectedIndices)
+			return output
+		
+		output.vertexEncoding = []
+		output.vertices = []
+		output.faces = []
+		
+		if combinedIndices is None:
+			#
+			# Maintain, for each indistinguishableEncoding, the sequence of
+			# encodedVertices in the outpush mesh using this encoding.
+			#
+			mergedEncodedVertices = {}
+			for mesh in meshes:
+				combineMesh(output, mesh, mergedEncodedVertices)
+		else:
+			(vertexIndices, selectedIndices) = combinedIndices
+			encodedVertices = list(itertools.chain.from_iterable(mesh.vertexEncoding for mesh in meshes))
+			output.vertexEncoding = [encodedVertices[index] for index in selectedIndices.tolist()]
+			output.vertices = [encodedVertex.vertex for encodedVertex in output.vertexEncoding]
+			
+			offset = 0
+			for mesh in meshes:
+				meshVertexIndices = {}
+				for (index, encodedVertex) in enumerate(mesh.vertexEncoding):
+					meshVertexIndices[encodedVertex.vertex] = offset + index
+				faceIndices = numpy.array([meshVertexIndices[vertex] for face in mesh.faces for vertex in face.vertices], dtype = numpy.int64)
+				output.faces += FmdlFile.FmdlFile.makeFaces(vertexIndices[faceIndices].reshape((-1, 3)), output.vertices)
+				offset += len(mesh.vertexEncoding)
+		
+		output.boneGroup = FmdlFile.FmdlFile.BoneGroup()
+		if output.vertexFields.hasBoneMapping:
+			selectedBones = set(bone for encodedVertex in output.vertexEncoding for (bone, weight) in encodedVertex.boneMapping)
+			output.boneGroup.bones = [bone for bone in bones if bone in selectedBones]
+		return output
 
 def decodeFmdlSplitMeshes(fmdl):
 	if fmdl.extensionHeaders == None or "mesh-splitting" not in fmdl.extensionHeaders['x-fmdl-extensions']:
@@ -1,4 +1,5 @@
 from . import FmdlFile
+import numpy
 
 #
 # FMDL files store mesh geometry as vertices, and faces that are sequences of
@@ -87,127 +88,305 @@ def nontopologicalEncoding(encodedVertex, vertexFields):
 	return bytes(encoding)
 
 def replaceFaceVertices(faces, replacedVertices):
-	return [
-		FmdlFile.FmdlFile.Face(*[
-			(replacedVertices[vertex] if vertex in replacedVertices else vertex) for vertex in face.vertices
-		]) for face in faces
-	]
+	if len(replacedVertices) == 0:
+		return faces[:]
+	#
+	# Faces without replaced vertices are kept, as they are when there are no
+	# replaced vertices at all.
+	#
+	Face = FmdlFile.FmdlFile.Face
+	replacement = replacedVertices.get
+	unchanged = replacedVertices.keys().isdisjoint
+	with FmdlFile.suspendedGarbageCollection():
+		return [
+			face if unchanged(face.vertices) else Face(*[replacement(vertex, vertex) for vertex in face.vertices])
+			for face in faces
+		]
+
+#
+# Builds the encoded copy of mesh with the vertices of encodedVertices, in
+# that order, and with faces using the vertices in replacedVertices replaced.
+#
+def encodedMesh(mesh, encodedVertices, replacedVertices):
+	output = FmdlFile.FmdlFile.Mesh()
+	output.boneGroup = mesh.boneGroup
+	output.materialInstance = mesh.materialInstance
+	output.alphaFlags = mesh.alphaFlags
+	output.shadowFlags = mesh.shadowFlags
+	output.vertexFields = mesh.vertexFields
+	output.vertices = [encodedVertex.vertex for encodedVertex in encodedVertices]
+	output.faces = replaceFaceVertices(mesh.faces, replacedVertices)
+	output.vertexEncoding = encodedVertices
+	output.extensionHeaders = mesh.extensionHeaders.copy()
+	
+	return output
+
+#
+# The vertex fields that make up nontopologicalEncoding(), in order.
+#
+def nontopologicalFieldNames(vertexFields):
+	fieldNames = []
+	if vertexFields.hasNormal:
+		fieldNames.append('normal')
+	if vertexFields.hasColor:
+		fieldNames.append('color')
+	for i in range(4):
+		if vertexFields.uvCount > i:
+			fieldNames.append('uv%d' % i)
+	if vertexFields.hasTangent:
+		fieldNames.append('tangent')
+	return fieldNames
+
+#
+# Builds the byte strings compared by topologicalKey() and
+# nontopologicalEncoding() for all vertices of a mesh at once, as the rows of
+# two (vertexCount, width) uint8 arrays. Bones in bone mappings are encoded as
+# an arbitrary but consistent bone ID. The mesh must have at least one vertex.
+#
+# Columnar meshes are encoded straight from their columns, as they would be
+# stored in the vertex buffer, without building their vertexEncoding.
+#
+def encodingRows(mesh):
+	vertexFields = mesh.vertexFields
+	if mesh.isColumnar():
+		vertexCount = len(mesh.positions)
+		records = mesh.encodeColumns()
+		def fieldRows(fieldName):
+			return numpy.ascontiguousarray(records[fieldName]).view(numpy.uint8).reshape((vertexCount, -1))
+		
+		if vertexFields.hasBoneMapping:
+			boneIDs = {}
+			boneGroupIDs = numpy.array([boneIDs.setdefault(bone, len(boneIDs)) for bone in mesh.boneGroup.bones] + [0xffff], dtype = numpy.uint16)
+			boneWeights = records['boneWeights']
+			boneMappingIDs = numpy.where(boneWeights > 0, boneGroupIDs[records['boneIndices']], 0xffff).astype(numpy.uint16)
+	else:
+		vertexCount = len(mesh.vertexEncoding)
+		def fieldRows(fieldName):
+			return FmdlFile.FmdlFile.encodedFieldRows(mesh.vertexEncoding, fieldName)
+		
+		if vertexFields.hasBoneMapping:
+			(boneMappingIDs, boneWeights) = FmdlFile.FmdlFile.encodedBoneMappingRows(mesh.vertexEncoding, {})
+	
+	topologicalColumns = [fieldRows('position')]
+	if vertexFields.hasBoneMapping:
+		topologicalColumns.append(boneMappingIDs.view(numpy.uint8).reshape((vertexCount, -1)))
+		topologicalColumns.append(numpy.asarray(boneWeights, dtype = numpy.uint8).reshape((vertexCount, -1)))
+	
+	nontopologicalColumns = [numpy.zeros((vertexCount, 0), dtype = numpy.uint8)]
+	nontopologicalColumns += [fieldRows(fieldName) for fieldName in nontopologicalFieldNames(vertexFields)]
+	
+	return (numpy.hstack(topologicalColumns), numpy.hstack(nontopologicalColumns))
+
+#
+# Pads the rows of a (count, width) uint8 array to a multiple of eight bytes,
+# and views them as big endian integers, so that comparing rows eight bytes
+# at a time compares them in lexicographical order.
+#
+def lexicographicalWords(rows):
+	(count, width) = rows.shape
+	paddedRows = numpy.zeros((count, (width + 7) // 8 * 8), dtype = numpy.uint8)
+	paddedRows[:, 0:width] = rows
+	return paddedRows.view('>u8')
+
+#
+# Ranks the rows of a (count, width) uint8 array by the lexicographical order
+# of the byte strings they encode. Equal rows get equal ranks.
+#
+def lexicographicalRanks(rows):
+	count = len(rows)
+	words = lexicographicalWords(rows)
+	order = numpy.lexsort(words.T[::-1]) if words.shape[1] > 0 else numpy.arange(count)
+	sortedWords = words[order]
+	rankIncrements = numpy.zeros(count, dtype = numpy.int64)
+	rankIncrements[1:] = numpy.any(sortedWords[1:] != sortedWords[:-1], axis = 1)
+	ranks = numpy.empty(count, dtype = numpy.int64)
+	ranks[order] = numpy.cumsum(rankIncrements)
+	return ranks
 
 #
 # Consider all FMDL vertices to be loops of the same vertex when they share a
 # position object pointer.
 #
+# Builds each topological key and nontopological encoding once, as byte rows,
+# and orders vertices by array operations on their ranks.
+#
 def encodeMeshVertexLoopPreservation(mesh):
+	vertexEncoding = mesh.vertexEncoding
+	vertexCount = len(vertexEncoding)
+	if vertexCount == 0:
+		return encodedMesh(mesh, [], {})
+	
+	positionIndices = {}
+	positionIDs = numpy.array([
+		positionIndices.setdefault(encodedVertex.vertex.position, len(positionIndices))
+		for encodedVertex in vertexEncoding
+	], dtype = numpy.int64)
+	positionCount = len(positionIndices)
+	
+	(topologicalRows, nontopologicalRows) = encodingRows(mesh)
+	keyIDs = lexicographicalRanks(topologicalRows)
+	loopRanks = lexicographicalRanks(nontopologicalRows)
+	vertexIndices = numpy.arange(vertexCount)
+	
 	#
-	# Map from topological keys to lists of position objects
-	#
-	topologicallyEquivalentVertices = {}
-	#
-	# Map from position objects to lists of encoded vertices
+	# A position object belongs to the topological key of its first vertex.
+	# A vertex with a topological key that no position object belongs to
+	# cannot be placed in the vertex order.
 	#
-	splitVertices = {}
-	
-	for encodedVertex in mesh.vertexEncoding:
-		key = topologicalKey(encodedVertex, mesh.vertexFields)
-		
-		if encodedVertex.vertex.position not in splitVertices:
-			splitVertices[encodedVertex.vertex.position] = []
-			
-			if key not in topologicallyEquivalentVertices:
-				topologicallyEquivalentVertices[key] = []
-			topologicallyEquivalentVertices[key].append(encodedVertex.vertex.position)
-		splitVertices[encodedVertex.vertex.position].append(encodedVertex)
+	positionFirstIndices = numpy.full(positionCount, vertexCount, dtype = numpy.int64)
+	numpy.minimum.at(positionFirstIndices, positionIDs, vertexIndices)
+	positionKeyIDs = keyIDs[positionFirstIndices]
+	unplacedIndices = numpy.flatnonzero(~numpy.isin(keyIDs, positionKeyIDs))
+	if len(unplacedIndices) > 0:
+		raise KeyError(topologicalKey(vertexEncoding[unplacedIndices[0]], mesh.vertexFields))
 	
 	#
-	# Sort splitVertices by nontopological encoding, and remove duplicates.
+	# Keep the first loop of each position object with a given nontopological
+	# encoding, and replace the others with it.
 	#
+	loopKeys = positionIDs * (int(loopRanks.max()) + 1) + loopRanks
+	(uniqueLoopKeys, keptIndices, loopIDs) = numpy.unique(loopKeys, return_index = True, return_inverse = True)
+	replacements = keptIndices[loopIDs.ravel()]
 	replacedVertices = {}
-	for key in splitVertices:
-		loops = {}
-		for encodedVertex in splitVertices[key]:
-			encoding = nontopologicalEncoding(encodedVertex, mesh.vertexFields)
-			if encoding in loops:
-				replacedVertices[encodedVertex.vertex] = loops[encoding].vertex
-			else:
-				loops[encoding] = encodedVertex
-		splitVertices[key] = [loops[encoding] for encoding in sorted(loops.keys())]
+	for index in numpy.flatnonzero(replacements != vertexIndices).tolist():
+		replacedVertices[vertexEncoding[index].vertex] = vertexEncoding[replacements[index]].vertex
 	
 	#
-	# Sort topologicallyEquivalentVertices by nontopological encoding of
-	# the first element, in descending order.
+	# Topological keys are emitted in order of their first use by any
+	# vertex; position objects with the same key in order of decreasing
+	# smallest nontopological encoding, breaking ties by order of first use;
+	# and the loops of a position object in order of increasing
+	# nontopological encoding.
 	#
-	for (key, positions) in topologicallyEquivalentVertices.items():
-		topologicallyEquivalentVertices[key] = sorted(positions, reverse = True, key = (
-			lambda position : nontopologicalEncoding(splitVertices[position][0], mesh.vertexFields)
-		))
+	positionMinimumRanks = numpy.full(positionCount, vertexCount, dtype = numpy.int64)
+	numpy.minimum.at(positionMinimumRanks, positionIDs, loopRanks)
+	keyFirstIndices = numpy.full(int(keyIDs.max()) + 1, vertexCount, dtype = numpy.int64)
+	numpy.minimum.at(keyFirstIndices, keyIDs, vertexIndices)
 	
-	encodedVertices = []
-	addedTopologicalKeys = set()
-	for encodedVertex in mesh.vertexEncoding:
-		key = topologicalKey(encodedVertex, mesh.vertexFields)
-		if key not in addedTopologicalKeys:
-			addedTopologicalKeys.add(key)
-			
-			for position in topologicallyEquivalentVertices[key]:
-				encodedVertices += splitVertices[position]
+	keptPositionIDs = positionIDs[keptIndices]
+	order = numpy.lexsort((
+		loopRanks[keptIndices],
+		keptPositionIDs,
+		-positionMinimumRanks[keptPositionIDs],
+		keyFirstIndices[positionKeyIDs[keptPositionIDs]],
+	))
+	encodedVertices = [vertexEncoding[index] for index in keptIndices[order].tolist()]
+	return encodedMesh(mesh, encodedVertices, replacedVertices)
+
+#
+# Encodes the meshes of fmdl in place. sourceMeshes optionally maps meshes to
+# other meshes of fmdl with the same vertices, faces and vertex fields, whose
+# encoding they copy rather than computing it again.
+#
+def encodeFmdlVertexLoopPreservationInPlace(fmdl, sourceMeshes = None):
+	if sourceMeshes is None:
+		sourceMeshes = {}
 	
-	output = FmdlFile.FmdlFile.Mesh()
-	output.boneGroup = mesh.boneGroup
-	output.materialInstance = mesh.materialInstance
-	output.alphaFlags = mesh.alphaFlags
-	output.shadowFlags = mesh.shadowFlags
-	output.vertexFields = mesh.vertexFields
-	output.vertices = [encodedVertex.vertex for encodedVertex in encodedVertices]
-	output.faces = replaceFaceVertices(mesh.faces, replacedVertices)
-	output.vertexEncoding = encodedVertices
-	output.extensionHeaders = mesh.extensionHeaders.copy()
+	encodedMeshes = {}
+	for mesh in sorted(fmdl.meshes, key = (lambda mesh: mesh in sourceMeshes)):
+		if mesh in sourceMeshes and sourceMeshes[mesh] in encodedMeshes:
+			encodedMesh = encodedMeshes[sourceMeshes[mesh]]
+		else:
+			if mesh.vertexEncoding is None:
+				mesh.vertexEncoding = fmdl.encodeVertices(mesh.vertices, mesh.vertexFields)
+			encodedMesh = encodeMeshVertexLoopPreservation(mesh)
+		encodedMeshes[mesh] = encodedMesh
+		mesh.vertices = encodedMesh.vertices[:]
+		mesh.faces = encodedMesh.faces[:]
+		mesh.vertexEncoding = encodedMesh.vertexEncoding[:]
 	
-	return output
+	if 'X-FMDL-Extensions' not in fmdl.extensionHeaders:
+		fmdl.extensionHeaders['X-FMDL-Extensions'] = []
+	fmdl.extensionHeaders['X-FMDL-Extensions'].append("vertex-loop-preservation")
 
 def encodeFmdlVertexLoopPreservation(fmdl):
 	fmdl.precomputeVertexEncoding()
 	
-	output = FmdlFile.FmdlFile()
-	output.bones = fmdl.bones
-	output.materialInstances = fmdl.materialInstances
-	output.meshes = []
-	meshMap = {}
-	for mesh in fmdl.meshes:
-		encodedMesh = encodeMeshVertexLoopPreservation(mesh)
-		output.meshes.append(encodedMesh)
-		meshMap[mesh] = encodedMesh
-	output.meshGroups = []
-	meshGroupMap = {}
-	for meshGroup in fmdl.meshGroups:
-		encodedMeshGroup = FmdlFile.FmdlFile.MeshGroup()
-		output.meshGroups.append(encodedMeshGroup)
-		meshGroupMap[meshGroup] = encodedMeshGroup
-	for meshGroup in fmdl.meshGroups:
-		encodedMeshGroup = meshGroupMap[meshGroup]
-		encodedMeshGroup.name = meshGroup.name
-		encodedMeshGroup.boundingBox = meshGroup.boundingBox
-		encodedMeshGroup.visible = meshGroup.visible
-		if meshGroup.parent == None:
-			encodedMeshGroup.parent = None
-		else:
-			encodedMeshGroup.parent = meshGroupMap[meshGroup.parent]
-		encodedMeshGroup.children = []
-		for child in meshGroup.children:
-			encodedMeshGroup.children.append(meshGroupMap[child])
-		encodedMeshGroup.meshes = []
-		for mesh in meshGroup.meshes:
-			encodedMeshGroup.meshes.append(meshMap[mesh])
-	output.extensionHeaders = {}
-	for (key, value) in fmdl.extensionHeaders.items():
-		output.extensionHeaders[key] = value[:]
-	if 'X-FMDL-Extensions' not in output.extensionHeaders:
-		output.extensionHeaders['X-FMDL-Extensions'] = []
-	output.extensionHeaders['X-FMDL-Extensions'].append("vertex-loop-preservation")
+	output = fmdl.copyStructure()
+	encodeFmdlVertexLoopPreservationInPlace(output)
 	return output
 
 
 
+#
+# Compares two (count, width) uint8 arrays row by row, returning for each row
+# whether the byte string it encodes in the first array is strictly less than
+# the one in the second, in lexicographical order: whether the first word in
+# which they differ is greater in the second array.
+#
+def increasingRows(rows, nextRows):
+	words = lexicographicalWords(rows)
+	nextWords = lexicographicalWords(nextRows)
+	if words.shape[1] == 0:
+		return numpy.zeros(len(words), dtype = bool)
+	differences = words != nextWords
+	firstDifferences = numpy.argmax(differences, axis = 1)[:, None]
+	return numpy.any(differences, axis = 1) & (
+		numpy.take_along_axis(words, firstDifferences, axis = 1) < numpy.take_along_axis(nextWords, firstDifferences, axis = 1)
+	)[:, 0]
+
+#
+# Decodes the vertex/loop relation of a mesh by comparing each row of its
+# encoded vertex buffer with the previous one, for all rows at once. Returns
+# an array with, for each FMDL vertex, the index of the vertex it is a loop of;
+# vertices are numbered in order of their first loop.
+#
+def decodeMeshVertexLoopIndices(mesh):
+	if mesh.isColumnar():
+		vertexCount = len(mesh.positions)
+	else:
+		vertexCount = len(mesh.vertexEncoding)
+	if vertexCount == 0:
+		return numpy.zeros(0, dtype = numpy.int64)
+	
+	#
+	# A row continues the vertex of the previous row if it has the same
+	# topological key, and a nontopological encoding that is strictly greater.
+	#
+	(topologicalRows, nontopologicalRows) = encodingRows(mesh)
+	sameKeys = numpy.all(topologicalRows[1:] == topologicalRows[:-1], axis = 1)
+	continuesVertex = sameKeys & increasingRows(nontopologicalRows[:-1], nontopologicalRows[1:])
+	
+	startsVertex = numpy.ones(vertexCount, dtype = numpy.int64)
+	startsVertex[1:] = ~continuesVertex
+	return numpy.cumsum(startsVertex) - 1
+
+#
+# Decodes a columnar mesh without building any Vertex or Face objects. The
+# output shares the arrays of the input mesh, and records the loop indices
+# found by decodeMeshVertexLoopIndices() as its loopVertexIndices. Its
+# vertices, if they are ever built, are the same as the ones
+# decodeMeshVertexLoopPreservation() builds for a regular mesh.
+#
+def decodeColumnarMeshVertexLoopPreservation(mesh):
+	output = FmdlFile.FmdlFile.ColumnarMesh()
+	output.positions = mesh.positions
+	output.normals = mesh.normals
+	output.tangents = mesh.tangents
+	output.colors = mesh.colors
+	output.uvs = mesh.uvs
+	output.boneIndices = mesh.boneIndices
+	output.boneWeights = mesh.boneWeights
+	output.faceIndices = mesh.faceIndices
+	output.boneGroup = mesh.boneGroup
+	output.materialInstance = mesh.materialInstance
+	output.alphaFlags = mesh.alphaFlags
+	output.shadowFlags = mesh.shadowFlags
+	output.vertexFields = mesh.vertexFields
+	output.extensionHeaders = mesh.extensionHeaders.copy()
+	output.loopVertexIndices = decodeMeshVertexLoopIndices(mesh)
+	return output
+
+#
+# Columnar meshes are decoded with decodeMeshVertexLoopIndices(). Regular
+# meshes are decoded one pair of adjacent vertices at a time, which is
+# cheaper than building the rows that decodeMeshVertexLoopIndices() compares
+# out of their vertexEncoding.
+#
 def decodeMeshVertexLoopPreservation(mesh):
+	if mesh.isColumnar():
+		return decodeColumnarMeshVertexLoopPreservation(mesh)
+	
 	vertexEncoding = []
 	vertices = []
 	replacedVertices = {}
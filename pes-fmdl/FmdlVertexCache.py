@@ -0,0 +1,311 @@
+from . import FmdlFile, FmdlSplitVertexEncoding
+
+#
+# GPUs keep the most recently transformed vertices of a mesh in a small
+# post-transform cache, and only run the vertex shader for a vertex referenced
+# by a triangle if the vertex is not in that cache. Meshes exported from
+# blender have their triangles in blender polygon order, or in the order mesh
+# splitting produced them, neither of which makes good use of this cache.
+#
+# This module reorders the faces of each mesh using Tom Forsyth's linear-speed
+# vertex cache optimization algorithm, which greedily emits the triangle with
+# the highest score, where the score of a triangle is the sum of the scores of
+# its vertices. Vertices score higher for being recently used in a simulated
+# LRU cache, and for having few triangles left to emit, so that stray triangles
+# do not remain for last.
+#
+# After reordering faces, it renumbers the vertices in order of first use by
+# the reordered faces, so that vertex fetches walk through the vertex buffer
+# mostly linearly. Both the vertex-loop-preservation and mesh-splitting
+# encodings encode information in the relative order of vertices that share a
+# topological key (a position and bone mapping); see FmdlSplitVertexEncoding
+# and FmdlMeshSplitting. Vertex renumbering therefore moves each group of
+# vertices sharing a topological key as a single block, positioned at the first
+# use of any of its vertices, keeping the vertices within a block in their
+# original order. Vertices not used by any face keep their relative order, at
+# the end of the vertex buffer.
+#
+# Like mesh splitting, this changes the face order of meshes. Meshes whose
+# correct rendering depends on their face order, such as meshes relying on
+# clever alpha blending tricks, may be adversely affected. The optimization is
+# therefore optional, and disabled by default.
+#
+# Cache efficiency is measured as the average cache miss ratio (ACMR), the
+# number of vertex shader invocations per triangle, and the average transform
+# to vertex ratio (ATVR), the number of vertex shader invocations per vertex
+# in the mesh, using a simulated FIFO cache. The best achievable ATVR is 1.0.
+#
+
+
+
+#
+# The size of the LRU cache simulated by the optimizer, and the size of the FIFO
+# cache used for measuring cache efficiency.
+#
+OPTIMIZED_CACHE_SIZE = 32
+MEASURED_CACHE_SIZE = 32
+
+CACHE_DECAY_POWER = 1.5
+LAST_TRIANGLE_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+
+#
+# The score of a vertex, by position in the simulated cache.
+# The vertices of the last triangle get a fixed score, so that the optimizer
+# does not prefer triangles that share an edge with the previous one over
+# triangles that share a vertex, which tends to produce long thin strips.
+#
+CACHE_POSITION_SCORES = [
+	LAST_TRIANGLE_SCORE if position < 3 else
+	(1.0 - (position - 3) / (OPTIMIZED_CACHE_SIZE - 3)) ** CACHE_DECAY_POWER
+	for position in range(OPTIMIZED_CACHE_SIZE)
+]
+
+def valenceScore(remainingFaces):
+	return VALENCE_BOOST_SCALE * remainingFaces ** -VALENCE_BOOST_POWER
+
+#
+# Computes the order in which to draw faces, given as tuples of vertex indices.
+# Returns a list of face indices.
+#
+# The score of each face is kept, and only recomputed when the score of one of
+# its vertices changes, rather than summing the scores of its vertices every
+# time the face is considered.
+#
+def optimizeFaceOrder(faceVertexIndices, vertexCount):
+	faceCount = len(faceVertexIndices)
+	#
+	# Degenerate faces use a vertex more than once, but count only once
+	# towards its score. For scoring, they are padded to three vertices with
+	# an extra vertex, which is never used by any face and scores 0.
+	#
+	faceVertices = [tuple(dict.fromkeys(vertices)) for vertices in faceVertexIndices]
+	scoredFaceVertices = [vertices + (vertexCount, ) * (3 - len(vertices)) for vertices in faceVertices]
+	vertexFaces = [[] for i in range(vertexCount)]
+	for (face, vertices) in enumerate(faceVertices):
+		for vertex in vertices:
+			vertexFaces[vertex].append(face)
+	remainingFaceCounts = [len(faces) for faces in vertexFaces]
+	
+	#
+	# Vertex scores depend only on the cache position and the number of
+	# remaining faces; cache them for all valences that occur.
+	#
+	maxValence = max(remainingFaceCounts, default = 0)
+	valenceScores = [0.0] + [valenceScore(valence) for valence in range(1, maxValence + 1)]
+	# Vertices in the cache without remaining faces score -1
+	cacheScores = [
+		[-1.0] + [positionScore + score for score in valenceScores[1:]]
+		for positionScore in CACHE_POSITION_SCORES
+	]
+	
+	vertexScores = [valenceScores[count] for count in remainingFaceCounts] + [0.0]
+	faceScores = [vertexScores[a] + vertexScores[b] + vertexScores[c] for (a, b, c) in scoredFaceVertices]
+	faceAdded = [False] * faceCount
+	# For each face, the number of faces emitted when its score was last updated
+	faceUpdates = [-1] * faceCount
+	
+	cache = []
+	output = []
+	nextFace = 0
+	bestFace = max(range(faceCount), key = faceScores.__getitem__, default = None)
+	while len(output) < faceCount:
+		if bestFace is None:
+			#
+			# No face uses a cached vertex. Continue with the next face in the
+			# input order, rather than scanning all faces for the best one,
+			# which would make the algorithm quadratic.
+			#
+			while faceAdded[nextFace]:
+				nextFace += 1
+			bestFace = nextFace
+		
+		faceAdded[bestFace] = True
+		output.append(bestFace)
+		emittedCount = len(output)
+		vertices = list(faceVertices[bestFace])
+		for vertex in vertices:
+			remainingFaceCounts[vertex] -= 1
+		
+		for vertex in vertices:
+			if vertex in cache:
+				cache.remove(vertex)
+		cache = vertices + cache
+		changedVertices = cache[OPTIMIZED_CACHE_SIZE:]
+		del cache[OPTIMIZED_CACHE_SIZE:]
+		for vertex in changedVertices:
+			vertexScores[vertex] = valenceScores[remainingFaceCounts[vertex]]
+		for (vertex, score) in zip(cache, [
+			positionScores[remainingFaceCounts[vertex]]
+			for (vertex, positionScores) in zip(cache, cacheScores)
+		]):
+			if score != vertexScores[vertex]:
+				vertexScores[vertex] = score
+				changedVertices.append(vertex)
+		
+		#
+		# Update the scores of the remaining faces of vertices that left the
+		# cache, or changed their score within it, once each.
+		#
+		for vertex in changedVertices:
+			for face in vertexFaces[vertex]:
+				if not faceAdded[face] and faceUpdates[face] != emittedCount:
+					faceUpdates[face] = emittedCount
+					(a, b, c) = scoredFaceVertices[face]
+					faceScores[face] = vertexScores[a] + vertexScores[b] + vertexScores[c]
+		
+		bestFace = None
+		bestScore = -1.0
+		for vertex in cache:
+			if remainingFaceCounts[vertex] == 0:
+				continue
+			for face in vertexFaces[vertex]:
+				if faceScores[face] > bestScore and not faceAdded[face]:
+					bestScore = faceScores[face]
+					bestFace = face
+	
+	return output
+
+#
+# Computes the vertex buffer order for a mesh whose faces will be drawn in the
+# given order, as a list of vertex indices. Groups of vertices that share a
+# topological key are placed as a block, at the first use of any of them.
+#
+def computeVertexOrder(mesh, faceVertexIndices):
+	vertexGroups = {}
+	groups = []
+	for (index, encodedVertex) in enumerate(mesh.vertexEncoding):
+		key = FmdlSplitVertexEncoding.topologicalKey(encodedVertex, mesh.vertexFields)
+		if key not in vertexGroups:
+			vertexGroups[key] = []
+			groups.append(vertexGroups[key])
+		vertexGroups[key].append(index)
+	vertexGroup = {}
+	for group in groups:
+		for index in group:
+			vertexGroup[index] = group
+	
+	output = []
+	addedGroups = set()
+	for vertices in faceVertexIndices:
+		for vertex in vertices:
+			group = vertexGroup[vertex]
+			if id(group) not in addedGroups:
+				addedGroups.add(id(group))
+				output += group
+	for group in groups:
+		if id(group) not in addedGroups:
+			output += group
+	return output
+
+def optimizeMeshVertexCache(mesh):
+	vertexIndices = {}
+	for (index, vertex) in enumerate(mesh.vertices):
+		vertexIndices[vertex] = index
+	faceVertexIndices = [tuple(vertexIndices[vertex] for vertex in face.vertices) for face in mesh.faces]
+	
+	faceOrder = optimizeFaceOrder(faceVertexIndices, len(mesh.vertices))
+	vertexOrder = computeVertexOrder(mesh, [faceVertexIndices[face] for face in faceOrder])
+	
+	output = FmdlFile.FmdlFile.Mesh()
+	output.boneGroup = mesh.boneGroup
+	output.materialInstance = mesh.materialInstance
+	output.alphaFlags = mesh.alphaFlags
+	output.shadowFlags = mesh.shadowFlags
+	output.vertexFields = mesh.vertexFields
+	output.vertices = [mesh.vertices[index] for index in vertexOrder]
+	output.faces = [mesh.faces[face] for face in faceOrder]
+	output.vertexEncoding = [mesh.vertexEncoding[index] for index in vertexOrder]
+	output.extensionHeaders = mesh.extensionHeaders.copy()
+	
+	return output
+
+#
+# Simulates drawing the faces of a mesh through a FIFO post-transform cache.
+# Returns (ACMR, ATVR).
+#
+def measureMeshVertexCache(mesh):
+	vertexIndices = {}
+	for (index, vertex) in enumerate(mesh.vertices):
+		vertexIndices[vertex] = index
+	
+	cache = [None] * MEASURED_CACHE_SIZE
+	cachedVertices = set()
+	nextSlot = 0
+	transforms = 0
+	for face in mesh.faces:
+		for vertex in face.vertices:
+			index = vertexIndices[vertex]
+			if index not in cachedVertices:
+				transforms += 1
+				cachedVertices.discard(cache[nextSlot])
+				cache[nextSlot] = index
+				cachedVertices.add(index)
+				nextSlot = (nextSlot + 1) % MEASURED_CACHE_SIZE
+	
+	return (
+		transforms / len(mesh.faces) if len(mesh.faces) > 0 else 0.0,
+		transforms / len(mesh.vertices) if len(mesh.vertices) > 0 else 0.0,
+	)
+
+#
+# Returns, for each mesh in the fmdl file, the tuple (ACMR, ATVR).
+#
+def measureFmdlVertexCache(fmdl):
+	return [measureMeshVertexCache(mesh) for mesh in fmdl.meshes]
+
+#
+# Returns a human-readable report comparing measureFmdlVertexCache() results
+# before and after optimization, with totals weighted by face and vertex count.
+#
+def describeVertexCacheStatistics(fmdl, statisticsBefore, statisticsAfter):
+	output = "Vertex cache optimization (%s entry FIFO cache):\n" % MEASURED_CACHE_SIZE
+	totalFaces = 0
+	totalVertices = 0
+	totalTransforms = [0.0, 0.0]
+	for (index, (mesh, before, after)) in enumerate(zip(fmdl.meshes, statisticsBefore, statisticsAfter)):
+		output += "\tmesh %s: %s faces, ACMR %.3f -> %.3f, ATVR %.3f -> %.3f\n" % (
+			index, len(mesh.faces), before[0], after[0], before[1], after[1]
+		)
+		totalFaces += len(mesh.faces)
+		totalVertices += len(mesh.vertices)
+		totalTransforms[0] += before[0] * len(mesh.faces)
+		totalTransforms[1] += after[0] * len(mesh.faces)
+	if totalFaces > 0:
+		output += "\ttotal: %s faces, ACMR %.3f -> %.3f, ATVR %.3f -> %.3f\n" % (
+			totalFaces,
+			totalTransforms[0] / totalFaces, totalTransforms[1] / totalFaces,
+			totalTransforms[0] / totalVertices, totalTransforms[1] / totalVertices,
+		)
+	return output
+
+#
+# Optimizes the meshes of fmdl in place. sourceMeshes optionally maps meshes
+# to other meshes of fmdl with the same vertices and faces, whose optimized
+# order they copy rather than computing it again.
+#
+def optimizeFmdlVertexCacheInPlace(fmdl, sourceMeshes = None):
+	if sourceMeshes is None:
+		sourceMeshes = {}
+	
+	fmdl.precomputeVertexEncoding()
+	
+	with FmdlFile.suspendedGarbageCollection():
+		optimizedMeshes = {}
+		for mesh in sorted(fmdl.meshes, key = (lambda mesh: mesh in sourceMeshes)):
+			if mesh in sourceMeshes and sourceMeshes[mesh] in optimizedMeshes:
+				optimizedMesh = optimizedMeshes[sourceMeshes[mesh]]
+			else:
+				optimizedMesh = optimizeMeshVertexCache(mesh)
+			optimizedMeshes[mesh] = optimizedMesh
+			mesh.vertices = optimizedMesh.vertices[:]
+			mesh.faces = optimizedMesh.faces[:]
+			mesh.vertexEncoding = optimizedMesh.vertexEncoding[:]
+
+def optimizeFmdlVertexCache(fmdl):
+	fmdl.precomputeVertexEncoding()
+	
+	output = fmdl.copyStructure()
+	optimizeFmdlVertexCacheInPlace(output)
+	return output
@@ -1,60 +1,143 @@
-from struct import pack, unpack
-import zlib
+from struct import iter_unpack, pack, unpack
+import io
 import tempfile
+import zlib
 import os
 
-def readImageBuffer(stream, imageOffset, chunkCount, uncompressedSize, compressedSize):
+#
+# Image data that is stored without chunks is copied and decompressed in
+# pieces of this size, so that converting a texture never holds more than one
+# piece or chunk of it in memory.
+#
+STREAM_BUFFER_SIZE = 1 << 16
+
+#
+# Offset of the pitchOrLinearSize field in a DDS file.
+#
+DDS_PITCH_OR_LINEAR_SIZE_OFFSET = 20
+
+#
+# Copies $size bytes from stream to outputStream, in pieces of at most
+# STREAM_BUFFER_SIZE bytes. Returns False if the stream ends before that.
+#
+def copyStream(stream, outputStream, size):
+	while size > 0:
+		buffer = stream.read(min(size, STREAM_BUFFER_SIZE))
+		if len(buffer) == 0:
+			return False
+		outputStream.write(buffer)
+		size -= len(buffer)
+	return True
+
+#
+# Decompresses a zlib stream of $compressedSize bytes from stream into
+# outputStream, in pieces of at most STREAM_BUFFER_SIZE bytes. Returns the
+# number of bytes written, or None if the data is truncated or invalid.
+#
+def decompressStream(stream, outputStream, compressedSize):
+	decompressor = zlib.decompressobj()
+	writtenSize = 0
+	try:
+		while compressedSize > 0 or len(decompressor.unconsumed_tail) > 0:
+			if len(decompressor.unconsumed_tail) > 0:
+				buffer = decompressor.unconsumed_tail
+			else:
+				buffer = stream.read(min(compressedSize, STREAM_BUFFER_SIZE))
+				if len(buffer) == 0:
+					return None
+				compressedSize -= len(buffer)
+			decompressedBuffer = decompressor.decompress(buffer, STREAM_BUFFER_SIZE)
+			outputStream.write(decompressedBuffer)
+			writtenSize += len(decompressedBuffer)
+		decompressedBuffer = decompressor.flush()
+		outputStream.write(decompressedBuffer)
+		writtenSize += len(decompressedBuffer)
+	except zlib.error:
+		return None
+	if not decompressor.eof:
+		return None
+	return writtenSize
+
+#
+# Reads the chunk table of a frame in one go. Returns a list of
+# (offset, compressedSize, isCompressed) tuples, with offsets relative to the
+# start of the file, or None if the table is truncated.
+#
+def readChunkTable(stream, imageOffset, chunkCount):
+	stream.seek(imageOffset, 0)
+	header = stream.read(8 * chunkCount)
+	if len(header) != 8 * chunkCount:
+		return None
+	
+	chunks = []
+	for (compressedSize, uncompressedSize, offset) in iter_unpack('< HH I', header):
+		isCompressed = (offset & (1 << 31)) == 0
+		offset &= ~(1 << 31)
+		
+		chunks.append((imageOffset + offset, compressedSize, isCompressed))
+	return chunks
+
+def readChunk(stream, offset, compressedSize):
+	stream.seek(offset, 0)
+	compressedBuffer = stream.read(compressedSize)
+	if len(compressedBuffer) != compressedSize:
+		return None
+	return compressedBuffer
+
+#
+# Returns None if the chunk is invalid.
+#
+def decompressChunk(compressedBuffer):
+	try:
+		return zlib.decompress(compressedBuffer)
+	except zlib.error:
+		return None
+
+#
+# Writes the image data of a single frame to outputStream, a chunk at a time.
+# Returns the number of bytes written, or None if the image data is invalid.
+#
+def writeImageBuffer(stream, outputStream, imageOffset, chunkCount, uncompressedSize, compressedSize):
 	stream.seek(imageOffset, 0)
 	
 	if chunkCount == 0:
 		if compressedSize == 0:
-			uncompressedBuffer = bytearray(uncompressedSize)
-			if stream.readinto(uncompressedBuffer) != len(uncompressedBuffer):
+			if not copyStream(stream, outputStream, uncompressedSize):
 				return None
-			return uncompressedBuffer
+			return uncompressedSize
 		else:
-			compressedBuffer = bytearray(compressedSize)
-			if stream.readinto(compressedBuffer) != len(compressedBuffer):
-				return None
-			return zlib.decompress(compressedBuffer)
+			return decompressStream(stream, outputStream, compressedSize)
 	
-	chunks = []
-	for i in range(chunkCount):
-		header = bytearray(8)
-		if stream.readinto(header) != len(header):
-			return None
-		(
-			compressedSize,
-			uncompressedSize,
-			offset,
-		) = unpack('< HH I', header)
-		isCompressed = (offset & (1 << 31)) == 0
-		offset &= ~(1 << 31)
-		
-		chunks.append((offset, compressedSize, isCompressed))
+	chunks = readChunkTable(stream, imageOffset, chunkCount)
+	if chunks == None:
+		return None
 	
-	imageBuffers = []
+	writtenSize = 0
 	for (offset, compressedSize, isCompressed) in chunks:
-		stream.seek(imageOffset + offset, 0)
-		compressedBuffer = bytearray(compressedSize)
-		if stream.readinto(compressedBuffer) != len(compressedBuffer):
+		compressedBuffer = readChunk(stream, offset, compressedSize)
+		if compressedBuffer == None:
 			return None
 		if isCompressed:
-			try:
-				decompressedBuffer = zlib.decompress(compressedBuffer)
-			except:
+			decompressedBuffer = decompressChunk(compressedBuffer)
+			if decompressedBuffer == None:
 				return None
 		else:
 			decompressedBuffer = compressedBuffer
-		imageBuffers.append(decompressedBuffer)
-	return b''.join(imageBuffers)
+		outputStream.write(decompressedBuffer)
+		writtenSize += len(decompressedBuffer)
+	return writtenSize
 
-def ftexToDds(ftexFilename, ddsFilename):
-	inputStream = open(ftexFilename, 'rb')
-	
+#
+# Reads the header of an ftex file, and determines the DDS file it converts
+# into. Returns a tuple (ddsHeader, usesLinearSize, frameSpecifications), or
+# None if the file cannot be converted. If usesLinearSize is set, the
+# pitchOrLinearSize field of ddsHeader is to be set to the size of the first
+# frame, which is only known once it has been decompressed.
+#
+def readFtexHeader(inputStream):
 	header = bytearray(64)
 	if inputStream.readinto(header) != len(header):
-		return False
+		return None
 	
 	(
 		ftexMagic,
@@ -76,16 +159,16 @@ def ftexToDds(ftexFilename, ddsFilename):
 	) = unpack('< 4s f HHHH  BB HIII  BB 14x  8s 8s', header)
 	
 	if ftexMagic != b'FTEX':
-		return False
+		return None
 	
 	if ftexVersion < 2.025:
-		return False
+		return None
 	if ftexVersion > 2.045:
-		return False
+		return None
 	if ftexFtexsCount > 0:
-		return False
+		return None
 	if ftexMipmapCount == 0:
-		return False
+		return None
 	
 	
 	
@@ -101,7 +184,7 @@ def ftexToDds(ftexFilename, ddsFilename):
 	if (ftexTextureType & 4) != 0:
 		# Cube map, with six faces
 		if ftexDepth > 1:
-			return False
+			return None
 		imageCount = 6
 		ddsDepth = 1
 		ddsCapabilities1 |= 0x8    # complex
@@ -158,17 +241,10 @@ def ftexToDds(ftexFilename, ddsFilename):
 				chunkCount,
 			) = unpack('< I I I BB H', mipmapHeader)
 			if index != j:
-				return False
+				return None
 			
 			frameSpecifications.append((offset, chunkCount, uncompressedSize, compressedSize))
 	
-	frames = []
-	for (offset, chunkCount, uncompressedSize, compressedSize) in frameSpecifications:
-		frame = readImageBuffer(inputStream, offset, chunkCount, uncompressedSize, compressedSize)
-		if frame == None:
-			return False
-		frames.append(frame)
-	
 	
 	
 	#
@@ -196,6 +272,7 @@ def ftexToDds(ftexFilename, ddsFilename):
 	ddsPitch = None
 	if ftexPixelFormat == 0:
 		ddsPitchOrLinearSize = 4 * ftexWidth
+		usesLinearSize = False
 		ddsFlags |= 0x8 # pitch
 		useExtensionHeader = False
 		
@@ -207,7 +284,9 @@ def ftexToDds(ftexFilename, ddsFilename):
 		ddsBBitMask = 0x000000ff
 		ddsABitMask = 0xff000000
 	else:
-		ddsPitchOrLinearSize = len(frames[0])
+		# Set to the size of the first frame once it is written
+		ddsPitchOrLinearSize = 0
+		usesLinearSize = True
 		ddsFlags |= 0x80000 # linear size
 		
 		ddsFormatFlags = 0x4 # compressed
@@ -245,7 +324,7 @@ def ftexToDds(ftexFilename, ddsFilename):
 		elif ftexPixelFormat == 15:
 			ddsExtensionFormat = 26
 		else:
-			return False
+			return None
 		
 		if ddsExtensionFormat is not None:
 			ddsFourCC = b'DX10'
@@ -255,9 +334,7 @@ def ftexToDds(ftexFilename, ddsFilename):
 	
 	
 	
-	outputStream = open(ddsFilename, 'wb')
-	
-	outputStream.write(pack('< 4s 7I 44x 2I 4s 5I 2I 12x',
+	ddsHeader = pack('< 4s 7I 44x 2I 4s 5I 2I 12x',
 		b'DDS ',
 		
 		124, # header size
@@ -279,47 +356,137 @@ def ftexToDds(ftexFilename, ddsFilename):
 		
 		ddsCapabilities1,
 		ddsCapabilities2,
-	))
+	)
 	
 	if useExtensionHeader:
-		outputStream.write(pack('< 5I',
+		ddsHeader += pack('< 5I',
 			ddsExtensionFormat,
 			ddsExtensionDimension,
 			ddsExtensionFlags,
 			1, # array size
 			0, # flags
-		))
+		)
 	
-	for frame in frames:
-		outputStream.write(frame)
+	return (ddsHeader, usesLinearSize, frameSpecifications)
+
+#
+# Writes the DDS file described by readFtexHeader() to outputStream, which
+# must be seekable, decompressing the frames of the ftex file one chunk at a
+# time. Returns False if the image data is invalid, in which case outputStream
+# contains an incomplete DDS file.
+#
+def writeDds(inputStream, outputStream, ddsHeader, usesLinearSize, frameSpecifications):
+	headerPosition = outputStream.tell()
+	outputStream.write(ddsHeader)
 	
-	outputStream.close()
+	frameSizes = []
+	for (offset, chunkCount, uncompressedSize, compressedSize) in frameSpecifications:
+		frameSize = writeImageBuffer(inputStream, outputStream, offset, chunkCount, uncompressedSize, compressedSize)
+		if frameSize == None:
+			return False
+		frameSizes.append(frameSize)
+	
+	if usesLinearSize:
+		endPosition = outputStream.tell()
+		outputStream.seek(headerPosition + DDS_PITCH_OR_LINEAR_SIZE_OFFSET, 0)
+		outputStream.write(pack('< I', frameSizes[0]))
+		outputStream.seek(endPosition, 0)
 	
 	return True
 
-def blenderImageLoadFtex(blenderImage, tempDir):
-	originalFilename = blenderImage.filepath
-	if os.path.isfile(originalFilename):
-		pos = originalFilename.replace("\\", "/").rfind('/')
-		if pos == -1:
-			baseName = originalFilename
-		else:
-			baseName = originalFilename[pos + 1:]
-		
-		try:
-			# tempDir is not always accessible
-			(ddsFileDescriptor, ddsFile) = tempfile.mkstemp(suffix = '.dds', prefix = baseName + '-', dir = tempDir)
-		except:
-			return False
-		os.close(ddsFileDescriptor)
-		if not ftexToDds(originalFilename, ddsFile):
-			os.remove(ddsFile)
+def ftexToDds(ftexFilename, ddsFilename):
+	with open(ftexFilename, 'rb') as inputStream:
+		ftexHeader = readFtexHeader(inputStream)
+		if ftexHeader == None:
 			return False
 		
-		blenderImage.filepath = ddsFile
+		with open(ddsFilename, 'wb') as outputStream:
+			success = writeDds(inputStream, outputStream, *ftexHeader)
+	
+	#
+	# Don't leave an incomplete DDS file behind, which would be mistaken for
+	# a converted texture.
+	#
+	if not success:
+		os.remove(ddsFilename)
+	return success
+
+#
+# Converts an ftex file into the contents of a DDS file, in memory. Returns
+# None if the file cannot be converted.
+#
+def ftexToDdsBuffer(ftexFilename):
+	with open(ftexFilename, 'rb') as inputStream:
+		ftexHeader = readFtexHeader(inputStream)
+		if ftexHeader == None:
+			return None
+		
+		with io.BytesIO() as outputStream:
+			if not writeDds(inputStream, outputStream, *ftexHeader):
+				return None
+			return outputStream.getvalue()
+
+#
+# Returns the ftex file that blenderImage was loaded from by
+# blenderImageLoadFtex(), or refers to before it is loaded, or None.
+#
+def blenderImageFtexFilename(blenderImage):
+	filename = blenderImage.filepath
+	if filename.lower().endswith('.ftex.dds'):
+		filename = filename[:-4]
+	if not filename.lower().endswith('.ftex'):
+		return None
+	return filename
+
+#
+# Loads the ftex file that blenderImage refers to into blenderImage. If cache
+# is an FtexCache.FtexCache, the texture is only converted if it is not in the
+# cache yet.
+#
+# The image gets the ftex filename with .dds appended as its filepath, so
+# that unpacking or saving the image never overwrites the ftex file. If
+# packImage is True, or the image is packed already, the converted DDS data
+# is packed into the image, so that it is saved in the .blend file; otherwise
+# the image is loaded from a temporary DDS file, and has to be loaded again
+# after reopening the .blend file.
+#
+def blenderImageLoadFtex(blenderImage, cache = None, packImage = True):
+	ftexFilename = blenderImageFtexFilename(blenderImage)
+	if ftexFilename == None or not os.path.isfile(ftexFilename):
+		return False
+	
+	if cache == None:
+		ddsData = ftexToDdsBuffer(ftexFilename)
+	else:
+		ddsData = cache.ddsBuffer(ftexFilename)
+	if ddsData == None:
+		return False
+	
+	ddsFilename = ftexFilename + '.dds'
+	if packImage or blenderImage.packed_file != None:
+		#
+		# Image.reload() would replace the packed data with the file at
+		# filepath again, so free the image buffers instead, to make blender
+		# load the image from the packed data.
+		#
+		blenderImage.filepath_raw = ddsFilename
+		blenderImage.pack(data = ddsData, data_len = len(ddsData))
+		blenderImage.buffers_free()
 		# Read from the pixels buffer to trigger a load operation
 		dummy = blenderImage.pixels[0]
-		blenderImage.filepath_raw = originalFilename
-		
-		os.remove(ddsFile)
 		return True
+	
+	try:
+		(ddsFileDescriptor, temporaryFilename) = tempfile.mkstemp(suffix = '.dds')
+	except OSError:
+		return False
+	try:
+		with os.fdopen(ddsFileDescriptor, 'wb') as stream:
+			stream.write(ddsData)
+		blenderImage.filepath = temporaryFilename
+		# Read from the pixels buffer to trigger a load operation
+		dummy = blenderImage.pixels[0]
+		blenderImage.filepath_raw = ddsFilename
+	finally:
+		os.remove(temporaryFilename)
+	return True
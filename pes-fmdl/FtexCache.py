@@ -0,0 +1,147 @@
+import hashlib
+import os
+import tempfile
+import time
+
+from . import Ftex
+
+#
+# Version of the DDS data stored in the cache. Changing the way ftex textures
+# are converted should change this, so that textures converted before are not
+# used anymore.
+#
+CACHE_FORMAT_VERSION = 1
+
+CACHE_ENTRY_EXTENSION = '.dds'
+CACHE_TEMPORARY_EXTENSION = '.tmp'
+
+#
+# Temporary files of writers that stopped before moving them into place are
+# removed once they are this many seconds old.
+#
+CACHE_TEMPORARY_FILE_AGE = 3600
+
+#
+# Persistent cache of ftex textures converted to DDS data, stored as one DDS
+# file per texture in $directory.
+#
+# Textures are identified by the absolute path, size and modification time of
+# their ftex file, so that a texture that is changed or replaced is converted
+# again. Each lookup of a texture marks its entry as recently used by
+# updating the modification time of the entry, and once the entries take more
+# than $maximumSize bytes, the least recently used ones are removed.
+#
+# Several blender instances can share a cache directory: entries are written
+# to a temporary file and moved into place in one step, so that a reader
+# finds either a complete entry or none, and writers converting the same
+# texture at the same time simply replace each other's identical entry.
+#
+class FtexCache:
+	def __init__(self, directory, maximumSize):
+		self.directory = directory
+		self.maximumSize = maximumSize
+	
+	def entryFilename(self, ftexFilename):
+		filename = os.path.abspath(ftexFilename)
+		status = os.stat(filename)
+		key = "%d\0%s\0%d\0%d" % (CACHE_FORMAT_VERSION, os.path.normcase(filename), status.st_size, status.st_mtime_ns)
+		return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest() + CACHE_ENTRY_EXTENSION)
+	
+	#
+	# Returns the DDS data of ftexFilename, converting it with
+	# Ftex.ftexToDdsBuffer() only if it is not in the cache. Returns None if the
+	# texture cannot be converted.
+	#
+	def ddsBuffer(self, ftexFilename):
+		entryFilename = self.entryFilename(ftexFilename)
+		ddsData = self.readEntry(entryFilename)
+		if ddsData != None:
+			return ddsData
+		
+		ddsData = Ftex.ftexToDdsBuffer(ftexFilename)
+		if ddsData != None:
+			self.writeEntry(entryFilename, ddsData)
+			self.evict()
+		return ddsData
+	
+	def readEntry(self, entryFilename):
+		try:
+			with open(entryFilename, 'rb') as stream:
+				ddsData = stream.read()
+			os.utime(entryFilename)
+		except OSError:
+			# Missing, or removed by another instance evicting it.
+			return None
+		return ddsData
+	
+	#
+	# Failing to store an entry only means the texture is converted again next
+	# time, so errors are ignored.
+	#
+	def writeEntry(self, entryFilename, ddsData):
+		try:
+			os.makedirs(self.directory, exist_ok = True)
+			(descriptor, temporaryFilename) = tempfile.mkstemp(suffix = CACHE_TEMPORARY_EXTENSION, dir = self.directory)
+		except OSError:
+			return
+		try:
+			with os.fdopen(descriptor, 'wb') as stream:
+				stream.write(ddsData)
+			os.replace(temporaryFilename, entryFilename)
+		except OSError:
+			try:
+				os.remove(temporaryFilename)
+			except OSError:
+				pass
+	
+	#
+	# Removes the least recently used entries until the remaining entries take
+	# at most maximumSize bytes, or the size of the cache if maximumSize is
+	# None, and removes abandoned temporary files. Returns the number of
+	# bytes removed.
+	#
+	def evict(self, maximumSize = None):
+		if maximumSize == None:
+			maximumSize = self.maximumSize
+		entries = []
+		totalSize = 0
+		removedSize = 0
+		now = time.time()
+		try:
+			directoryEntries = list(os.scandir(self.directory))
+		except OSError:
+			return 0
+		for directoryEntry in directoryEntries:
+			try:
+				status = directoryEntry.stat()
+			except OSError:
+				continue
+			if directoryEntry.name.endswith(CACHE_ENTRY_EXTENSION):
+				entries.append((status.st_mtime_ns, status.st_size, directoryEntry.path))
+				totalSize += status.st_size
+			elif directoryEntry.name.endswith(CACHE_TEMPORARY_EXTENSION) and now - status.st_mtime > CACHE_TEMPORARY_FILE_AGE:
+				try:
+					os.remove(directoryEntry.path)
+					removedSize += status.st_size
+				except OSError:
+					pass
+		
+		entries.sort()
+		for (modificationTime, size, filename) in entries:
+			if totalSize <= maximumSize:
+				break
+			try:
+				os.remove(filename)
+				removedSize += size
+			except OSError:
+				pass
+			totalSize -= size
+		return removedSize
+	
+	#
+	# Removes all entries, and returns the number of bytes removed. Entries
+	# that other blender instances write at the same time may remain.
+	#
+	def clear(self):
+		return self.evict(0)
+
@@ -1,6 +1,7 @@
 import bpy
 import mathutils
 import itertools
+import numpy
 import os
 import os.path
 import re
@@ -8,7 +9,7 @@ import bmesh
 import random
 from mathutils import Vector
 
-from . import FmdlFile, FmdlAntiBlur, FmdlMeshSplitting, FmdlSplitVertexEncoding, Ftex, PesSkeletonData
+from . import FmdlFile, FmdlAntiBlur, FmdlExportPipeline, FmdlMeshSplitting, FmdlSplitVertexEncoding, Ftex, PesSkeletonData
 
 
 class UnsupportedFmdl(Exception):
@@ -30,6 +31,10 @@ class ImportSettings:
 		self.enableLoadTextures = True
 		self.enableImportAllBoundingBoxes = False
 		self.texturePath = str()
+		# FtexCache.FtexCache holding textures converted by earlier imports; None converts every texture.
+		self.textureCache = None
+		# Store converted ftex textures in the .blend file, which grows by the size of their DDS data.
+		self.packTextures = True
 
 class ExportSettings:
 	def __init__(self):
@@ -37,6 +42,9 @@ class ExportSettings:
 		self.enableAntiblur = True
 		self.enableVertexLoopPreservation = True
 		self.enableMeshSplitting = True
+		# How submeshes are carved out of bone subtrees that do not fit one submesh.
+		self.meshSplittingFragmentStrategy = FmdlMeshSplitting.FRAGMENT_STRATEGY_SORT_VECTOR
+		self.enableVertexCacheOptimization = False
 
 
 
@@ -241,7 +249,7 @@ def importFmdl(context, fmdl, filename, importSettings = None):
 				blenderImage.filepath = texturePath
 			elif filename.lower().endswith('.ftex'):
 				blenderImage.filepath = filename
-				Ftex.blenderImageLoadFtex(blenderImage, bpy.app.tempdir)
+				Ftex.blenderImageLoadFtex(blenderImage, importSettings.textureCache, importSettings.packTextures)
 			else:
 				blenderImage.filepath = filename
 				blenderImage.reload()
@@ -479,9 +487,25 @@ def importFmdl(context, fmdl, filename, importSettings = None):
 			return options[0][0]
 		return None
 	
-	def importMesh(mesh, name, fmdl, materialIDs, armatureObjectID, boneIDs):
-		blenderMesh = bpy.data.meshes.new(name)
-		
+	#
+	# The UV maps of a mesh that are imported, as indices into vertex.uv.
+	#
+	def importedUvIndices(vertexFields):
+		uvIndices = []
+		if vertexFields.uvCount >= 1:
+			uvIndices.append(0)
+		if vertexFields.uvCount >= 2 and 0 not in vertexFields.uvEqualities[1]:
+			uvIndices.append(1)
+		return uvIndices
+	
+	#
+	# Collects the geometry of a mesh in the form it is set on a blender mesh:
+	# blender coordinates of each vertex, and vertex index, normal, color and
+	# UV coordinates of each loop, as flat sequences; and the vertices that
+	# get each weight for each bone, as a dict from (bone, weight) pairs to
+	# lists of vertex indices.
+	#
+	def meshGeometry(mesh):
 		#
 		# mesh.vertices does not correspond either to the blenderMesh.vertices
 		# nor the blenderMesh.loops, but rather the unique values of blenderMesh.loops.
@@ -496,22 +520,10 @@ def importFmdl(context, fmdl, filename, importSettings = None):
 				vertexVertices.append(vertex)
 		loopVertices = list(itertools.chain.from_iterable([reversed(face.vertices) for face in mesh.faces]))
 		
-		blenderMesh.vertices.add(len(vertexVertices))
-		blenderMesh.vertices.foreach_set("co", tuple(itertools.chain.from_iterable([
+		vertexPositions = tuple(itertools.chain.from_iterable([
 			(vertex.position.x, -vertex.position.z, vertex.position.y) for vertex in vertexVertices
-		])))
-		
-		blenderMesh.loops.add(len(mesh.faces) * 3)
-		blenderMesh.loops.foreach_set("vertex_index", tuple([vertexIndices[vertex.position] for vertex in loopVertices]))
-		
-		blenderMesh.polygons.add(len(mesh.faces))
-		blenderMesh.polygons.foreach_set("loop_start", tuple(range(0, 3 * len(mesh.faces), 3)))
-		blenderMesh.polygons.foreach_set("loop_total", [3 for face in mesh.faces])
-		
-		blenderMesh.update(calc_edges = True)
-		
-		materialKey = (mesh.materialInstance, mesh.alphaFlags, mesh.shadowFlags, 'has-antiblur-meshes' in mesh.extensionHeaders)
-		blenderMaterial = bpy.data.materials[materialIDs[materialKey]]
+		]))
+		loopVertexIndices = tuple([vertexIndices[vertex.position] for vertex in loopVertices])
 		
 		if mesh.vertexFields.hasNormal:
 			def normalize(vector):
@@ -520,26 +532,122 @@ def importFmdl(context, fmdl, filename, importSettings = None):
 				if size < 0.01:
 					return (x, y, z)
 				return (x / size, y / size, z / size)
-			blenderMesh.normals_split_custom_set([
+			loopNormals = [
 				normalize((vertex.normal.x, -vertex.normal.z, vertex.normal.y)) for vertex in loopVertices
-			])
-			blenderMesh.use_auto_smooth = True
+			]
+		else:
+			loopNormals = None
 		
 		if mesh.vertexFields.hasColor:
-			colorLayer = blenderMesh.vertex_colors.new(name='color')
-			colorLayer.data.foreach_set("color", tuple(itertools.chain.from_iterable([
+			loopColors = tuple(itertools.chain.from_iterable([
 				vertex.color[0:4] for vertex in loopVertices
-			])))
+			]))
+		else:
+			loopColors = None
+		
+		loopUvs = [
+			tuple(itertools.chain.from_iterable([
+				(vertex.uv[uvIndex].u, 1.0 - vertex.uv[uvIndex].v) for vertex in loopVertices
+			]))
+			for uvIndex in importedUvIndices(mesh.vertexFields)
+		]
+		
+		vertexBoneWeights = {}
+		if mesh.vertexFields.hasBoneMapping:
+			for (index, vertex) in enumerate(vertexVertices):
+				for (bone, weight) in vertex.boneMapping.items():
+					vertexBoneWeights.setdefault((bone, weight), []).append(index)
+		
+		return (vertexPositions, loopVertexIndices, loopNormals, loopColors, loopUvs, vertexBoneWeights)
+	
+	#
+	# Collects the same geometry as meshGeometry() from the arrays of a
+	# columnar mesh, without building Vertex or Face objects. The blender
+	# vertices are the vertices of mesh.vertexLoops(): the vertex records
+	# themselves, or the vertices decoded by vertex loop preservation.
+	#
+	def columnarMeshGeometry(mesh):
+		(vertexIndices, firstLoopIndices) = mesh.vertexLoops()
+		loopRecords = numpy.asarray(mesh.faceIndices, dtype = numpy.int64)[:, ::-1].ravel()
+		
+		def blenderVectors(vectors):
+			vectors = numpy.asarray(vectors, dtype = numpy.float64)
+			return numpy.column_stack((vectors[:, 0], -vectors[:, 2], vectors[:, 1]))
+		
+		vertexPositions = blenderVectors(mesh.positions[firstLoopIndices]).astype(numpy.float32).ravel()
+		loopVertexIndices = vertexIndices[loopRecords].astype(numpy.int32)
+		
+		if mesh.vertexFields.hasNormal:
+			normals = blenderVectors(mesh.normals[loopRecords])
+			sizes = numpy.sqrt(numpy.sum(normals ** 2, axis = 1))[:, None]
+			loopNormals = numpy.where(sizes < 0.01, normals, normals / numpy.maximum(sizes, 0.01))
+		else:
+			loopNormals = None
+		
+		if mesh.vertexFields.hasColor:
+			loopColors = numpy.asarray(mesh.colors, dtype = numpy.float32)[loopRecords, 0:4].ravel()
+		else:
+			loopColors = None
+		
+		loopUvs = []
+		for uvIndex in importedUvIndices(mesh.vertexFields):
+			uvs = numpy.asarray(mesh.uvs[uvIndex], dtype = numpy.float64)[loopRecords]
+			loopUvs.append(numpy.column_stack((uvs[:, 0], 1.0 - uvs[:, 1])).astype(numpy.float32).ravel())
+		
+		vertexBoneWeights = {}
+		if mesh.vertexFields.hasBoneMapping:
+			(boneIndices, boneWeights) = mesh.boneMappingColumns()
+			boneIndices = boneIndices[firstLoopIndices]
+			boneWeights = boneWeights[firstLoopIndices]
+			(vertices, slots) = numpy.nonzero(boneWeights)
+			keys = boneIndices[vertices, slots] * 256 + boneWeights[vertices, slots]
+			order = numpy.argsort(keys, kind = 'stable')
+			(uniqueKeys, groupStarts) = numpy.unique(keys[order], return_index = True)
+			for (key, groupVertices) in zip(uniqueKeys.tolist(), numpy.split(vertices[order], groupStarts[1:])):
+				vertexBoneWeights[(mesh.boneGroup.bones[key // 256], (key % 256) / 255.0)] = groupVertices.tolist()
+		
+		return (vertexPositions, loopVertexIndices, loopNormals, loopColors, loopUvs, vertexBoneWeights)
+	
+	def importMesh(mesh, name, fmdl, materialIDs, armatureObjectID, boneIDs):
+		blenderMesh = bpy.data.meshes.new(name)
+		
+		if mesh.isColumnar():
+			geometry = columnarMeshGeometry(mesh)
+		else:
+			geometry = meshGeometry(mesh)
+		(vertexPositions, loopVertexIndices, loopNormals, loopColors, loopUvs, vertexBoneWeights) = geometry
+		faceCount = len(loopVertexIndices) // 3
+		
+		blenderMesh.vertices.add(len(vertexPositions) // 3)
+		blenderMesh.vertices.foreach_set("co", vertexPositions)
+		
+		blenderMesh.loops.add(faceCount * 3)
+		blenderMesh.loops.foreach_set("vertex_index", loopVertexIndices)
+		
+		blenderMesh.polygons.add(faceCount)
+		blenderMesh.polygons.foreach_set("loop_start", tuple(range(0, 3 * faceCount, 3)))
+		blenderMesh.polygons.foreach_set("loop_total", [3] * faceCount)
+		
+		blenderMesh.update(calc_edges = True)
+		
+		materialKey = (mesh.materialInstance, mesh.alphaFlags, mesh.shadowFlags, 'has-antiblur-meshes' in mesh.extensionHeaders)
+		blenderMaterial = bpy.data.materials[materialIDs[materialKey]]
+		
+		if loopNormals is not None:
+			blenderMesh.normals_split_custom_set(loopNormals)
+			blenderMesh.use_auto_smooth = True
+		
+		if loopColors is not None:
+			colorLayer = blenderMesh.vertex_colors.new(name='color')
+			colorLayer.data.foreach_set("color", loopColors)
 			colorLayer.active = True
 			colorLayer.active_render = True
 		
-		if mesh.vertexFields.uvCount >= 1:
+		if len(loopUvs) >= 1:
 			uvTexture = blenderMesh.uv_layers.new(name = UV_MAP_COLOR)
 			uvLayer = blenderMesh.uv_layers[uvTexture.name]
 			
-			uvLayer.data.foreach_set("uv", tuple(itertools.chain.from_iterable([
-				(vertex.uv[0].u, 1.0 - vertex.uv[0].v) for vertex in loopVertices
-			])))
+			uvLayer.data.foreach_set("uv", loopUvs[0])
 			uvTexture.active = True
 			uvTexture.active_clone = True
 			uvTexture.active_render = True
@@ -549,13 +657,11 @@ def importFmdl(context, fmdl, filename, importSettings = None):
 			# 	for i in range(len(uvTexture.data)):
 			# 		uvTexture.data[i].image = image
 		
-		if mesh.vertexFields.uvCount >= 2 and 0 not in mesh.vertexFields.uvEqualities[1]:
+		if len(loopUvs) >= 2:
 			uvTexture = blenderMesh.uv_layers.new(name = UV_MAP_NORMALS)
 			uvLayer = blenderMesh.uv_layers[uvTexture.name]
 			
-			uvLayer.data.foreach_set("uv", tuple(itertools.chain.from_iterable([
-				(vertex.uv[1].u, 1.0 - vertex.uv[1].v) for vertex in loopVertices
-			])))
+			uvLayer.data.foreach_set("uv", loopUvs[1])
 			
 			# image = findUvMapImage(blenderMaterial, UV_MAP_NORMALS, 'NormalMap_Tex_')
 			# if image is not None:
@@ -575,10 +681,8 @@ def importFmdl(context, fmdl, filename, importSettings = None):
 		
 		if mesh.vertexFields.hasBoneMapping:
 			vertexGroupIDs = addSkeletonMeshModifier(blenderMeshObject, mesh.boneGroup, armatureObjectID, boneIDs)
-			for i in range(len(vertexVertices)):
-				for bone in vertexVertices[i].boneMapping:
-					weight = vertexVertices[i].boneMapping[bone]
-					blenderMeshObject.vertex_groups[vertexGroupIDs[bone]].add((i, ), weight, 'REPLACE')
+			for ((bone, weight), vertexIndices) in vertexBoneWeights.items():
+				blenderMeshObject.vertex_groups[vertexGroupIDs[bone]].add(vertexIndices, weight, 'REPLACE')
 		
 		return meshObjectID
 	
@@ -735,6 +839,10 @@ def simplifyBlenderObjectName(name):
 		return name[:-4]
 	return name
 
+#
+# Returns a tuple (fmdlFile, reports), where reports are the messages of the
+# export extensions for the user, such as vertex cache statistics.
+#
 def exportFmdl(context, rootObjectName, exportSettings = None):
 	def iterateTextureSlots(blenderMaterial):
 		if blenderMaterial.node_tree is not None:
@@ -1408,12 +1516,13 @@ def exportFmdl(context, rootObjectName, exportSettings = None):
 	fmdlFile.meshes = meshes
 	fmdlFile.meshGroups = meshGroups
 	
-	if exportSettings.enableExtensions and exportSettings.enableAntiblur:
-		fmdlFile = FmdlAntiBlur.encodeFmdlAntiBlur(fmdlFile)
-	if exportSettings.enableExtensions and exportSettings.enableVertexLoopPreservation:
-		fmdlFile = FmdlSplitVertexEncoding.encodeFmdlVertexLoopPreservation(fmdlFile)
-	if exportSettings.enableExtensions and exportSettings.enableMeshSplitting:
-		fmdlFile = FmdlMeshSplitting.encodeFmdlSplitMeshes(fmdlFile)
+	(durations, reports) = FmdlExportPipeline.runExportStages(fmdlFile, FmdlExportPipeline.exportStages(
+		exportSettings.enableExtensions and exportSettings.enableAntiblur,
+		exportSettings.enableExtensions and exportSettings.enableVertexLoopPreservation,
+		exportSettings.enableExtensions and exportSettings.enableMeshSplitting,
+		exportSettings.enableVertexCacheOptimization,
+		exportSettings.meshSplittingFragmentStrategy,
+	))
 	
 	errors = []
 	for mesh in fmdlFile.meshes:
@@ -1436,7 +1545,7 @@ def exportFmdl(context, rootObjectName, exportSettings = None):
 	if len(errors) > 0:
 		raise FmdlExportError(errors)
 	
-	return fmdlFile
+	return (fmdlFile, reports)
 
 def exportSummary(context, rootObjectName):
 	def objectName(blenderObject, rootObject):
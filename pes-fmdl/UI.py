@@ -7,7 +7,7 @@ import bpy_extras.io_utils
 import random
 from mathutils import Vector
 
-from . import FmdlFile, Ftex, IO, MaterialPresets, PesSkeletonData
+from . import FmdlFile, FmdlMeshSplitting, Ftex, FtexCache, IO, MaterialPresets, PesSkeletonData
 
 # AddonsPath = str()
 AddonsPath = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
@@ -19,6 +19,11 @@ def node_group():
 		if not NodeTree in bpy.data.node_groups:
 			bpy.ops.wm.append(filepath=os.path.join(base_file_blend, inner_path, NodeTree),directory=os.path.join(base_file_blend, inner_path),filename=NodeTree)
 
+meshSplittingFragmentStrategies = [
+	(FmdlMeshSplitting.FRAGMENT_STRATEGY_SORT_VECTOR, "Sort vector", "Cut each submesh along a sort vector through the whole mesh"),
+	(FmdlMeshSplitting.FRAGMENT_STRATEGY_REGION_GROWING, "Region growing", "Grow each submesh over connected faces, in sort vector order"),
+]
+
 vertexGroupSummaryCache = {}
 
 def vertexGroupSummaryGet(objectName):
@@ -254,7 +259,19 @@ def getDirPath(dirPath):
 			filename, extension = os.path.splitext(fileName)
 			return os.path.dirname(os.path.join(root, filename+extension))
 
-def textureLoad(dirPath):
+def textureCacheDirectory(create):
+	return bpy.utils.user_resource('DATAFILES', path = 'pes-fmdl-texture-cache', create = create)
+
+#
+# Returns the cache of converted ftex textures shared by all blender sessions,
+# holding up to maximumSize megabytes, or None if it is not enabled.
+#
+def textureCache(enabled, maximumSize):
+	if not enabled:
+		return None
+	return FtexCache.FtexCache(textureCacheDirectory(True), maximumSize * 1024 * 1024)
+
+def textureLoad(dirPath, cache = None):
 	for root, directories, filenames in os.walk(dirPath):
 		for fileName in filenames:
 			filename, extension = os.path.splitext(fileName)
@@ -263,7 +280,13 @@ def textureLoad(dirPath):
 				ftexPath = os.path.join(root, filename + extension)
 				if not os.path.isfile(ddsPath):
 					try:
-						Ftex.ftexToDds(ftexPath, ddsPath)
+						if cache == None:
+							Ftex.ftexToDds(ftexPath, ddsPath)
+						else:
+							ddsData = cache.ddsBuffer(ftexPath)
+							if ddsData != None:
+								with open(ddsPath, 'wb') as stream:
+									stream.write(ddsData)
 					except Exception as msg:
 						print(format(msg))
 				
@@ -280,6 +303,8 @@ class FMDL_Scene_Import(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
 	mesh_splitting : bpy.props.BoolProperty(name = "Autosplit overlarge meshes", default = True)
 	load_textures : bpy.props.BoolProperty(name = "Load textures", default = True)
 	import_all_bounding_boxes : bpy.props.BoolProperty(name = "Import all bounding boxes", default = False)
+	texture_cache : bpy.props.BoolProperty(name = "Cache converted textures", description = "Keep textures converted from FTEX in the blender user data directory, so that later imports in any session do not convert them again", default = False)
+	pack_textures : bpy.props.BoolProperty(name = "Pack textures into .blend", description = "Store textures converted from FTEX in the .blend file, which grows by the size of their DDS data. Textures that are not packed have to be loaded again after reopening the .blend file", default = True)
 	
 	import_label = "PES FMDL (.fmdl)"
 	
@@ -293,19 +318,22 @@ class FMDL_Scene_Import(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
 		self.mesh_splitting = context.scene.fmdl_import_mesh_splitting
 		self.load_textures = context.scene.fmdl_import_load_textures
 		self.import_all_bounding_boxes = context.scene.fmdl_import_all_bounding_boxes
+		self.texture_cache = context.scene.fmdl_import_texture_cache
+		self.pack_textures = context.scene.fmdl_import_pack_textures
 		return bpy_extras.io_utils.ImportHelper.invoke(self, context, event)
 	
 	def execute(self, context):
 		node_group()
 		filename = self.filepath
 		getTextureDir = str()
+		cache = textureCache(self.texture_cache, context.scene.fmdl_import_texture_cache_size)
 		if context.scene.fmdl_import_load_textures:
 			textureDir = f"{findDirectory(os.path.dirname(filename))}"
 			win11Dir = str(findTextureDirectory(textureDir))
 			if os.path.exists(win11Dir):
 				getTextureDir = getDirPath(win11Dir)
 			if os.path.exists(getTextureDir):
-				textureLoad(getTextureDir)
+				textureLoad(getTextureDir, cache)
 
 		importSettings = IO.ImportSettings()
 		importSettings.enableExtensions = self.extensions_enabled
@@ -315,9 +343,15 @@ class FMDL_Scene_Import(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
 		importSettings.enableLoadTextures = self.load_textures
 		importSettings.enableImportAllBoundingBoxes = self.import_all_bounding_boxes
 		importSettings.texturePath = bpy.app.tempdir
+		importSettings.textureCache = cache
+		importSettings.packTextures = self.pack_textures
 		
+		#
+		# Read meshes as arrays, so that extensions are decoded and blender
+		# meshes are built without creating a Vertex object for each vertex.
+		#
 		fmdlFile = FmdlFile.FmdlFile()
-		fmdlFile.readFile(filename)
+		fmdlFile.readFile(filename, columnar = True)
 		
 		rootObject = IO.importFmdl(context, fmdlFile, filename, importSettings)
 		
@@ -338,6 +372,8 @@ class FMDL_Scene_Export_Scene(bpy.types.Operator, bpy_extras.io_utils.ExportHelp
 	antiblur : bpy.props.BoolProperty("Automatic antiblur meshes", default = True)
 	loop_preservation : bpy.props.BoolProperty(name = "Preserve split vertices", default = True)
 	mesh_splitting : bpy.props.BoolProperty(name = "Autosplit overlarge meshes", default = True)
+	mesh_splitting_fragment_strategy : bpy.props.EnumProperty(name = "Autosplit strategy", items = meshSplittingFragmentStrategies, default = FmdlMeshSplitting.FRAGMENT_STRATEGY_SORT_VECTOR)
+	vertex_cache_optimization : bpy.props.BoolProperty(name = "Optimize face order for vertex cache", default = False)
 	
 	export_label = "PES FMDL (.fmdl)"
 	
@@ -354,9 +390,11 @@ class FMDL_Scene_Export_Scene(bpy.types.Operator, bpy_extras.io_utils.ExportHelp
 		exportSettings.enableAntiblur = self.antiblur
 		exportSettings.enableVertexLoopPreservation = self.loop_preservation
 		exportSettings.enableMeshSplitting = self.mesh_splitting
+		exportSettings.meshSplittingFragmentStrategy = self.mesh_splitting_fragment_strategy
+		exportSettings.enableVertexCacheOptimization = self.vertex_cache_optimization
 		
 		try:
-			fmdlFile = IO.exportFmdl(context, None, exportSettings)
+			(fmdlFile, reports) = IO.exportFmdl(context, None, exportSettings)
 		except IO.FmdlExportError as error:
 			self.report({'ERROR'}, "Error exporting Fmdl: " + "; ".join(error.errors))
 			print("Error exporting Fmdl:\n" + "\n".join(error.errors))
@@ -364,6 +402,8 @@ class FMDL_Scene_Export_Scene(bpy.types.Operator, bpy_extras.io_utils.ExportHelp
 		
 		fmdlFile.writeFile(self.filepath)
 		
+		for report in reports:
+			self.report({'INFO'}, report.rstrip())
 		self.report({'INFO'}, "Fmdl exported successfully.") 
 		
 		return {'FINISHED'}
@@ -379,6 +419,8 @@ class FMDL_Scene_Export_Object(bpy.types.Operator, bpy_extras.io_utils.ExportHel
 	antiblur : bpy.props.BoolProperty(name = "Automatic antiblur meshes", default = True)
 	loop_preservation : bpy.props.BoolProperty(name = "Preserve split vertices", default = True)
 	mesh_splitting : bpy.props.BoolProperty(name = "Autosplit overlarge meshes", default = True)
+	mesh_splitting_fragment_strategy : bpy.props.EnumProperty(name = "Autosplit strategy", items = meshSplittingFragmentStrategies, default = FmdlMeshSplitting.FRAGMENT_STRATEGY_SORT_VECTOR)
+	vertex_cache_optimization : bpy.props.BoolProperty(name = "Optimize face order for vertex cache", default = False)
 	
 	export_label = "PES FMDL (.fmdl)"
 	
@@ -395,6 +437,8 @@ class FMDL_Scene_Export_Object(bpy.types.Operator, bpy_extras.io_utils.ExportHel
 		self.antiblur = context.active_object.fmdl_export_antiblur
 		self.loop_preservation = context.active_object.fmdl_export_loop_preservation
 		self.mesh_splitting = context.active_object.fmdl_export_mesh_splitting
+		self.mesh_splitting_fragment_strategy = context.active_object.fmdl_export_mesh_splitting_fragment_strategy
+		self.vertex_cache_optimization = context.active_object.fmdl_export_vertex_cache_optimization
 		if context.active_object.fmdl_filename != "":
 			self.filepath = context.active_object.fmdl_filename
 		return bpy_extras.io_utils.ExportHelper.invoke(self, context, event)
@@ -409,9 +453,11 @@ class FMDL_Scene_Export_Object(bpy.types.Operator, bpy_extras.io_utils.ExportHel
 		exportSettings.enableAntiblur = self.antiblur
 		exportSettings.enableVertexLoopPreservation = self.loop_preservation
 		exportSettings.enableMeshSplitting = self.mesh_splitting
+		exportSettings.meshSplittingFragmentStrategy = self.mesh_splitting_fragment_strategy
+		exportSettings.enableVertexCacheOptimization = self.vertex_cache_optimization
 		
 		try:
-			fmdlFile = IO.exportFmdl(context, self.objectName, exportSettings)
+			(fmdlFile, reports) = IO.exportFmdl(context, self.objectName, exportSettings)
 		except IO.FmdlExportError as error:
 			self.report({'ERROR'}, "Error exporting Fmdl: " + "; ".join(error.errors))
 			print("Error exporting Fmdl:\n" + "\n".join(error.errors))
@@ -419,6 +465,8 @@ class FMDL_Scene_Export_Object(bpy.types.Operator, bpy_extras.io_utils.ExportHel
 		
 		fmdlFile.writeFile(self.filepath)
 		
+		for report in reports:
+			self.report({'INFO'}, report.rstrip())
 		self.report({'INFO'}, "Fmdl exported successfully.") 
 		
 		return {'FINISHED'}
@@ -442,6 +490,21 @@ class FMDL_Scene_Export_Object_Summary(bpy.types.Operator):
 		showExportSummary(area, self.objectName)
 		return {'FINISHED'}
 
+class FMDL_Scene_Clear_Texture_Cache(bpy.types.Operator):
+	"""Remove all textures from the cache of converted FTEX textures"""
+	bl_idname = "fmdl.clear_texture_cache"
+	bl_label = "Clear texture cache"
+	bl_options = {'REGISTER'}
+	
+	def execute(self, context):
+		directory = textureCacheDirectory(False)
+		if os.path.isdir(directory):
+			removedSize = FtexCache.FtexCache(directory, 0).clear()
+		else:
+			removedSize = 0
+		self.report({'INFO'}, "Removed %.1f MB of cached textures." % (removedSize / (1024 * 1024)))
+		return {'FINISHED'}
+
 class FMDL_MT_Scene_Panel_FMDL_Import_Settings(bpy.types.Menu):
 	"""Import Settings"""
 	bl_label = "Import settings"
@@ -466,6 +529,18 @@ class FMDL_MT_Scene_Panel_FMDL_Import_Settings(bpy.types.Menu):
 		
 		row = self.layout.row()
 		row.prop(context.scene, 'fmdl_import_all_bounding_boxes')
+		
+		row = self.layout.row()
+		row.prop(context.scene, 'fmdl_import_pack_textures')
+		row.enabled = context.scene.fmdl_import_load_textures
+		
+		self.layout.prop(context.scene, 'fmdl_import_texture_cache')
+		
+		row = self.layout.row()
+		row.prop(context.scene, 'fmdl_import_texture_cache_size')
+		row.enabled = context.scene.fmdl_import_texture_cache
+		
+		self.layout.operator(FMDL_Scene_Clear_Texture_Cache.bl_idname)
 
 class FMDL_Scene_Panel_FMDL_Compose(bpy.types.Operator):
 	"""Enable separate exporting of the active object"""
@@ -508,6 +583,10 @@ class FMDL_MT_Scene_Panel_FMDL_Export_Settings(bpy.types.Menu):
 		row = self.layout.row()
 		row.prop(context.active_object, 'fmdl_export_mesh_splitting')
 		row.enabled = context.active_object.fmdl_export_extensions_enabled
+		row = self.layout.row()
+		row.prop(context.active_object, 'fmdl_export_mesh_splitting_fragment_strategy')
+		row.enabled = context.active_object.fmdl_export_extensions_enabled and context.active_object.fmdl_export_mesh_splitting
+		self.layout.prop(context.active_object, 'fmdl_export_vertex_cache_optimization')
 
 class FMDL_Scene_Panel_FMDL_Select_Filename(bpy.types.Operator):
 	"""Select a filename to export this FMDL file"""
@@ -585,6 +664,8 @@ class FMDL_PT_Scene_Panel(bpy.types.Panel):
 			exportSettings.antiblur = object.fmdl_export_antiblur
 			exportSettings.loop_preservation = object.fmdl_export_loop_preservation
 			exportSettings.mesh_splitting = object.fmdl_export_mesh_splitting
+			exportSettings.mesh_splitting_fragment_strategy = object.fmdl_export_mesh_splitting_fragment_strategy
+			exportSettings.vertex_cache_optimization = object.fmdl_export_vertex_cache_optimization
 			if object.fmdl_filename == "":
 				subrow.enabled = False
 			row.operator(FMDL_Scene_Export_Object_Summary.bl_idname, text = "", icon = 'INFO').objectName = object.name
@@ -1527,14 +1608,14 @@ class FMDL_Texture_Load_Ftex(bpy.types.Operator):
 			texture != None and
 			texture.type == 'IMAGE' and
 			texture.image != None and
-			texture.image.filepath.lower().endswith('.ftex')
+			Ftex.blenderImageFtexFilename(texture.image) != None
 		)
 	
 	def execute(self, context):
 		# Avoids a blender bug in which an invalid image can't be replaced with a valid one
 		context.texture.image_user.use_auto_refresh = context.texture.image_user.use_auto_refresh
 		
-		Ftex.blenderImageLoadFtex(context.texture.image, bpy.app.tempdir)
+		Ftex.blenderImageLoadFtex(context.texture.image, cache = textureCache(context.scene.fmdl_import_texture_cache, context.scene.fmdl_import_texture_cache_size), packImage = context.scene.fmdl_import_pack_textures)
 		return {'FINISHED'}
 
 def FMDL_Texture_Load_Ftex_Button(self, context):
@@ -1610,6 +1691,7 @@ classes = [
 	FMDL_Scene_Export_Scene,
 	FMDL_Scene_Export_Object,
 	FMDL_Scene_Export_Object_Summary,
+	FMDL_Scene_Clear_Texture_Cache,
 	FMDL_MT_Scene_Panel_FMDL_Import_Settings,
 	FMDL_Scene_Panel_FMDL_Compose,
 	FMDL_OT_remove_exportable,
@@ -1670,12 +1752,17 @@ def register():
 	bpy.types.Object.fmdl_export_antiblur = bpy.props.BoolProperty("Automatic antiblur meshes", default = True)
 	bpy.types.Object.fmdl_export_loop_preservation = bpy.props.BoolProperty(name = "Preserve split vertices", default = True)
 	bpy.types.Object.fmdl_export_mesh_splitting = bpy.props.BoolProperty(name = "Autosplit overlarge meshes", default = True)
+	bpy.types.Object.fmdl_export_mesh_splitting_fragment_strategy = bpy.props.EnumProperty(name = "Autosplit strategy", items = meshSplittingFragmentStrategies, default = FmdlMeshSplitting.FRAGMENT_STRATEGY_SORT_VECTOR)
+	bpy.types.Object.fmdl_export_vertex_cache_optimization = bpy.props.BoolProperty(name = "Optimize face order for vertex cache", default = False)
 	bpy.types.Scene.fmdl_import_extensions_enabled = bpy.props.BoolProperty(name = "Enable blender-pes-fmdl extensions", default = True)
 	bpy.types.Scene.fmdl_import_antiblur = bpy.props.BoolProperty(name = "Automatic antiblur meshes", default = True)
 	bpy.types.Scene.fmdl_import_loop_preservation = bpy.props.BoolProperty(name = "Preserve split vertices", default = True)
 	bpy.types.Scene.fmdl_import_mesh_splitting = bpy.props.BoolProperty(name = "Autosplit overlarge meshes", default = True)
 	bpy.types.Scene.fmdl_import_load_textures = bpy.props.BoolProperty(name = "Load textures", default = True)
 	bpy.types.Scene.fmdl_import_all_bounding_boxes = bpy.props.BoolProperty(name = "Import all bounding boxes", default = False)
+	bpy.types.Scene.fmdl_import_pack_textures = bpy.props.BoolProperty(name = "Pack textures into .blend", description = "Store textures converted from FTEX in the .blend file, which grows by the size of their DDS data. Textures that are not packed have to be loaded again after reopening the .blend file", default = True)
+	bpy.types.Scene.fmdl_import_texture_cache = bpy.props.BoolProperty(name = "Cache converted textures", description = "Keep textures converted from FTEX in the blender user data directory, so that later imports in any session do not convert them again", default = False)
+	bpy.types.Scene.fmdl_import_texture_cache_size = bpy.props.IntProperty(name = "Texture cache size (MB)", default = 512, min = 0)
 	bpy.types.Scene.fmdl_skeleton_type = bpy.props.EnumProperty(name = "Skeleton type",
 		items = skeletonTypes,
 		default = defaultSkeletonType,